@@ -0,0 +1,202 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import struct
+import datetime
+import zipfile
+
+from wallflower_schema import c_type_info, getStructCode
+
+'''
+Binary points are fixed-width little-endian records, packed with struct
+using standard sizes. Each record is the point timestamp, as a signed 64-bit
+count of microseconds since 1970-01-01T00:00:00Z, followed by the point
+value(s) using the struct code of the stream points-type. Streams with
+points-length N have N values per record, otherwise one. Variable length
+strings ('s') have no fixed width and can not be packed.
+'''
+
+epoch = datetime.datetime(1970,1,1)
+datetime_format_full = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+class BinaryPointsError(Exception):
+    pass
+    
+'''
+Return the struct format of one record for the points details.
+'''
+def getRecordFormat(points_details):
+    code = getStructCode( points_details['points-type'] )
+    if code not in c_type_info or code == 's':
+        raise BinaryPointsError('Points type '+str(code)+' has no binary encoding')
+    length = points_details['points-length']
+    return '<q' + code * max(length,1)
+    
+'''
+Convert a datetime to microseconds since the epoch.
+'''
+def datetimeToMicroseconds(timestamp):
+    delta = timestamp - epoch
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    
+'''
+Convert microseconds since the epoch to a datetime.
+'''
+def microsecondsToDatetime(microseconds):
+    return epoch + datetime.timedelta(microseconds=microseconds)
+    
+'''
+Convert an ISO 8601 timestamp to microseconds since the epoch.
+'''
+def timestampToMicroseconds(timestamp):
+    return datetimeToMicroseconds( datetime.datetime.strptime(timestamp,datetime_format_full) )
+    
+'''
+Convert microseconds since the epoch to an ISO 8601 timestamp.
+'''
+def microsecondsToTimestamp(microseconds):
+    return microsecondsToDatetime(microseconds).strftime(datetime_format_full)
+
+'''
+Pack a list of points into binary records.
+'''
+def packPoints(points,points_details):
+    record = struct.Struct( getRecordFormat(points_details) )
+    multiple = points_details['points-length'] > 0
+    data = []
+    try:
+        for point in points:
+            if multiple:
+                data.append( record.pack(
+                    timestampToMicroseconds(point['at']), *point['value']
+                ) )
+            else:
+                data.append( record.pack(
+                    timestampToMicroseconds(point['at']), point['value']
+                ) )
+    except (struct.error, ValueError, TypeError), err:
+        raise BinaryPointsError('Points can not be packed: '+str(err))
+    return ''.join(data)
+    
+'''
+Unpack binary records into a list of points.
+'''
+def unpackPoints(data,points_details):
+    record = struct.Struct( getRecordFormat(points_details) )
+    multiple = points_details['points-length'] > 0
+    if len(data) % record.size != 0:
+        raise BinaryPointsError(
+            'Binary points length is not a multiple of '+str(record.size)+' bytes'
+        )
+    points = []
+    try:
+        for offset in xrange(0,len(data),record.size):
+            values = record.unpack_from(data,offset)
+            if multiple:
+                value = list(values[1:])
+            else:
+                value = values[1]
+            points.append({
+                'at': microsecondsToTimestamp(values[0]),
+                'value': value
+            })
+    except (struct.error, OverflowError), err:
+        raise BinaryPointsError('Binary points can not be unpacked: '+str(err))
+    return points
+
+'''
+Columnar points are NumPy NPY arrays (format version 1.0), one per column, 
+stored in an NPZ (zip) archive. Timestamps are the 'at' column of 
+datetime64[us] values and values are the 'value' column, or the 
+'value0' ... 'valueN-1' columns of streams with points-length N. 
+The arrays are written directly, so NumPy is only needed to read them.
+'''
+
+numpy_descr = {
+    'b': '|i1',
+    '?': '|b1',
+    'B': '|u1',
+    'h': '<i2',
+    'H': '<u2',
+    'i': '<i4',
+    'I': '<u4',
+    'q': '<i8',
+    'Q': '<u8',
+    'f': '<f4',
+    'd': '<f8'
+}
+timestamp_descr = '<M8[us]'
+
+'''
+Return the struct code and NumPy descr of the value columns.
+'''
+def getColumnFormat(points_details):
+    code = getStructCode( points_details['points-type'] )
+    if code not in numpy_descr:
+        raise BinaryPointsError('Points type '+str(code)+' has no columnar encoding')
+    return code, numpy_descr[code]
+    
+'''
+Pack a sequence of values into a contiguous little-endian column.
+'''
+def packColumn(code,values):
+    try:
+        return struct.pack( '<'+str(len(values))+code, *values )
+    except struct.error, err:
+        raise BinaryPointsError('Column can not be packed: '+str(err))
+        
+'''
+Pack a sequence of datetimes into a column of microseconds since the epoch.
+'''
+def packTimestampColumn(timestamps):
+    return packColumn('q',[ datetimeToMicroseconds(timestamp) for timestamp in timestamps ])
+    
+'''
+Return the NPY file contents of a one dimensional array.
+'''
+def npyArray(descr,count,data):
+    header = "{'descr': '"+descr+"', 'fortran_order': False, 'shape': ("+str(count)+",), }"
+    # Pad the header with spaces so that the data is 16 byte aligned
+    padding = 16 - (10 + len(header) + 1) % 16
+    header = header + ' ' * (padding % 16) + '\n'
+    return '\x93NUMPY\x01\x00' + struct.pack('<H',len(header)) + header + data
+    
+'''
+Write (name, descr, count, data) columns to a file as an NPZ archive.
+The arrays are stored uncompressed, as by numpy.savez.
+'''
+def writeNPZ(fileobj,columns):
+    archive = zipfile.ZipFile(fileobj,'w',zipfile.ZIP_STORED,allowZip64=True)
+    try:
+        for name, descr, count, data in columns:
+            archive.writestr( name+'.npy', npyArray(descr,count,data) )
+    finally:
+        archive.close()
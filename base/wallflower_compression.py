@@ -0,0 +1,387 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import struct
+
+'''
+Compressed points chunks, after the Gorilla time series encoding. 
+Timestamps, in microseconds since the epoch, are stored as the first 
+timestamp, the first delta, and then the delta of each delta in a 
+variable number of bits. Float values are stored as the XOR of each 
+value with the previous value, as the meaningful bits only. Integer 
+values are stored as zigzag varints of the delta from the previous 
+value. Bool values are stored as one bit and string values as utf-8 
+with a varint length. Each column of the chunk is a separate bit 
+stream, so that columns can be decoded independently.
+
+Chunk layout:
+    version (1 byte), value kind (1 byte), count (varint), 
+    column count (varint), then for the timestamp column and each 
+    value column: byte length (varint) and the column bit stream.
+'''
+
+chunk_version = 1
+
+class CompressionError(Exception):
+    pass
+    
+'''
+Write bits, most significant first.
+'''
+class BitWriter(object):
+    
+    def __init__(self):
+        self.data = bytearray()
+        self.buffer = 0
+        self.bits = 0
+        
+    def write(self,value,bits):
+        self.buffer = (self.buffer << bits) | (value & ((1 << bits) - 1))
+        self.bits += bits
+        while self.bits >= 8:
+            self.bits -= 8
+            self.data.append( (self.buffer >> self.bits) & 0xFF )
+        self.buffer &= (1 << self.bits) - 1
+        
+    def writeBytes(self,value):
+        if self.bits == 0:
+            self.data.extend(value)
+        else:
+            for byte in bytearray(value):
+                self.write( byte, 8 )
+        
+    def writeVarint(self,value):
+        while value > 0x7F:
+            self.write( (value & 0x7F) | 0x80, 8 )
+            value >>= 7
+        self.write( value, 8 )
+        
+    def getvalue(self):
+        data = bytearray(self.data)
+        if self.bits > 0:
+            data.append( (self.buffer << (8 - self.bits)) & 0xFF )
+        return str(data)
+        
+'''
+Read bits, most significant first.
+'''
+class BitReader(object):
+    
+    def __init__(self,data):
+        self.data = bytearray(data)
+        self.position = 0
+        self.buffer = 0
+        self.bits = 0
+        
+    def read(self,bits):
+        while self.bits < bits:
+            if self.position >= len(self.data):
+                raise CompressionError('Chunk ended unexpectedly')
+            self.buffer = (self.buffer << 8) | self.data[self.position]
+            self.position += 1
+            self.bits += 8
+        self.bits -= bits
+        value = self.buffer >> self.bits
+        self.buffer &= (1 << self.bits) - 1
+        return value
+        
+    def readBytes(self,length):
+        if self.bits == 0:
+            value = self.data[self.position:self.position+length]
+            if len(value) < length:
+                raise CompressionError('Chunk ended unexpectedly')
+            self.position += length
+            return str(value)
+        return str(bytearray( self.read(8) for i in xrange(length) ))
+        
+    def readVarint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.read(8)
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+    
+def zigzag(value):
+    if value < 0:
+        return (-value << 1) - 1
+    return value << 1
+    
+def unzigzag(value):
+    if value & 1:
+        return -((value + 1) >> 1)
+    return value >> 1
+    
+def signed(value,bits):
+    if value >= 1 << (bits - 1):
+        return value - (1 << bits)
+    return value
+    
+# Delta of delta buckets, (prefix, prefix bits, value bits)
+delta_buckets = [
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b11110, 5, 32),
+    (0b11111, 5, 64)
+]
+
+'''
+Encode timestamps, in microseconds, as delta of deltas.
+'''
+def encodeTimestamps(timestamps):
+    writer = BitWriter()
+    previous = 0
+    previous_delta = 0
+    for i in xrange(len(timestamps)):
+        if i == 0:
+            writer.write( timestamps[0], 64 )
+        elif i == 1:
+            previous_delta = timestamps[1] - timestamps[0]
+            writer.write( zigzag(previous_delta), 64 )
+        else:
+            delta = timestamps[i] - previous
+            delta_of_delta = delta - previous_delta
+            previous_delta = delta
+            if delta_of_delta == 0:
+                writer.write( 0, 1 )
+            else:
+                for prefix, prefix_bits, bits in delta_buckets:
+                    if -(1 << (bits - 1)) <= delta_of_delta < (1 << (bits - 1)):
+                        writer.write( prefix, prefix_bits )
+                        writer.write( delta_of_delta, bits )
+                        break
+        previous = timestamps[i]
+    return writer.getvalue()
+    
+'''
+Decode count timestamps encoded by encodeTimestamps.
+'''
+def decodeTimestamps(data,count):
+    reader = BitReader(data)
+    timestamps = []
+    if count == 0:
+        return timestamps
+    previous = signed( reader.read(64), 64 )
+    timestamps.append( previous )
+    if count == 1:
+        return timestamps
+    delta = unzigzag( reader.read(64) )
+    previous += delta
+    timestamps.append( previous )
+    for i in xrange(2,count):
+        if reader.read(1) == 1:
+            # Count the ones of the bucket prefix. The last
+            # prefix has no terminating zero.
+            ones = 1
+            while ones < len(delta_buckets) and reader.read(1) == 1:
+                ones += 1
+            bits = delta_buckets[ones-1][2]
+            delta += signed( reader.read(bits), bits )
+        previous += delta
+        timestamps.append( previous )
+    return timestamps
+    
+'''
+Encode floats as the XOR of the IEEE 754 double bits of each value with 
+the previous value. Only the meaningful bits are written, reusing the 
+leading and trailing zero window of the previous value when it fits.
+'''
+def encodeFloats(values):
+    writer = BitWriter()
+    pack = struct.Struct('<d').pack
+    unpack = struct.Struct('<Q').unpack
+    previous = 0
+    leading = -1
+    trailing = 0
+    for i in xrange(len(values)):
+        bits = unpack( pack(values[i]) )[0]
+        if i == 0:
+            writer.write( bits, 64 )
+        else:
+            xor = bits ^ previous
+            if xor == 0:
+                writer.write( 0, 1 )
+            else:
+                value_leading = 64 - xor.bit_length()
+                value_trailing = (xor & -xor).bit_length() - 1
+                if leading >= 0 and value_leading >= leading and value_trailing >= trailing:
+                    # Fits the previous window
+                    writer.write( 0b10, 2 )
+                    writer.write( xor >> trailing, 64 - leading - trailing )
+                else:
+                    leading = min(value_leading,31)
+                    trailing = value_trailing
+                    meaningful = 64 - leading - trailing
+                    writer.write( 0b11, 2 )
+                    writer.write( leading, 5 )
+                    # A length of 64 is written as 0
+                    writer.write( meaningful & 0x3F, 6 )
+                    writer.write( xor >> trailing, meaningful )
+        previous = bits
+    return writer.getvalue()
+    
+'''
+Decode count floats encoded by encodeFloats.
+'''
+def decodeFloats(data,count):
+    reader = BitReader(data)
+    pack = struct.Struct('<Q').pack
+    unpack = struct.Struct('<d').unpack
+    values = []
+    if count == 0:
+        return values
+    previous = reader.read(64)
+    values.append( unpack(pack(previous))[0] )
+    leading = 0
+    trailing = 0
+    for i in xrange(1,count):
+        if reader.read(1) == 1:
+            if reader.read(1) == 1:
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        values.append( unpack(pack(previous))[0] )
+    return values
+    
+'''
+Encode integers as zigzag varints of the delta from the previous value.
+'''
+def encodeIntegers(values):
+    writer = BitWriter()
+    previous = 0
+    for value in values:
+        writer.writeVarint( zigzag(value - previous) )
+        previous = value
+    return writer.getvalue()
+    
+'''
+Decode count integers encoded by encodeIntegers.
+'''
+def decodeIntegers(data,count):
+    reader = BitReader(data)
+    values = []
+    previous = 0
+    for i in xrange(count):
+        previous += unzigzag( reader.readVarint() )
+        values.append( previous )
+    return values
+    
+'''
+Encode bools as one bit each.
+'''
+def encodeBools(values):
+    writer = BitWriter()
+    for value in values:
+        writer.write( 1 if value else 0, 1 )
+    return writer.getvalue()
+    
+'''
+Decode count bools encoded by encodeBools.
+'''
+def decodeBools(data,count):
+    reader = BitReader(data)
+    return [ reader.read(1) == 1 for i in xrange(count) ]
+    
+'''
+Encode strings as utf-8 with a varint length.
+'''
+def encodeStrings(values):
+    writer = BitWriter()
+    for value in values:
+        if isinstance(value,unicode):
+            value = value.encode('utf-8')
+        writer.writeVarint( len(value) )
+        writer.writeBytes( value )
+    return writer.getvalue()
+    
+'''
+Decode count strings encoded by encodeStrings.
+'''
+def decodeStrings(data,count):
+    reader = BitReader(data)
+    values = []
+    for i in xrange(count):
+        length = reader.readVarint()
+        values.append( reader.readBytes(length).decode('utf-8') )
+    return values
+    
+# Value kinds, by Python type
+value_kinds = {
+    float: (0, encodeFloats, decodeFloats),
+    int: (1, encodeIntegers, decodeIntegers),
+    bool: (2, encodeBools, decodeBools),
+    basestring: (3, encodeStrings, decodeStrings)
+}
+value_kinds_by_id = dict( (kind[0], kind) for kind in value_kinds.values() )
+
+'''
+Encode a chunk of points. timestamps is a list of microseconds since 
+the epoch and columns is a list of value lists, one for each value of 
+the points. python_type is the type of the stream values.
+'''
+def encodeChunk(python_type,timestamps,columns):
+    if python_type not in value_kinds:
+        raise CompressionError('Points type '+str(python_type)+' can not be compressed')
+    kind, encode, decode = value_kinds[python_type]
+    sections = [ encodeTimestamps(timestamps) ]
+    try:
+        for column in columns:
+            sections.append( encode(column) )
+    except (TypeError, ValueError, struct.error), err:
+        raise CompressionError('Points can not be compressed: '+str(err))
+    writer = BitWriter()
+    writer.write( chunk_version, 8 )
+    writer.write( kind, 8 )
+    writer.writeVarint( len(timestamps) )
+    writer.writeVarint( len(columns) )
+    for section in sections:
+        writer.writeVarint( len(section) )
+    return writer.getvalue() + ''.join(sections)
+    
+'''
+Decode a chunk. Returns the timestamps and the value columns.
+'''
+def decodeChunk(data):
+    reader = BitReader(data)
+    if reader.read(8) != chunk_version:
+        raise CompressionError('Unknown chunk version')
+    kind, encode, decode = value_kinds_by_id[ reader.read(8) ]
+    count = reader.readVarint()
+    column_count = reader.readVarint()
+    lengths = [ reader.readVarint() for i in xrange(column_count + 1) ]
+    sections = [ reader.readBytes(length) for length in lengths ]
+    timestamps = decodeTimestamps(sections[0],count)
+    columns = [ decode(section,count) for section in sections[1:] ]
+    return timestamps, columns
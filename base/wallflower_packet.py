@@ -359,7 +359,7 @@ class WallflowerMultiplePackets(WallflowerPacketBase):
     '''
     def hasPointsRequest(self, network_id, object_id, stream_id):
         try:
-            assert self.request_type in ['update','read','search']
+            assert self.request_type in ['update','read','delete','search']
             #points_request = copy.deepcopy( 
             #    self.validated_packet['objects'][object_id]['streams'][stream_id]['points']
             #)
@@ -106,6 +106,11 @@ def getPythonType(data_type):
     elif isinstance(data_type,int):
         return c_type_info[WallflowerSchema().data_type_list[data_type]]['python_type']
     return int
+
+def getStructCode(data_type):
+    if isinstance(data_type,int):
+        data_type = WallflowerSchema().data_type_list[data_type]
+    return data_type
         
 class SchemaError(Exception):
 
@@ -583,6 +588,18 @@ class WallflowerSchema():
     points_details_create = Schema({
         'points-type': data_type,
         'points-length': int,
+        Optional('points-storage'): And(
+            basestring, In(['table','segment']),
+            error='Invalid points storage'
+        ),
+        Optional('points-encoding'): And(
+            basestring, In(['plain','dictionary']),
+            error='Invalid points encoding'
+        ),
+        Optional('points-conflict'): And(
+            basestring, In(['reject','ignore','overwrite']),
+            error='Invalid points conflict policy'
+        ),
         Optional(basestring,priority=5): object
     }, error = 'Invalid points details')
     
@@ -819,6 +836,13 @@ class WallflowerSchema():
     }, error = 'Invalid stream search request')
     
     points_search = Schema({
+        Optional('since'): And(
+            basestring,
+            Or(
+                Timestamp(datetime_format_full),
+                Timestamp(datetime_format_min)
+            )
+        ),
         Optional('start'): And(
             basestring,
             Or(
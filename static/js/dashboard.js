@@ -29,6 +29,11 @@
 var network_id = 'local';
 var network = {};
 var view_stream = [];
+// Newest point received for each stream, used for points-since requests
+var points_cursor = {};
+// Stream currently held by the points plot and points table
+var plot_stream = null;
+var table_stream = null;
 
 var custom_sidebar_link_callback, ws_callback;
 
@@ -1361,7 +1366,10 @@ $(document).ready(function(){
           // Start Success message
           message.addClass('alert-success');
           message.append("<h4>Success!</h4>");
-          req.css({ 'color': '#3c763d' });          
+          req.css({ 'color': '#3c763d' });
+          
+          // Points were removed, so the next view must be a full reload
+          delete points_cursor[network_id+'.'+object_id+'.'+stream_id];
         }else{
           // Start Danger message
           message.addClass('alert-danger');
@@ -1665,6 +1673,9 @@ function doDeleteStream( response ){
   // Delete stream from client-side record
   delete network['objects'][response['object-id']]['streams'][response['stream-id']];
   
+  // Forget the newest point received for the stream
+  delete points_cursor[response['network-id']+'.'+response['object-id']+'.'+response['stream-id']];
+  
   // TODO: If user is viewing stream when deleted
   
   // Reload the stream and points delete forms
@@ -2238,17 +2249,33 @@ function loadPointsPlot(){
 //
 //  Function reloading the points plot
 //  by retrieving most recent data from WCC server. 
+//  Once the plot holds a stream, only points newer than 
+//  the last received point are requested.
 //
 function reloadPointsPlot( network_id, object_id, stream_id ){
+  var stream_key = network_id+'.'+object_id+'.'+stream_id;
+  var streamPlot = $('#page-view-points-plot');
+  var is_delta = ( plot_stream == stream_key && 
+                   points_cursor.hasOwnProperty(stream_key) &&
+                   streamPlot.highcharts().series.length > 0 );
+  
+  var query = 'points-limit=100';
+  if( is_delta ){
+    query = 'points-since='+encodeURIComponent( points_cursor[stream_key] );
+  }
+  
   // Send the request to the WCC server
   $.ajax({
-    url : '/networks/'+network_id+'/objects/'+object_id+'/streams/'+stream_id+'/points?limit=100',
+    url : '/networks/'+network_id+'/objects/'+object_id+'/streams/'+stream_id+'/points?'+query,
     type: "get",
     cache: false,
     data: {},
     success : function(response){
       if( response['points-code'] == 200 ){
         var points = response.points;
+        if( response.hasOwnProperty('points-cursor') ){
+          points_cursor[stream_key] = response['points-cursor'];
+        }
         // Iterate over points to place in Highcharts format
         var datapoints = [];
         for ( var i = 0; i < points.length; i++){
@@ -2258,15 +2285,23 @@ function reloadPointsPlot( network_id, object_id, stream_id ){
         }
         
         // Update Highcharts plot
-        var streamPlot = $('#page-view-points-plot');
-        if( streamPlot.highcharts().series.length > 0 ){
+        if( is_delta ){
+          // Append new points and drop the oldest ones
+          var series = streamPlot.highcharts().series[0];
+          for ( var i = 0; i < datapoints.length; i++){
+            series.addPoint( datapoints[i], false, series.data.length >= 100 );
+          }
+          streamPlot.highcharts().redraw();
+        }else if( streamPlot.highcharts().series.length > 0 ){
           streamPlot.highcharts().series[0].setData( datapoints );
+          streamPlot.highcharts().series[0].update({ name: stream_id });
         }else{
           streamPlot.highcharts().addSeries({
             name: stream_id,
             data: datapoints
           });
         }
+        plot_stream = stream_key;
       }else{
         // Something went wrong
       }
@@ -2281,33 +2316,53 @@ function reloadPointsPlot( network_id, object_id, stream_id ){
 //
 //  Function reloading the points table
 //  by retrieving most recent data from WCC server. 
+//  Once the table holds a stream, only points newer than 
+//  the last received point are requested.
 //
 function reloadPointsTable( network_id, object_id, stream_id ){
   var tbody = $('div#page-view-points-table tbody')
+  var stream_key = network_id+'.'+object_id+'.'+stream_id;
+  var is_delta = ( table_stream == stream_key && 
+                   points_cursor.hasOwnProperty(stream_key) );
+  
+  var query = 'points-limit=20';
+  if( is_delta ){
+    query = 'points-since='+encodeURIComponent( points_cursor[stream_key] );
+  }
+  
   // Send the request to the WCC server
   $.ajax({
-    url : '/networks/'+network_id+'/objects/'+object_id+'/streams/'+stream_id+'/points?limit=20',
+    url : '/networks/'+network_id+'/objects/'+object_id+'/streams/'+stream_id+'/points?'+query,
     type: "get",
     cache: false,
     data: {},
     success : function(response){
-      tbody.html('');
+      if( !is_delta ){
+        tbody.html('');
+      }
       if( response['points-code'] == 200 ){
         var points = response.points;
+        if( response.hasOwnProperty('points-cursor') ){
+          points_cursor[stream_key] = response['points-cursor'];
+        }
         // Iterate over points to populate the table.
+        // New points are placed above existing rows.
+        var rows = '';
         for ( var i = 0; i < points.length; i++){
-          tbody.append(
-            '<tr><td>'+points[i].value+'</td>'+
+          rows += '<tr><td>'+points[i].value+'</td>'+
             '<td>'+points[i].at+'</td>'+
-            '<td>'+(new Date(points[i].at)).toLocaleString()+'</td></tr>'
-          );
+            '<td>'+(new Date(points[i].at)).toLocaleString()+'</td></tr>';
         }
+        tbody.prepend( rows );
+        $('tr:gt(19)', tbody).remove();
+        table_stream = stream_key;
       }else{
         // Something went wrong
       }
     },
     error : function(jqXHR, textStatus, errorThrown){
       tbody.html('');
+      table_stream = null;
       // Called when there is an error
       console.log(jqXHR.message);
     }
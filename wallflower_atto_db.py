@@ -30,27 +30,218 @@
 __version__ = '0.0.1'
 
 import json
-import sys
 import datetime
 import copy
 import re
 import uuid
+import time
+import threading
+import heapq
+import zlib
+import itertools
+import functools
+import contextlib
 
-from base.wallflower_packet import WallflowerPacket
-from base.wallflower_schema import getPythonType
+from base.wallflower_packet import WallflowerPacket, WallflowerMultiplePackets
+from base.wallflower_schema import getPythonType, WallflowerSchema
+from base.wallflower_binary import BinaryPointsError, getColumnFormat, \
+    packColumn, packTimestampColumn, timestamp_descr, \
+    datetimeToMicroseconds, microsecondsToDatetime, getRecordFormat
+from base.wallflower_compression import CompressionError, encodeChunk, decodeChunk
 
-from wallflower_atto_models import Network, Object, Stream, createPointsTable
+from wallflower_atto_models import Network, Object, Stream, PointsChunk, PointsDictionary, \
+    IdempotencyKey, StreamStats, createPointsTable
+from wallflower_atto_segments import SegmentError, SegmentConflictError, SegmentResult
+from wallflower_atto_logging import getLogger
+from wallflower_atto_tracing import no_span
 
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError, IntegrityError
 from sqlalchemy.sql import select
 
-class WallflowerDB:
+'''
+Lets requests wait for new points on a stream. updatePoints notifies
+the stream after each commit and waiting requests are woken without
+polling the database. Only requests served by the same process are
+notified, so a waiting request should still search for points after
+its timeout expires.
+'''
+class WallflowerPointsNotifier(object):
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Update count and condition for each stream, by stream key
+        self.versions = {}
+        self.conditions = {}
+        self.waiters = {}
+        
+    '''
+    Return the update count of the stream. Read the version before
+    searching for points and pass it to wait, so that updates made
+    between the search and the wait are not missed.
+    '''
+    def version(self,key):
+        with self.lock:
+            return self.versions.get(key,0)
+    
+    '''
+    Wake all requests waiting on the stream.
+    '''
+    def notify(self,key):
+        with self.lock:
+            self.versions[key] = self.versions.get(key,0) + 1
+            # Conditions share the lock, which is held here
+            if key in self.conditions:
+                self.conditions[key].notify_all()
+                
+    '''
+    Block until the stream is updated past the given version, or the 
+    timeout (in seconds) expires. Return True if the stream was updated.
+    '''
+    def wait(self,key,version,timeout):
+        with self.lock:
+            if key not in self.conditions:
+                self.conditions[key] = threading.Condition(self.lock)
+                self.waiters[key] = 0
+            condition = self.conditions[key]
+            self.waiters[key] += 1
+            try:
+                end = time.time() + timeout
+                while self.versions.get(key,0) == version:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+                return self.versions.get(key,0) != version
+            finally:
+                self.waiters[key] -= 1
+                if self.waiters[key] == 0:
+                    del self.conditions[key]
+                    del self.waiters[key]
+                    
+    '''
+    Return the number of waiting requests.
+    '''
+    def waiting(self):
+        with self.lock:
+            return sum( self.waiters.values() )
+                    
+
+'''
+In-memory usage counters of the streams, by ids, until they are 
+flushed to the stream_stats table (see WallflowerDB.flushStreamStats).
+Each count is [writes, points written, reads, points read, last write].
+'''
+class WallflowerStreamCounters(object):
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        
+    def add(self,ids,writes=0,points_written=0,reads=0,points_read=0,last_write_at=None):
+        with self.lock:
+            counts = self.counts.get(ids)
+            if counts is None:
+                counts = self.counts[ids] = [0,0,0,0,None]
+            counts[0] += writes
+            counts[1] += points_written
+            counts[2] += reads
+            counts[3] += points_read
+            if last_write_at is not None and (counts[4] is None or last_write_at > counts[4]):
+                counts[4] = last_write_at
+                
+    '''
+    Return the counts and start new ones.
+    '''
+    def take(self):
+        with self.lock:
+            counts = self.counts
+            self.counts = {}
+        return counts
+        
+    '''
+    Add back counts that could not be flushed.
+    '''
+    def restore(self,counts):
+        for ids, (writes, points_written, reads, points_read, last_write_at) in counts.items():
+            self.add(ids,writes,points_written,reads,points_read,last_write_at)
+                    
+
+'''
+Raised when the points of a stream change while they are sealed.
+'''
+class SealConflictError(Exception):
+    pass
+    
+'''
+Raised when a new point has the timestamp of a sealed point.
+'''
+class DuplicatePointsError(Exception):
+    pass
+    
+'''
+Decorator for read-only methods of WallflowerDB. Their queries are 
+sent to the read replica, when one is configured.
+'''
+def replicaRead(method):
+    @functools.wraps(method)
+    def routed(self,*args,**kwargs):
+        with self.readReplica():
+            return method(self,*args,**kwargs)
+    return routed
+    
+'''
+Decorator for the request methods of WallflowerDB. Counts and times 
+requests by level, type, and result code. Level is the request_level 
+argument unless given.
+'''
+def measured(level=None):
+    def decorator(method):
+        @functools.wraps(method)
+        def timed(self,request,request_type,*args,**kwargs):
+            if self.metrics is None:
+                return method(self,request,request_type,*args,**kwargs)
+            start = time.time()
+            result = method(self,request,request_type,*args,**kwargs)
+            request_level = level or args[0]
+            labels = (('level',request_level),('type',request_type))
+            self.metrics.observe( 'wallflower_db_request_duration_seconds', time.time()-start, labels )
+            self.metrics.inc( 'wallflower_db_requests_total', 
+                labels+(('code',self.db_message.get(request_level+'-code',0)),) )
+            return result
+        return timed
+    return decorator
+    
+'''
+Record a db.do span of a request of WallflowerDB, if tracing is enabled.
+Level is the request level, or taken from the arguments.
+'''
+def traced(level=None):
+    def decorator(method):
+        @functools.wraps(method)
+        def span(self,request,request_type,*args,**kwargs):
+            if self.tracer is None:
+                return method(self,request,request_type,*args,**kwargs)
+            with self.span('db.do',{'db.level': level or args[0], 'db.type': request_type}):
+                return method(self,request,request_type,*args,**kwargs)
+        return span
+    return decorator
+    
+'''
+Raised when a stream can not use dictionary encoding, or when the 
+codes of new values can not be added.
+'''
+class DictionaryError(Exception):
+    pass
+    
+
+class WallflowerDB(object):
     
     datetime_format_full = '%Y-%m-%dT%H:%M:%S.%fZ'
+    datetime_format_min = '%Y%m%dT%H%M%S%fZ'
     
-    print_debug = True
-    # Internal db messages
-    db_message = None
+    # Logger of the db module, levels are set by configureLogging
+    logger = getLogger('db')
     
     # Response(s)
     # For read, response contains requested data
@@ -60,13 +251,145 @@ class WallflowerDB:
       
     db = None
     
+    # Compressed chunks of older points (cold storage)
+    cold_storage = False
+    chunk_size = 1000
+    
+    # Segment files of streams with points-storage 'segment'
+    segments = None
+    
+    # Most values of one dictionary encoded stream kept in memory
+    dictionary_cache_size = 10000
+    # Attempts to add new values when other processes take their codes
+    dictionary_attempts = 5
+    
+    # Number of SQLite files the points tables are sharded across
+    shards = 0
+    
+    # A read replica is configured as the 'replica' bind
+    replica = False
+    
+    # WallflowerMetrics of the server, if enabled
+    metrics = None
+    
+    # WallflowerTracer of the server, if enabled
+    tracer = None
+    
+    # WallflowerStreamCounters, if stream statistics are enabled
+    stream_counters = None
+    
+    # Policy for points with the timestamp of an existing point:
+    # reject, ignore, or overwrite
+    points_conflict = 'reject'
+    conflict_policies = ['reject','ignore','overwrite']
+    
+    # Seconds between the prunes of the Idempotency-Keys of a process
+    idempotency_prune_interval = 60
+    
+    def __init__(self):
+        # Requests may be served by multiple threads, so the
+        # internal db messages are kept per thread.
+        self.local = threading.local()
+        self.points_notifier = WallflowerPointsNotifier()
+        # Committed codes of dictionary encoded streams, by stream
+        self.dictionaries = {}
+        self.dictionaries_lock = threading.Lock()
+        # Time of the last prune of the Idempotency-Keys
+        self.idempotency_pruned_at = 0
+        self.idempotency_lock = threading.Lock()
+        
+    '''
+    Internal db messages
+    '''
+    @property
+    def db_message(self):
+        return getattr(self.local,'db_message',None)
+        
+    @db_message.setter
+    def db_message(self,db_message):
+        self.local.db_message = db_message
+    
+    '''
+    Commit the session. In a batch, changes are only flushed and
+    the batch is committed once all of its requests are done.
+    '''
+    def commit(self):
+        if getattr(self.local,'batch',False):
+            self.db.session.flush()
+        else:
+            self.db.session.commit()
+            self.publishCodes()
+            self.applySegments()
+            
+    '''
+    Roll back the session. In a batch, the batch is marked as failed
+    and rolled back once all of its requests are done.
+    '''
+    def rollback(self):
+        if getattr(self.local,'batch',False):
+            self.local.batch_failed = True
+        else:
+            self.db.session.rollback()
+            self.discardCodes()
+            self.discardSegments()
+            
+    '''
+    Send the reads of the current request to the primary, for 
+    clients that have just written (read-your-writes).
+    '''
+    def setReadPrimary(self,read_primary):
+        self.local.read_primary = read_primary
+        
+    '''
+    Set the conflict policy of the points updates of the current 
+    request. None uses the policy of the stream.
+    '''
+    def setPointsConflict(self,points_conflict):
+        self.local.points_conflict = points_conflict
+        
+    '''
+    Send the queries of the enclosed block to the read replica, unless 
+    the request reads from the primary, is part of a batch, or the 
+    session has changes that are not flushed yet.
+    '''
+    @contextlib.contextmanager
+    def readReplica(self):
+        session = self.db.session()
+        previous = session.info.get('replica',False)
+        session.info['replica'] = self.replica and \
+            not getattr(self.local,'read_primary',False) and \
+            not getattr(self.local,'batch',False) and \
+            not (session.new or session.dirty or session.deleted)
+        try:
+            yield
+        finally:
+            session.info['replica'] = previous
+            
+    '''
+    Wake requests waiting for new points on a stream. In a batch, 
+    requests are woken once the batch has been committed.
+    '''
+    def notifyPoints(self,key):
+        if getattr(self.local,'batch',False):
+            self.local.batch_notify.append( key )
+        else:
+            self.points_notifier.notify( key )
+    
     '''
-    Print Messages
+    Log messages. Arguments are only formatted into the message if the 
+    level is enabled.
     '''
-    def debug(self,text):
-        if self.print_debug:
-            print( text )
-            sys.stdout.flush()
+    def debug(self,text,*args):
+        self.logger.debug(text,*args)
+        
+    def info(self,text,*args):
+        self.logger.info(text,*args)
+        
+    def warning(self,text,*args):
+        self.logger.warning(text,*args)
+        
+    def error(self,text,*args,**kwargs):
+        self.logger.error(text,*args,**kwargs)
     
     def getCombinedResponse(self, request_packet ):
         def merge(a, b, path=None):
@@ -88,6 +411,8 @@ class WallflowerDB:
     '''
     Execute Network, Object, Stream, or Points Request
     '''
+    @measured()
+    @traced()
     def do(self,request,request_type,request_level,ids,at=None):
         if at is None:
             at = datetime.datetime.utcnow().isoformat() + 'Z'
@@ -96,22 +421,24 @@ class WallflowerDB:
         self.db_message = {}
         
         request_packet = WallflowerPacket()
-        request_packet.loadRequest(request,request_type,request_level)
+        with self.span('db.validate'):
+            request_packet.loadRequest(request,request_type,request_level)
         
         # Check if packet has request
         has_request, the_request = request_packet.hasRequest(request_level)
-        self.debug('Has '+request_level+" "+request_type+" request: "+str(has_request))
+        self.debug( "Has %s %s request: %s", request_level, request_type, has_request )
         if not has_request:
             self.db_message.update({
                 request_level+'-error': 'Invalid request',
                 request_level+'-code': 400
             })
             self.db_message.update( request_packet.schema_packet  )
-            self.debug( "Invalid request or schema error" )
+            self.info( "Invalid request or schema error" )
             return self.db_message
         
         # Check if necessary elements/parents do or do not exist
-        do_continue = self.doChecks(request_type,request_level,ids)
+        with self.span('db.checks'):
+            do_continue = self.doChecks(request_type,request_level,ids)
         if not do_continue:
             if request_level+'-code' not in self.db_message:
                 self.db_message.update({
@@ -121,7 +448,8 @@ class WallflowerDB:
             return self.db_message
         
         # Finally, do request
-        done = self.doRequest(the_request,request_type,request_level,ids,at)
+        with self.span('db.request'):
+            done = self.doRequest(the_request,request_type,request_level,ids,at)
         if not done:
             if request_level+'-code' not in self.db_message:
                 self.db_message.update({
@@ -132,6 +460,167 @@ class WallflowerDB:
         return self.db_message
         
     
+    '''
+    Execute a tree of network, object, stream, and points requests, 
+    as loaded by WallflowerMultiplePackets, in one transaction. The
+    existing objects and streams of the network are loaded once for
+    the whole tree. Parents are handled before children (children 
+    before parents for delete requests). Returns the per-entity 
+    result tree.
+    '''
+    @measured('bulk')
+    @traced('bulk')
+    def doMultiple(self,packet,request_type,at=None):
+        if at is None:
+            at = datetime.datetime.utcnow().isoformat() + 'Z'
+            
+        result = {}
+        request_packet = WallflowerMultiplePackets()
+        with self.span('db.validate'):
+            loaded = request_packet.loadRequests(packet,request_type)
+        if not loaded or not request_packet.hasAnyRequest():
+            result['bulk-error'] = 'Invalid request'
+            result['bulk-code'] = 400
+            result['bulk-schema'] = request_packet.schema_packet
+            self.info( "Invalid request or schema error" )
+            self.db_message = result
+            return result
+        
+        network_id = request_packet.getNetworkID()
+        result['network-id'] = network_id
+        
+        # Requests removed by the schema validation fail, and fail
+        # the batch of create, update, and delete requests
+        pruned = self.prunedRequests( request_packet.packet, request_packet.schema_packet, network_id )
+        for request_level, ids, error in pruned:
+            self.placeResult( result, request_level, ids, {
+                request_level+'-error': error,
+                request_level+'-code': 400
+            })
+        
+        # Plan the requests
+        plan = []
+        has_request, the_request = request_packet.hasNetworkRequest(network_id)
+        if has_request:
+            plan.append( ('network',(network_id,),the_request) )
+        for object_id in request_packet.getObjectIDs():
+            has_request, the_request = request_packet.hasObjectRequest(network_id,object_id)
+            if has_request:
+                plan.append( ('object',(network_id,object_id),
+                    the_request['objects'][object_id]) )
+            for stream_id in request_packet.getStreamIDs(object_id):
+                ids = (network_id,object_id,stream_id)
+                has_request, the_request = request_packet.hasStreamRequest(*ids)
+                if has_request:
+                    plan.append( ('stream',ids,
+                        the_request['objects'][object_id]['streams'][stream_id]) )
+                has_request, the_request = request_packet.hasPointsRequest(*ids)
+                if has_request:
+                    plan.append( ('points',ids,{
+                        'stream-id': stream_id,
+                        'points': the_request['objects'][object_id]['streams'][stream_id]['points']
+                    }) )
+        if request_type == 'delete':
+            plan.reverse()
+            
+        # Load existing records for the checks
+        exists = {}
+        network_exists, net = self.networkExists((network_id,))
+        if network_exists:
+            exists[(network_id,)] = net
+            for obj in Object.query.filter_by(network_id=network_id).all():
+                exists[(network_id,obj.object_id)] = obj
+            for stm in Stream.query.filter_by(network_id=network_id).all():
+                exists[(network_id,stm.object_id,stm.stream_id)] = stm
+        
+        self.local.exists = exists
+        self.local.batch = request_type in ['create','update','delete']
+        self.local.batch_failed = self.local.batch and len(pruned) > 0
+        self.local.batch_notify = []
+        try:
+            for request_level, ids, the_request in plan:
+                if self.local.batch_failed:
+                    self.db_message = {
+                        request_level+'-error': request_level.title()+\
+                            ' request not completed, another request in the batch failed',
+                        request_level+'-code': 424
+                    }
+                elif request_level == 'network' and request_type in ['create','delete']:
+                    self.db_message = {
+                        'network-error': 'The Wallflower-Atto server does not allow '+\
+                            'network '+request_type+' requests',
+                        'network-code': 400
+                    }
+                else:
+                    self.db_message = {}
+                    # Search is only implemented for points
+                    level_request_type = request_type
+                    if request_type == 'search' and request_level != 'points':
+                        level_request_type = 'read'
+                    with self.span('db.checks',{'db.level': request_level}):
+                        do_continue = self.doChecks(level_request_type,request_level,ids)
+                    if do_continue:
+                        with self.span('db.request',{'db.level': request_level}):
+                            self.doRequest(the_request,level_request_type,request_level,ids,at)
+                    if request_level+'-code' not in self.db_message:
+                        self.db_message.update({
+                            request_level+'-error': request_level.title()+' request could not be completed',
+                            request_level+'-code': 400
+                        })
+                        
+                code = self.db_message[request_level+'-code']
+                if code >= 400 and self.local.batch:
+                    self.local.batch_failed = True
+                elif code == 201:
+                    exists[tuple(ids)] = True
+                elif code == 200 and request_type == 'delete':
+                    for key in exists.keys():
+                        if key[:len(ids)] == tuple(ids):
+                            del exists[key]
+                            
+                self.placeResult( result, request_level, ids, self.db_message )
+                
+            if self.local.batch and self.local.batch_failed:
+                self.db.session.rollback()
+                self.discardCodes()
+                self.discardSegments()
+                result['bulk-error'] = 'Bulk '+request_type+' request failed. No changes made.'
+                result['bulk-code'] = 400
+                self.info( result['bulk-error'] )
+            else:
+                if self.local.batch:
+                    self.db.session.commit()
+                    self.publishCodes()
+                    self.applySegments()
+                    for key in self.local.batch_notify:
+                        self.points_notifier.notify( key )
+                result['bulk-message'] = 'Bulk '+request_type+' request completed'
+                result['bulk-code'] = 200
+                self.debug( result['bulk-message'] )
+                
+        except SegmentError, err:
+            # The batch was committed, but not all segment changes applied
+            self.discardSegments()
+            result['bulk-error'] = 'Bulk '+request_type+' request committed, but segment points were not changed: '+str(err)
+            result['bulk-code'] = 409
+            self.warning( result['bulk-error'] )
+            
+        except:
+            self.db.session.rollback()
+            self.discardCodes()
+            self.discardSegments()
+            result['bulk-error'] = 'Bulk '+request_type+' request failed. No changes made.'
+            result['bulk-code'] = 400
+            self.error( "Unexpected error (24)", exc_info=True )
+            
+        finally:
+            self.local.exists = None
+            self.local.batch = False
+            self.local.batch_notify = []
+            
+        self.db_message = result
+        return result
+    
     """
     Check if necessary elements do or do not exist
     """
@@ -155,7 +644,7 @@ class WallflowerDB:
                     request_level.title()+' '+the_id+' does not exist and '+\
                     request_type+' request cannot be completed.'
                 self.db_message[request_level+'-code'] = 404
-                self.debug( self.db_message[request_level+'-error'] )
+                self.info( self.db_message[request_level+'-error'] )
                 return False
                 
         elif request_level == 'object':
@@ -168,7 +657,7 @@ class WallflowerDB:
                     'Network '+network_id+' does not exist and '+\
                     request_level+' '+request_type+' request cannot be completed.'
                 self.db_message['network-code'] = 404
-                self.debug( self.db_message['network-error'] )
+                self.info( self.db_message['network-error'] )
                 return False
             
             # Check for the object
@@ -186,7 +675,7 @@ class WallflowerDB:
                     request_level.title()+' '+the_id+' does not exist and '+\
                     request_type+' request cannot be completed.'
                 self.db_message[request_level+'-code'] = 404
-                self.debug( self.db_message[request_level+'-error'] )
+                self.info( self.db_message[request_level+'-error'] )
                 return False
             
         elif request_level == 'stream' or request_level == 'points':
@@ -199,7 +688,7 @@ class WallflowerDB:
                     'Network '+network_id+' does not exist and '+\
                     request_level+' '+request_type+' request cannot be completed.'
                 self.db_message['network-code'] = 404
-                self.debug( self.db_message['network-error'] )
+                self.info( self.db_message['network-error'] )
                 return False
             
             # Check for the object
@@ -210,7 +699,7 @@ class WallflowerDB:
                     'Object '+network_id+'.'+object_id+' does not exist and '+\
                     request_level+' '+request_type+' request cannot be completed.'
                 self.db_message['object-code'] = 404
-                self.debug( self.db_message['object-error'] )
+                self.info( self.db_message['object-error'] )
                 return False
             
             # Check for the stream
@@ -228,7 +717,7 @@ class WallflowerDB:
                     request_level.title()+' '+the_id+' does not exist and '+\
                     request_type+' request cannot be completed.'
                 self.db_message[request_level+'-code'] = 404
-                self.debug( self.db_message[request_level+'-error'] )
+                self.info( self.db_message[request_level+'-error'] )
                 return False
         
         return True
@@ -296,6 +785,63 @@ class WallflowerDB:
         elif request_level == 'points':
             return self.streamExists(ids)
             
+    '''
+    Return the (updated_at, record count) pair that versions a read of
+    the network, object, stream, or points. Only metadata is queried.
+    Returns None if the requested element does not exist.
+    '''
+    @replicaRead
+    def lastModified(self,request_level,ids):
+        if request_level == 'network':
+            network_id = ids[0]
+            versions = [
+                self.db.session.query(
+                    func.max(Network.updated_at),func.count(Network.id)
+                ).filter_by(network_id=network_id).one(),
+                self.db.session.query(
+                    func.max(Object.updated_at),func.count(Object.id)
+                ).filter_by(network_id=network_id).one(),
+                self.db.session.query(
+                    func.max(Stream.updated_at),func.count(Stream.id)
+                ).filter_by(network_id=network_id).one()
+            ]
+        elif request_level == 'object':
+            network_id,object_id = ids
+            versions = [
+                self.db.session.query(
+                    func.max(Object.updated_at),func.count(Object.id)
+                ).filter_by(network_id=network_id,object_id=object_id).one(),
+                self.db.session.query(
+                    func.max(Stream.updated_at),func.count(Stream.id)
+                ).filter_by(network_id=network_id,object_id=object_id).one()
+            ]
+        elif request_level in ['stream','points']:
+            network_id,object_id,stream_id = ids
+            versions = [
+                self.db.session.query(
+                    func.max(Stream.updated_at),func.count(Stream.id)
+                ).filter_by(network_id=network_id,object_id=object_id,stream_id=stream_id).one()
+            ]
+        else:
+            return None
+        
+        # The requested element itself must exist
+        if versions[0][1] == 0:
+            return None
+        
+        updated_at = max( v[0] for v in versions if v[0] is not None )
+        count = sum( v[1] for v in versions )
+        return updated_at, count
+        
+    '''
+    Return the points details of a stream, or None if the stream 
+    does not exist. Used to encode and decode binary points.
+    '''
+    def getPointsDetails(self,ids):
+        found, stream_record = self.streamExists(ids)
+        if not found:
+            return None
+        return json.loads( stream_record.points_details )
         
     '''
     Create network. 
@@ -329,10 +875,10 @@ class WallflowerDB:
             network_details = json.dumps( create_network_request['network-details'] )
             create_network = Network(network_id, network_details)
             self.db.session.add(create_network)
-            self.db.session.commit()
+            self.commit()
             
             created = True
-            self.debug( "Network "+network_id+" Created" )
+            self.debug( "Network %s Created", network_id )
             self.db_message['network-message'] =\
                 "Network "+network_id+" Created"
             self.db_message['network-code'] = 201
@@ -343,16 +889,16 @@ class WallflowerDB:
             self.db_message['network-error'] =\
                 "Network "+network_id+" Not Created"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Created" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Network %s Not Created", network_id )
+            self.warning( err )
+            self.rollback()
             
         except:
             self.db_message['network-error'] =\
                 "Network "+network_id+" Not Created"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Created" )
-            self.debug( "Unexpected error (0):"+str(sys.exc_info()) )
+            self.warning( "Error: Network %s Not Created", network_id )
+            self.error( "Unexpected error (0)", exc_info=True )
                         
         return created
     
@@ -383,10 +929,10 @@ class WallflowerDB:
             object_details = json.dumps( create_object_request['object-details'] )
             create_object = Object(network_id, object_id, object_details)
             self.db.session.add(create_object)
-            self.db.session.commit()
+            self.commit()
             
             created = True
-            self.debug( "Object "+network_id+"."+object_id+" Created" )
+            self.debug( "Object %s.%s Created", network_id, object_id )
             self.db_message['object-message'] =\
                 "Object "+network_id+"."+object_id+" Created"
             self.db_message['object-code'] = 201
@@ -397,16 +943,16 @@ class WallflowerDB:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Created"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Created" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Object %s.%s Not Created", network_id, object_id )
+            self.warning( err )
+            self.rollback()
             
         except:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Created"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Created" )
-            self.debug( "Unexpected error (1):"+str(sys.exc_info()) )
+            self.warning( "Error: Object %s.%s Not Created", network_id, object_id )
+            self.error( "Unexpected error (1)", exc_info=True )
             
         return created
     
@@ -432,14 +978,31 @@ class WallflowerDB:
             points_details = create_stream_request['points-details']
             python_type = getPythonType( points_details['points-type']  )
             
+            if self.isSegmentStream(points_details):
+                # Segment records must be fixed width
+                if self.segments is None:
+                    raise SegmentError('Segment storage is not enabled')
+                getRecordFormat(points_details)
+                # Appended points can not be replaced
+                if points_details.get('points-conflict') == 'overwrite':
+                    raise SegmentError('Segment streams do not support the overwrite conflict policy')
+                
+            if self.isDictionaryStream(points_details):
+                # Only string values of tables are dictionary encoded
+                if python_type is not basestring:
+                    raise DictionaryError('Dictionary encoding requires a string points type')
+                if self.isSegmentStream(points_details):
+                    raise DictionaryError('Dictionary encoding requires table storage')
+                points_details['points-dictionary'] = uuid.uuid4().hex
+                
+            if self.shards > 0 and not self.isSegmentStream(points_details):
+                # The shard is kept, so the shard count may change later
+                points_details['points-shard'] = self.pointsShard(ids)
+            
             # Create SQLAlchemy table as needed
-            points_table = createPointsTable( 
-                table_name, 
-                python_type, 
-                points_details['points-length']
-            )
-            points_table.create(self.db.engine, checkfirst=True)
-            self.db.session.commit()            
+            points_table = self.getPointsTable(ids,points_details)
+            points_table.create(self.db.session.connection(), checkfirst=True)
+            self.commit()            
             
             create_stream_request['stream-details']['created-at'] = at
             '''
@@ -457,10 +1020,10 @@ class WallflowerDB:
             points_details = json.dumps( create_stream_request['points-details'] )
             create_stream = Stream(network_id, object_id, stream_id, stream_details, points_details)
             self.db.session.add(create_stream)
-            self.db.session.commit()
+            self.commit()
 
             created = True
-            self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Created" )
+            self.debug( "Stream %s.%s.%s Created", network_id, object_id, stream_id )
             self.db_message['stream-message'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Created"
             self.db_message['stream-code'] = 201
@@ -469,20 +1032,28 @@ class WallflowerDB:
             self.db_message['points-details'] =\
                 create_stream_request['points-details']
             
+        except (SegmentError, BinaryPointsError, DictionaryError), err:
+            self.db_message['stream-error'] =\
+                "Stream "+network_id+"."+object_id+"."+stream_id+" Not Created: "+str(err)
+            self.db_message['stream-code'] = 406
+            self.warning( "Error: Stream %s.%s.%s Not Created", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
+            
         except OperationalError, err:
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Created"
             self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Created" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Stream %s.%s.%s Not Created", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
     
         except:
             # There was an error.
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Created"
             self.db_message['stream-code'] = 400
-            self.debug( "Unexpected error (2):"+str(sys.exc_info()) )
+            self.error( "Unexpected error (2)", exc_info=True )
             
         return created
     
@@ -490,6 +1061,7 @@ class WallflowerDB:
     '''
     Read Network
     '''
+    @replicaRead
     def readNetwork(self,ids,read_network_request,at):
         network_id = ids[0]
         read = False
@@ -500,7 +1072,7 @@ class WallflowerDB:
             if net is None:
                 self.db_message['network-error'] = "Network "+network_id+" Not Read"
                 self.db_message['network-code'] = 400
-                self.debug( "Error: Network "+network_id+" Not Read" )
+                self.warning( "Error: Network %s Not Read", network_id )
             else:
                 self.db_message['network-details'] = json.loads( net.network_details )
                 self.db_message['network-id'] = network_id
@@ -534,42 +1106,29 @@ class WallflowerDB:
                         }
                         
                         # Get points
-                        table_name = network_id+'.'+object_id+'.'+stream_id
-                        python_type = getPythonType( points_details['points-type']  )
-                        
-                        # Create SQLAlchemy table as needed
-                        points_table = createPointsTable( 
-                            table_name, 
-                            python_type, 
-                            points_details['points-length']
+                        points, cursor = self.queryPoints( 
+                            (network_id,object_id,stream_id), 
+                            points_details, 
+                            {'limit': 5}
                         )
-                        statement = select([points_table]).limit(5).order_by(points_table.c.timestamp.desc())
-                        points_records = self.db.session.execute(statement).fetchall()
-                        
-                        points = []
-                        for point in points_records:
-                            if 0 == points_details['points-length']:
-                                points.append({'at':point[0].isoformat() + 'Z','value':point[1]})
-                            else:
-                                points.append({'at':point[0].isoformat() + 'Z','value':point[1:]})
                         self.db_message['objects'][object_id]['streams'][stream_id]['points'] = points
                 
                 read = True
                 self.db_message['network-message'] = "Network "+network_id+" Read"
                 self.db_message['network-code'] = 200
-                self.debug( "Network "+network_id+" Read" )
+                self.debug( "Network %s Read", network_id )
             
         except OperationalError, err:
             self.db_message['network-error'] = "Network "+network_id+" Not Read"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Read" )
-            self.debug( err )
+            self.warning( "Error: Network %s Not Read", network_id )
+            self.warning( err )
             
         except:
             self.db_message['network-error'] = "Network "+network_id+" Not Read"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Read" )
-            self.debug( "Unexpected error (3):"+str(sys.exc_info()) )
+            self.warning( "Error: Network %s Not Read", network_id )
+            self.error( "Unexpected error (3)", exc_info=True )
             
         return read
     
@@ -577,6 +1136,7 @@ class WallflowerDB:
     '''
     Read Object
     '''
+    @replicaRead
     def readObject(self,ids,read_object_request,at):
         network_id,object_id = ids
         read = False
@@ -589,7 +1149,7 @@ class WallflowerDB:
             if obj is None:
                 self.db_message['object-error'] = "Object "+network_id+"."+object_id+" Not Read"
                 self.db_message['object-code'] = 400
-                self.debug( "Error: Object "+network_id+"."+object_id+" Not Read" )
+                self.warning( "Error: Object %s.%s Not Read", network_id, object_id )
             else:
                 self.db_message['object-details'] = json.loads( obj.object_details )
                 self.db_message['object-id'] = object_id
@@ -611,51 +1171,39 @@ class WallflowerDB:
                         }
                         
                         # Get points
-                        table_name = network_id+'.'+object_id+'.'+stream_id
-                        python_type = getPythonType( points_details['points-type']  )
-                        
-                        # Create SQLAlchemy table as needed
-                        points_table = createPointsTable( 
-                            table_name, 
-                            python_type, 
-                            points_details['points-length']
+                        points, cursor = self.queryPoints( 
+                            (network_id,object_id,stream_id), 
+                            points_details, 
+                            {'limit': 5}
                         )
-                        statement = select([points_table]).limit(5).order_by(points_table.c.timestamp.desc())
-                        contents = self.db.session.execute(statement).fetchall()
-                        
-                        points = []
-                        for point in contents:
-                            if 0 == points_details['points-length']:
-                                points.append({'at':point[0].isoformat() + 'Z','value':point[1]})
-                            else:
-                                points.append({'at':point[0].isoformat() + 'Z','value':point[1:]})
                         self.db_message['streams'][stream_id]['points'] = points
                                 
                 self.db_message['object-message'] =\
                     "Object "+network_id+"."+object_id+" Read"
                 self.db_message['object-code'] = 200
-                self.debug( "Object "+network_id+"."+object_id+" Read" )
+                self.debug( "Object %s.%s Read", network_id, object_id )
                 read = True
             
         except OperationalError, err:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Read"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Read" )
-            self.debug( err )
+            self.warning( "Error: Object %s.%s Not Read", network_id, object_id )
+            self.warning( err )
             
         except:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Read"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Read" )
-            self.debug( "Unexpected error (4):"+str(sys.exc_info()) )            
+            self.warning( "Error: Object %s.%s Not Read", network_id, object_id )
+            self.error( "Unexpected error (4)", exc_info=True )            
             
         return read
                 
     '''
     Read stream.
     '''
+    @replicaRead
     def readStream(self,ids,read_stream_request,at):
         network_id,object_id,stream_id = ids
         read = False
@@ -671,7 +1219,7 @@ class WallflowerDB:
                 self.db_message['stream-error'] = \
                     "Stream "+network_id+"."+object_id+"."+stream_id+" Not Read"
                 self.db_message['stream-code'] = 400
-                self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Read" )
+                self.warning( "Error: Stream %s.%s.%s Not Read", network_id, object_id, stream_id )
             else:
                 stream_details = json.loads( stm.stream_details )
                 points_details = json.loads( stm.points_details )
@@ -680,51 +1228,40 @@ class WallflowerDB:
                 self.db_message['points-details'] = points_details
                             
                 # Get points
-                table_name = network_id+'.'+object_id+'.'+stream_id
-                python_type = getPythonType( points_details['points-type']  )
-                
-                # Create SQLAlchemy table as needed
-                points_table = createPointsTable( 
-                    table_name, 
-                    python_type, 
-                    points_details['points-length']
+                points, cursor = self.queryPoints( 
+                    (network_id,object_id,stream_id), 
+                    points_details, 
+                    {'limit': 5}
                 )
-                statement = select([points_table]).limit(5).order_by(points_table.c.timestamp.desc())
-                contents = self.db.session.execute(statement).fetchall()
-                
-                points = []
-                for point in contents:
-                    if 0 == points_details['points-length']:
-                        points.append({'at':point[0].isoformat() + 'Z','value':point[1]})
-                    else:
-                        points.append({'at':point[0].isoformat() + 'Z','value':point[1:]})
                 self.db_message['points'] = points
+                self.countStreamRead( ids, len(points) )
                 
                 
                 self.db_message['stream-message'] =\
                     "Stream "+network_id+"."+object_id+"."+stream_id+" Read"
                 self.db_message['stream-code'] = 200
-                self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Read" )
+                self.debug( "Stream %s.%s.%s Read", network_id, object_id, stream_id )
                 read = True
             
         except OperationalError, err:
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Read"
             self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Read" )
-            self.debug( err )
+            self.warning( "Error: Stream %s.%s.%s Not Read", network_id, object_id, stream_id )
+            self.warning( err )
         except:
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Read"
             self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Read" )
-            self.debug( "Unexpected error (5):"+str(sys.exc_info()) )
+            self.warning( "Error: Stream %s.%s.%s Not Read", network_id, object_id, stream_id )
+            self.error( "Unexpected error (5)", exc_info=True )
             
         return read
                 
     '''
     Read points from stream.
     '''
+    @replicaRead
     def readPoints(self,ids,read_points_request,at):
         network_id,object_id,stream_id = ids
         read = False
@@ -738,51 +1275,39 @@ class WallflowerDB:
                 self.db_message['points-error'] = \
                     "Points "+network_id+"."+object_id+"."+stream_id+".points Not Read"
                 self.db_message['points-code'] = 400
-                self.debug( "Error: Points "+network_id+"."+object_id+"."+stream_id+".points Not Read" )
+                self.warning( "Error: Points %s.%s.%s.points Not Read", network_id, object_id, stream_id )
             else:
                 points_details = json.loads( stm.points_details )
                 self.db_message['stream-id'] = stream_id
                 self.db_message['points-details'] = points_details
                 
                 # Get points
-                table_name = network_id+'.'+object_id+'.'+stream_id
-                python_type = getPythonType( points_details['points-type']  )
-                
-                # Create SQLAlchemy table as needed
-                points_table = createPointsTable( 
-                    table_name, 
-                    python_type, 
-                    points_details['points-length']
+                points, cursor = self.queryPoints( 
+                    (network_id,object_id,stream_id), 
+                    points_details, 
+                    {'limit': 100}
                 )
-                statement = select([points_table]).limit(100).order_by(points_table.c.timestamp.desc())
-                contents = self.db.session.execute(statement).fetchall()
-                
-                points = []
-                for point in contents:
-                    if 0 == points_details['points-length']:
-                        points.append({'at':point[0].isoformat() + 'Z','value':point[1]})
-                    else:
-                        points.append({'at':point[0].isoformat() + 'Z','value':point[1:]})
                 self.db_message['points'] = points
+                self.countStreamRead( ids, len(points) )
                 
                 self.db_message['points-message'] =\
                     "Points "+network_id+"."+object_id+"."+stream_id+".points Read"
                 self.db_message['points-code'] = 200
-                self.debug( "Points "+network_id+"."+object_id+"."+stream_id+".points Read" )
+                self.debug( "Points %s.%s.%s.points Read", network_id, object_id, stream_id )
                 read = True
             
         except OperationalError, err:
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Read"
             self.db_message['points-code'] = 400
-            self.debug( "Error: Points "+network_id+"."+object_id+"."+stream_id+".points Not Read" )
-            self.debug( err )
+            self.warning( "Error: Points %s.%s.%s.points Not Read", network_id, object_id, stream_id )
+            self.warning( err )
         except:
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Read"
             self.db_message['points-code'] = 400
-            self.debug( "Error: Points "+network_id+"."+object_id+"."+stream_id+".points Not Read" )
-            self.debug( "Unexpected error (6):"+str(sys.exc_info()) )
+            self.warning( "Error: Points %s.%s.%s.points Not Read", network_id, object_id, stream_id )
+            self.error( "Unexpected error (6)", exc_info=True )
             
         return read
     
@@ -800,7 +1325,7 @@ class WallflowerDB:
             if net is None:
                 self.db_message['network-error'] = "Network "+network_id+" Not Updated"
                 self.db_message['network-code'] = 400
-                self.debug( "Error: Network "+network_id+" Not Updated" )
+                self.warning( "Error: Network %s Not Updated", network_id )
             else:
                 # Update network
                 network_details = json.loads( net.network_details )
@@ -813,7 +1338,7 @@ class WallflowerDB:
                     at,
                     self.datetime_format_full
                 )
-                self.db.session.commit()
+                self.commit()
                 
                 updated = True
                 self.db_message['network-message'] = "Network "+network_id+" Updated"
@@ -822,20 +1347,20 @@ class WallflowerDB:
                 # Return only updated details
                 self.db_message['network-details'] =\
                     update_network_request['network-details']
-                self.debug( "Network "+network_id+" Updated" )
+                self.debug( "Network %s Updated", network_id )
             
         except OperationalError, err:
             self.db_message['network-error'] = "Network "+network_id+" Not Updated"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Updated" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Network %s Not Updated", network_id )
+            self.warning( err )
+            self.rollback()
             
         except:
             self.db_message['network-error'] = "Network "+network_id+" Not Updated"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Updated" )
-            self.debug( "Unexpected error (7):"+str(sys.exc_info()) )
+            self.warning( "Error: Network %s Not Updated", network_id )
+            self.error( "Unexpected error (7)", exc_info=True )
         
         return updated
 
@@ -855,7 +1380,7 @@ class WallflowerDB:
             if obj is None:
                 self.db_message['object-error'] = "Object "+network_id+"."+object_id+" Not Updated"
                 self.db_message['object-code'] = 400
-                self.debug( "Error: Object "+network_id+"."+object_id+" Not Updated" )
+                self.warning( "Error: Object %s.%s Not Updated", network_id, object_id )
             else:
                 # Update object
                 object_details = json.loads( obj.object_details )
@@ -869,7 +1394,7 @@ class WallflowerDB:
                     at,
                     self.datetime_format_full
                 )       
-                self.db.session.commit()
+                self.commit()
                 
                 updated = True
                 self.db_message['object-message'] =\
@@ -879,22 +1404,22 @@ class WallflowerDB:
                 # Return only updated details
                 self.db_message['object-details'] =\
                     update_object_request['object-details']
-                self.debug( "Object "+network_id+"."+object_id+" Updated" )
+                self.debug( "Object %s.%s Updated", network_id, object_id )
             
         except OperationalError, err:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Updated"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Updated" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Object %s.%s Not Updated", network_id, object_id )
+            self.warning( err )
+            self.rollback()
             
         except:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Updated"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Updated" )
-            self.debug( "Unexpected error (8):"+str(sys.exc_info()) )
+            self.warning( "Error: Object %s.%s Not Updated", network_id, object_id )
+            self.error( "Unexpected error (8)", exc_info=True )
 
         return updated
         
@@ -915,7 +1440,7 @@ class WallflowerDB:
                 self.db_message['stream-error'] = \
                     "Stream "+network_id+"."+object_id+"."+stream_id+" Not Updated"
                 self.db_message['stream-code'] = 400
-                self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Updated" )
+                self.warning( "Error: Stream %s.%s.%s Not Updated", network_id, object_id, stream_id )
             else:
                 # Update stream
                 stream_details = json.loads( stm.stream_details )
@@ -928,7 +1453,7 @@ class WallflowerDB:
                     at,
                     self.datetime_format_full
                 )          
-                self.db.session.commit()
+                self.commit()
                 
                 updated = True
                 self.db_message['stream-message'] =\
@@ -938,22 +1463,22 @@ class WallflowerDB:
                 self.db_message['stream-id'] = stream_id
                 self.db_message['stream-details'] =\
                     update_stream_request['stream-details']            
-                self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Updated" )
+                self.debug( "Stream %s.%s.%s Updated", network_id, object_id, stream_id )
                 
         except OperationalError, err:
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Updated"
             self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Updated" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Stream %s.%s.%s Not Updated", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
             
         except:
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Updated"
             self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Updated" )
-            self.debug( "Unexpected error (9):"+str(sys.exc_info()) )
+            self.warning( "Error: Stream %s.%s.%s Not Updated", network_id, object_id, stream_id )
+            self.error( "Unexpected error (9)", exc_info=True )
             
         return updated
         
@@ -975,7 +1500,7 @@ class WallflowerDB:
                 self.db_message['stream-error'] = \
                     "Stream "+network_id+"."+object_id+"."+stream_id+" Not Found"
                 self.db_message['stream-code'] = 400
-                self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Found" )
+                self.warning( "Error: Stream %s.%s.%s Not Found", network_id, object_id, stream_id )
             else:
                 
                 points_details = json.loads( stm.points_details )
@@ -1038,9 +1563,8 @@ class WallflowerDB:
                             "Stream "+network_id+"."+object_id+"."+\
                             stream_id+" Point Value Not "+str(python_type)
                         self.db_message['points-code'] = 406
-                        self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+ \
-                            " Point Value Should Be "+str(python_type)+\
-                            ", Not "+str(found_type) )
+                        self.info( "Stream %s.%s.%s Point Value Should Be %s, Not %s",
+                            network_id, object_id, stream_id, python_type, found_type )
                         continue_update = False
                         break
                         
@@ -1059,37 +1583,116 @@ class WallflowerDB:
                     python_type = getPythonType( points_details['points-type']  )
                     
                     # Create SQLAlchemy table as needed
-                    points_table = createPointsTable( 
-                        table_name, 
-                        python_type, 
-                        points_details['points-length']
-                    )
+                    points_table = self.getPointsTable(ids,points_details)
+                    rows = []
                     for i in range(len(new_points)):
+                        row = {
+                            'timestamp': self.parseTimestamp( new_points[i]['at'] )
+                        }
                         if 0 == points_details['points-length']:
-                            statement = points_table.insert().values(
-                                timestamp = datetime.datetime.strptime(
-                                    new_points[i]['at'],
-                                    self.datetime_format_full
-                                ),
-                                value = new_points[i]['value']
-                            )
+                            row['value'] = new_points[i]['value']
                         else:
-                            kwargs = {
-                                'timestamp': datetime.datetime.strptime(
-                                    new_points[i]['at'], 
-                                    self.datetime_format_full
-                                )
-                            }
                             for j in range(points_details['points-length']):
-                                kwargs['value'+str(j)] = new_points[i]['value'][j]
-                            statement = points_table.insert().values(**kwargs)
-                                
-                         # TODO: Check Lists
-                        self.db.session.execute(statement)
+                                row['value'+str(j)] = new_points[i]['value'][j]
+                        rows.append( row )
+                        
+                    points_conflict = self.pointsConflict(points_details)
+                    shard_committed = False
+                        
+                    sealed = {}
+                    if self.cold_storage and not self.isSegmentStream(points_details):
+                        # Sealed points are no longer in the points table, 
+                        # so its primary key does not reject them
+                        sealed = self.sealedPoints( ids, [ row['timestamp'] for row in rows ] )
+                        if len(sealed) > 0 and points_conflict == 'reject':
+                            raise DuplicatePointsError('A point with the same timestamp exists')
+                        elif len(sealed) > 0 and points_conflict == 'overwrite':
+                            # Move the sealed points back to be replaced
+                            self.unsealPoints( ids, points_details, sealed )
+                            sealed = {}
+                            
+                    if points_conflict == 'ignore' and not self.isSegmentStream(points_details):
+                        # Keep only the points that will be stored, so the
+                        # current value, min, max, and counts match them
+                        existing = self.existingTimestamps( points_table, 
+                            [ row['timestamp'] for row in rows ] )
+                        existing.update( sealed )
+                        stored = []
+                        for i in range(len(rows)):
+                            if rows[i]['timestamp'] not in existing:
+                                existing.add( rows[i]['timestamp'] )
+                                stored.append( i )
+                        rows = [ rows[i] for i in stored ]
+                        new_points = [ new_points[i] for i in stored ]
+                        the_points_update = [ the_points_update[i] for i in stored ]
+                        
+                    if self.isDictionaryStream(points_details):
+                        # Store the code of each value
+                        columns = ['value']
+                        if points_details['points-length'] > 0:
+                            columns = [ 'value'+str(j) for j in range(points_details['points-length']) ]
+                        codes = self.encodeValues( ids, points_details,
+                            [ row[key] for row in rows for key in columns ] )
+                        for row in rows:
+                            for key in columns:
+                                row[key] = codes[row[key]]
+                        
+                    if self.isSegmentStream(points_details):
+                        records = self.segments.prepare( ids, points_details, [ 
+                            (row['timestamp'],) + tuple( new_points[i]['value'] 
+                                if points_details['points-length'] > 0 
+                                else (new_points[i]['value'],) )
+                            for i, row in enumerate(rows) 
+                        ], points_conflict )
+                        # Keep only the points that will be stored
+                        kept = set( record[0] for record in records )
+                        stored = []
+                        for i in range(len(rows)):
+                            timestamp = datetimeToMicroseconds( rows[i]['timestamp'] )
+                            if timestamp in kept:
+                                kept.discard( timestamp )
+                                stored.append( i )
+                        new_points = [ new_points[i] for i in stored ]
+                        the_points_update = [ the_points_update[i] for i in stored ]
+                        # Appended to the segment files once committed
+                        self.pendingSegments().append( ('append', (ids, points_details, records)) )
+                    elif len(rows) > 0:
+                        # Insert all points with a single executemany
+                        # TODO: Check Lists
+                        result = self.db.session.execute(
+                            self.insertPoints(points_table,points_conflict), 
+                            rows
+                        )
+                        if points_conflict == 'ignore' and not ( 
+                            self.db.engine.dialect.supports_sane_multi_rowcount and 
+                            result.rowcount == len(rows) ):
+                            # Another writer stored points at some of the 
+                            # timestamps since they were checked. The insert
+                            # holds the write lock, so keep the points whose 
+                            # stored row is the new row.
+                            existing = self.existingRows( points_table, 
+                                [ row['timestamp'] for row in rows ] )
+                            stored = [ i for i in range(len(rows)) if 
+                                tuple( existing.get(rows[i]['timestamp'],()) ) == 
+                                tuple( rows[i][column.name] for column in points_table.c ) ]
+                            rows = [ rows[i] for i in stored ]
+                            new_points = [ new_points[i] for i in stored ]
+                            the_points_update = [ the_points_update[i] for i in stored ]
+                        if self.pointsSchema(points_details) is not None and \
+                            not getattr(self.local,'batch',False):
+                            # Commit the points of a sharded stream on their
+                            # own. A transaction that also wrote the Stream row
+                            # would hold the lock of the main database file 
+                            # until its multi-file commit is done, and writers
+                            # of all shards would wait for each other.
+                            self.commit()
+                            shard_committed = True
                     
                     # Set current value
                     new_points = sorted(new_points, key=lambda k: k['at'])
-                    if stm.points_current is None:
+                    if len(new_points) == 0:
+                        pass
+                    elif stm.points_current is None:
                         stm.points_current = json.dumps( new_points[-1] )
                     else:
                         points_current = json.loads( stm.points_current )
@@ -1120,7 +1723,26 @@ class WallflowerDB:
                         at,
                         self.datetime_format_full
                     )
-                    self.db.session.commit()
+                    if shard_committed:
+                        try:
+                            self.commit()
+                        except OperationalError, err:
+                            # The points are stored. The current value and
+                            # the min and max are updated by the next points.
+                            self.rollback()
+                            self.warning( "Points %s.%s.%s.points Updated, Stream Not Updated", 
+                                network_id, object_id, stream_id )
+                            self.warning( err )
+                    else:
+                        self.commit()
+                    
+                    # Wake requests waiting for new points
+                    self.notifyPoints( table_name )
+                    
+                    if self.metrics is not None:
+                        self.metrics.inc( 'wallflower_points_ingested_total', 
+                            (('points_type',points_details['points-type']),), len(new_points) )
+                    self.countStreamWrite( ids, len(new_points), stm.updated_at )
                     
                     updated = True
                     
@@ -1129,22 +1751,48 @@ class WallflowerDB:
                     self.db_message['points-code'] = 200
                     # Return only updated details
                     self.db_message['points'] = the_points_update
-                    self.debug( "Points "+network_id+"."+object_id+"."+stream_id+".points Updated" )
+                    self.debug( "Points %s.%s.%s.points Updated", network_id, object_id, stream_id )
+            
+        except (IntegrityError, DuplicatePointsError, SegmentConflictError), err:
+            self.db_message['points-error'] =\
+                "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated: "+\
+                "A point with the same timestamp exists"
+            self.db_message['points-code'] = 409
+            self.warning( "Points %s.%s.%s.points Not Updated", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
+            
+        except (SegmentError, DictionaryError), err:
+            self.db_message['points-error'] =\
+                "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated: "+str(err)
+            self.db_message['points-code'] = 400
+            self.warning( "Points %s.%s.%s.points Not Updated", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
+            
+        except ValueError, err:
+            self.db_message['points-error'] =\
+                "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated: "+str(err)
+            self.db_message['points-code'] = 400
+            self.warning( "Points %s.%s.%s.points Not Updated", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
             
         except OperationalError, err:
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated"
             self.db_message['points-code'] = 400
-            self.debug( "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Points %s.%s.%s.points Not Updated", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
             
         except:
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated"
             self.db_message['points-code'] = 400
-            self.debug( "Points "+network_id+"."+object_id+"."+stream_id+".points Not Updated" )
-            self.debug( "Unexpected error (10):"+str(sys.exc_info()) )
+            self.warning( "Points %s.%s.%s.points Not Updated", network_id, object_id, stream_id )
+            self.error( "Unexpected error (10)", exc_info=True )
+            self.rollback()
             
         return updated
 
@@ -1164,7 +1812,7 @@ class WallflowerDB:
                 if update_message:
                     self.db_message['network-error'] = "Network "+network_id+" Not Deleted"
                     self.db_message['network-code'] = 400
-                    self.debug( "Error: Network "+network_id+" Not Deleted" )
+                    self.warning( "Error: Network %s Not Deleted", network_id )
             else:
                 # Delete all objects
                 objects = Object.query.filter_by(
@@ -1174,23 +1822,23 @@ class WallflowerDB:
 
                 # Delete network
                 self.db.session.delete(net)
-                self.db.session.commit()
+                self.commit()
                 
                 deleted = True
                 if update_message:
                     self.db_message['network-message'] =\
                         "Network "+network_id+" Deleted"
                     self.db_message['network-code'] = 200
-                self.debug( "Network "+network_id+" Deleted" )
+                self.debug( "Network %s Deleted", network_id )
 
         except OperationalError, err:
             if update_message:
                 self.db_message['network-error'] =\
                     "Network "+network_id+" Not Deleted"
                 self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Deleted" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Network %s Not Deleted", network_id )
+            self.warning( err )
+            self.rollback()
     
         except:
             # There was an error.
@@ -1198,7 +1846,7 @@ class WallflowerDB:
                 self.db_message['network-error'] =\
                     "Network "+network_id+" Not Deleted"
                 self.db_message['network-code'] = 400
-            self.debug( "Unexpected error (11):"+str(sys.exc_info()) )
+            self.error( "Unexpected error (11)", exc_info=True )
             
         return deleted
 
@@ -1219,7 +1867,7 @@ class WallflowerDB:
                 if update_message:
                     self.db_message['object-error'] = "Object "+network_id+"."+object_id+" Not Deleted"
                     self.db_message['object-code'] = 400
-                    self.debug( "Error: Object "+network_id+"."+object_id+" Not Deleted" )
+                    self.warning( "Error: Object %s.%s Not Deleted", network_id, object_id )
                 
             else:
                 # Delete all streams
@@ -1231,23 +1879,31 @@ class WallflowerDB:
                 
                 # Delete object
                 self.db.session.delete(obj)
-                self.db.session.commit()
+                
+                # Mark the parent network as modified
+                Network.query.filter_by(network_id=network_id).update({
+                    'updated_at': datetime.datetime.strptime(
+                        at,
+                        self.datetime_format_full
+                    )
+                })
+                self.commit()
                 
                 deleted = True
                 if update_message:
                     self.db_message['object-message'] =\
                         "Object "+network_id+"."+object_id+" Deleted"
                     self.db_message['object-code'] = 200
-                self.debug( "Object "+network_id+"."+object_id+" Deleted" )
+                self.debug( "Object %s.%s Deleted", network_id, object_id )
     
         except OperationalError, err:
             if update_message:
                 self.db_message['object-error'] =\
                     "Object "+network_id+"."+object_id+" Not Deleted"
                 self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Deleted" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Object %s.%s Not Deleted", network_id, object_id )
+            self.warning( err )
+            self.rollback()
     
         except:
             # There was an error.
@@ -1255,7 +1911,7 @@ class WallflowerDB:
                 self.db_message['object-error'] =\
                     "Object "+network_id+"."+object_id+" Not Deleted"
                 self.db_message['object-code'] = 400
-            self.debug( "Unexpected error (12):"+str(sys.exc_info()) )
+            self.error( "Unexpected error (12)", exc_info=True )
             
         return deleted
         
@@ -1278,7 +1934,7 @@ class WallflowerDB:
                     self.db_message['stream-error'] = \
                         "Stream "+network_id+"."+object_id+"."+stream_id+" Not Deleted"
                     self.db_message['stream-code'] = 400
-                    self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Deleted" )
+                    self.warning( "Error: Stream %s.%s.%s Not Deleted", network_id, object_id, stream_id )
             else:  
                 # Drop table
                 table_name = network_id+'.'+object_id+'.'+stream_id
@@ -1290,30 +1946,56 @@ class WallflowerDB:
                 points_table = createPointsTable( 
                     table_name, 
                     python_type, 
-                    points_length
+                    points_length,
+                    self.pointsSchema( json.loads(stm.points_details) )
                 )
-                points_table.drop(self.db.engine, checkfirst=True)
-                self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" DB Deleted" )
+                points_table.drop(self.db.session.connection(), checkfirst=True)
+                PointsChunk.query.filter_by(
+                    network_id=network_id,
+                    object_id=object_id,
+                    stream_id=stream_id).delete()
+                PointsDictionary.query.filter_by(
+                    network_id=network_id,
+                    object_id=object_id,
+                    stream_id=stream_id).delete()
+                StreamStats.query.filter_by(
+                    network_id=network_id,
+                    object_id=object_id,
+                    stream_id=stream_id).delete()
+                self.dropCodes(ids,json.loads(stm.points_details))
+                if self.segments is not None:
+                    self.pendingSegments().append( ('drop', (ids,)) )
+                self.debug( "Stream %s.%s.%s DB Deleted", network_id, object_id, stream_id )
                 
                 # Delete stream
                 self.db.session.delete(stm)
-                self.db.session.commit()
+                
+                # Mark the parent object as modified
+                Object.query.filter_by(
+                    network_id=network_id,
+                    object_id=object_id).update({
+                    'updated_at': datetime.datetime.strptime(
+                        at,
+                        self.datetime_format_full
+                    )
+                })
+                self.commit()
                 
                 deleted = True
                 if update_message:
                     self.db_message['stream-message'] =\
                         "Stream "+network_id+"."+object_id+"."+stream_id+" Deleted"
                     self.db_message['stream-code'] = 200
-                self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Deleted" )
+                self.debug( "Stream %s.%s.%s Deleted", network_id, object_id, stream_id )
                     
         except OperationalError, err:
             if update_message:
                 self.db_message['stream-error'] =\
                     "Stream "+network_id+"."+object_id+"."+stream_id+" Not Deleted"
                 self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Deleted" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Stream %s.%s.%s Not Deleted", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
     
         except:
             # There was an error.
@@ -1321,7 +2003,7 @@ class WallflowerDB:
                 self.db_message['stream-error'] =\
                     "Stream "+network_id+"."+object_id+"."+stream_id+" Not Deleted"
                 self.db_message['stream-code'] = 400
-            self.debug( "Unexpected error (13):"+str(sys.exc_info()) )
+            self.error( "Unexpected error (13)", exc_info=True )
         
         return deleted
 
@@ -1339,11 +2021,19 @@ class WallflowerDB:
             python_type = int
             points_length = 0
             
+            # Compressed chunks, segments and shards are read with the points details
+            points_details = None
+            segment_stream = False
+            if self.cold_storage or self.segments is not None or self.shards > 0:
+                points_details = self.getPointsDetails(ids)
+                segment_stream = self.isSegmentStream(points_details)
+            
             # Create SQLAlchemy table as needed
             points_table = createPointsTable( 
                 table_name, 
                 python_type, 
-                points_length
+                points_length,
+                self.pointsSchema(points_details) if points_details is not None else None
             )
             
             # Start delete statement
@@ -1351,6 +2041,7 @@ class WallflowerDB:
             
             # Expand statement according to details
             delete_points_details = delete_points_request['points']
+            before, after = None, None
             if 'before' in delete_points_details:
                 before = datetime.datetime.strptime( 
                     delete_points_details['before'], 
@@ -1370,34 +2061,61 @@ class WallflowerDB:
                 except_statement = select([points_table]).\
                     limit(delete_points_details['except']).\
                     order_by(points_table.c.timestamp.desc())
-                contents = self.db.session.execute(except_statement).fetchall()
+                if segment_stream:
+                    contents = list( self.segments.select(ids,points_details,limit=delete_points_details['except']) )
+                else:
+                    contents = self.db.session.execute(except_statement).fetchall()
+                if self.cold_storage and not segment_stream:
+                    contents = sorted(
+                        contents + self.coldRows(ids,points_details,{},delete_points_details['except']),
+                        key=lambda row: row[0],
+                        reverse=True
+                    )[:delete_points_details['except']]
                 except_after = contents[-1][0]
                 statement = statement.where( points_table.c.timestamp < except_after )
+                if before is None or except_after < before:
+                    before = except_after
             
-            self.db.session.execute(statement)
-            self.db.session.commit()
+            if segment_stream:
+                self.pendingSegments().append( ('delete', (ids, points_details, before, after)) )
+            else:
+                self.db.session.execute(statement)
+                if self.cold_storage:
+                    self.deleteColdPoints(ids,points_details,before,after)
+            
+            # Mark the stream as modified
+            Stream.query.filter_by(
+                network_id=network_id,
+                object_id=object_id,
+                stream_id=stream_id).update({
+                'updated_at': datetime.datetime.strptime(
+                    at,
+                    self.datetime_format_full
+                )
+            })
+            self.commit()
             
             deleted = True
             
             self.db_message['points-message'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Deleted"
             self.db_message['points-code'] = 200
-            self.debug( "Points "+network_id+"."+object_id+"."+stream_id+".points Deleted" )
+            self.debug( "Points %s.%s.%s.points Deleted", network_id, object_id, stream_id )
                     
         except OperationalError, err:
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Deleted"
             self.db_message['points-code'] = 400
-            self.debug( "Error: Points "+network_id+"."+object_id+"."+stream_id+".points Not Deleted" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Points %s.%s.%s.points Not Deleted", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
     
         except:
             # There was an error.
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Deleted"
             self.db_message['points-code'] = 400
-            self.debug( "Unexpected error (13):"+str(sys.exc_info()) )
+            self.error( "Unexpected error (13)", exc_info=True )
         
         return deleted
         
@@ -1416,14 +2134,14 @@ class WallflowerDB:
             self.db_message['network-message'] =\
                 "Network "+network_id+" Searched"
             self.db_message['network-code'] = 200
-            self.debug( "Network "+network_id+" Searched" )
+            self.debug( "Network %s Searched", network_id )
             return True
         except:
             self.db_message['network-error'] =\
                 "Network "+network_id+" Not Searched"
             self.db_message['network-code'] = 400
-            self.debug( "Error: Network "+network_id+" Not Searched" )
-            self.debug( "Unexpected error (14):"+str(sys.exc_info()) )
+            self.warning( "Error: Network %s Not Searched", network_id )
+            self.error( "Unexpected error (14)", exc_info=True )
         return False
 
         
@@ -1441,14 +2159,14 @@ class WallflowerDB:
             self.db_message['object-message'] =\
                 "Object "+network_id+"."+object_id+" Searched"
             self.db_message['object-code'] = 200
-            self.debug( "Object "+network_id+"."+object_id+" Searched" )
+            self.debug( "Object %s.%s Searched", network_id, object_id )
             return True
         except:
             self.db_message['object-error'] =\
                 "Object "+network_id+"."+object_id+" Not Searched"
             self.db_message['object-code'] = 400
-            self.debug( "Error: Object "+network_id+"."+object_id+" Not Searched" )
-            self.debug( "Unexpected error (15):"+str(sys.exc_info()) )
+            self.warning( "Error: Object %s.%s Not Searched", network_id, object_id )
+            self.error( "Unexpected error (15)", exc_info=True )
         return False
                 
     '''
@@ -1465,86 +2183,1409 @@ class WallflowerDB:
             self.db_message['stream-message'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Searched"
             self.db_message['stream-code'] = 200
-            self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Searched" )
+            self.debug( "Stream %s.%s.%s Searched", network_id, object_id, stream_id )
             return True
         except:
             self.db_message['stream-error'] =\
                 "Stream "+network_id+"."+object_id+"."+stream_id+" Not Searched"
             self.db_message['stream-code'] = 400
-            self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Searched" )
-            self.debug( "Unexpected error (16):"+str(sys.exc_info()) )
+            self.warning( "Error: Stream %s.%s.%s Not Searched", network_id, object_id, stream_id )
+            self.error( "Unexpected error (16)", exc_info=True )
         return False
      """
      
     '''
-    Search points from stream.
+    Get the SQLAlchemy table that holds the points of a stream.
     '''
-    def searchPoints(self,ids,search_points_request,at):
+    def getPointsTable(self,ids,points_details):
         network_id,object_id,stream_id = ids
-        searched = False
+        table_name = network_id+'.'+object_id+'.'+stream_id
+        python_type = self.storedType(points_details)
         
-        try:
-            # Check for stream
-            stm = Stream.query.filter_by(
-                network_id=network_id,
-                object_id=object_id,
-                stream_id=stream_id).one()
-            if stm is None:
-                # TODO stream-error or points-error
-                self.db_message['stream-error'] = \
-                    "Stream "+network_id+"."+object_id+"."+stream_id+" Not Found"
-                self.db_message['stream-code'] = 400
-                self.debug( "Error: Stream "+network_id+"."+object_id+"."+stream_id+" Not Found" )
+        # Create SQLAlchemy table as needed
+        return createPointsTable( 
+            table_name, 
+            python_type, 
+            points_details['points-length'],
+            self.pointsSchema(points_details)
+        )
+        
+    '''
+    Return the conflict policy of a points update: the policy of the 
+    request, else of the stream, else of the server.
+    '''
+    def pointsConflict(self,points_details):
+        points_conflict = getattr(self.local,'points_conflict',None) or \
+            points_details.get('points-conflict') or \
+            self.points_conflict
+        if points_conflict not in self.conflict_policies:
+            raise ValueError('Invalid points conflict policy '+str(points_conflict))
+        return points_conflict
+        
+    '''
+    Return the insert statement of a points table for a conflict policy.
+    Points are unique by timestamp, so a conflicting point is skipped 
+    (ignore) or replaced (overwrite) by the database.
+    '''
+    def insertPoints(self,points_table,points_conflict):
+        dialect = self.db.engine.dialect.name
+        if dialect == 'postgresql':
+            # Imported here, so SQLite servers start without it
+            from sqlalchemy.dialects import postgresql
+        if points_conflict == 'ignore':
+            if dialect == 'sqlite':
+                return points_table.insert().prefix_with('OR IGNORE')
+            elif dialect == 'postgresql':
+                return postgresql.insert(points_table).on_conflict_do_nothing(
+                    index_elements=['timestamp']
+                )
+        elif points_conflict == 'overwrite':
+            if dialect == 'sqlite':
+                return points_table.insert().prefix_with('OR REPLACE')
+            elif dialect == 'postgresql':
+                statement = postgresql.insert(points_table)
+                return statement.on_conflict_do_update(
+                    index_elements=['timestamp'],
+                    set_=dict( (column.name, statement.excluded[column.name]) 
+                        for column in points_table.c if column.name != 'timestamp' )
+                )
+        return points_table.insert()
+        
+    '''
+    Return the shard of a new stream, from a hash of its ids.
+    '''
+    def pointsShard(self,ids):
+        return (zlib.crc32( '.'.join(ids) ) & 0xffffffff) % self.shards
+        
+    '''
+    Return the schema of the points table of a stream, None if the 
+    table is in the main database.
+    '''
+    def pointsSchema(self,points_details):
+        if points_details.get('points-shard') is None:
+            return None
+        return 'shard'+str(points_details['points-shard'])
+        
+    '''
+    Run a points search on the table of a stream. Returns the points, 
+    newest first, and the points-cursor for the next points-since 
+    search (None if there is no cursor).
+    '''
+    def queryPoints(self,ids,points_details,search_points_details):
+        limit = 100
+        if 'limit' in search_points_details:
+            if search_points_details['limit'] < 1000:
+                limit = search_points_details['limit'] 
             else:
+                limit = 1000
+        
+        if self.isSegmentStream(points_details):
+            rows, since = self.segmentRows(ids,points_details,search_points_details,limit)
+            contents = list(rows)
+        else:
+            points_table = self.getPointsTable(ids,points_details)
+            statement, since = self.pointsStatement(points_table,search_points_details)
+            statement = statement.limit(limit)
+            contents = self.db.session.execute(statement).fetchall()
+            
+        if self.cold_storage and not self.isSegmentStream(points_details):
+            # Merge with the points of compressed chunks. Once the table
+            # has limit points, only chunks that overlap them are read.
+            bound = None
+            if len(contents) >= limit:
+                bound = contents[-1][0]
+            cold_rows = self.coldRows(ids,points_details,search_points_details,limit,since is not None,bound)
+            if len(cold_rows) > 0:
+                contents = sorted( 
+                    contents + cold_rows, 
+                    key=lambda row: row[0],
+                    reverse=(since is None)
+                )[:limit]
+        if since is not None:
+            # Return newest first, as for other searches
+            contents.reverse()
+            
+        if self.isDictionaryStream(points_details):
+            contents = self.decodeRows(ids,points_details,contents)
+        
+        points = []
+        for point in contents:
+            if 0 == points_details['points-length']:
+                points.append({'at':point[0].strftime(self.datetime_format_full),'value':point[1]})
+            else:
+                points.append({'at':point[0].strftime(self.datetime_format_full),'value':point[1:]})
                 
-                points_details = json.loads( stm.points_details )
-                
-                # Search for points in table
-                table_name = network_id+'.'+object_id+'.'+stream_id
-                python_type = getPythonType( points_details['points-type']  )
-                points_length = points_details['points-length'] 
-                
-                # Create SQLAlchemy table as needed
-                points_table = createPointsTable( 
-                    table_name, 
-                    python_type, 
-                    points_length
-                )
-                
-                # Start search statement
-                statement = select([points_table]).order_by(points_table.c.timestamp.desc())
-                
-                # Expand statement according to details
-                search_points_details = search_points_request['points']
-                if 'start' in search_points_details:
-                    start = datetime.datetime.strptime( 
-                        search_points_details['start'], 
-                        self.datetime_format_full
-                    )
-                    statement = statement.where( points_table.c.timestamp >= start )
-                if 'end' in search_points_details:
-                    end = datetime.datetime.strptime( 
-                        search_points_details['end'], 
-                        self.datetime_format_full
-                    )
-                    statement = statement.where( points_table.c.timestamp <= end )
+        cursor = None
+        if len(points) > 0:
+            cursor = points[0]['at']
+        elif since is not None:
+            cursor = since.strftime(self.datetime_format_full)
+            
+        return points, cursor
+        
+    '''
+    Check if the points of a stream are stored in segment files.
+    '''
+    def isSegmentStream(self,points_details):
+        return points_details.get('points-storage') == 'segment'
+        
+    '''
+    Check if the values of a stream are stored as dictionary codes.
+    '''
+    def isDictionaryStream(self,points_details):
+        return points_details.get('points-encoding') == 'dictionary'
+        
+    '''
+    Return the python type of the values as stored in the points 
+    table and chunks of a stream (int for dictionary codes).
+    '''
+    def storedType(self,points_details):
+        if self.isDictionaryStream(points_details):
+            return int
+        return getPythonType( points_details['points-type'] )
+        
+    '''
+    Return the key of the cached dictionary of a stream. The key
+    changes when a stream is deleted and created again, so codes
+    cached by other processes are not reused.
+    '''
+    def dictionaryKey(self,ids,points_details):
+        return '.'.join(ids)+'.'+points_details.get('points-dictionary','')
+        
+    '''
+    Return the codes added to dictionaries by the current transaction,
+    by stream. They are only cached once the transaction is committed.
+    '''
+    def pendingCodes(self):
+        if getattr(self.local,'dictionary_pending',None) is None:
+            self.local.dictionary_pending = {}
+        return self.local.dictionary_pending
+        
+    '''
+    Cache the codes added by the committed transaction.
+    '''
+    def publishCodes(self):
+        pending = self.pendingCodes()
+        self.local.dictionary_pending = {}
+        with self.dictionaries_lock:
+            for key, codes in pending.items():
+                for value, code in codes.items():
+                    self.cacheCode(key,value,code)
                     
-                limit = 100
-                if 'limit' in search_points_details:
-                    if search_points_details['limit'] < 1000:
-                        limit = search_points_details['limit'] 
+    '''
+    Place the message of a request in the result tree of doMultiple.
+    '''
+    def placeResult(self,result,request_level,ids,message):
+        if request_level == 'network':
+            result.update( message )
+            return
+        object_id = ids[1]
+        if 'objects' not in result:
+            result['objects'] = {}
+        if object_id not in result['objects']:
+            result['objects'][object_id] = { 'object-id': object_id }
+        if request_level == 'object':
+            result['objects'][object_id].update( message )
+            return
+        stream_id = ids[2]
+        if 'streams' not in result['objects'][object_id]:
+            result['objects'][object_id]['streams'] = {}
+        if stream_id not in result['objects'][object_id]['streams']:
+            result['objects'][object_id]['streams'][stream_id] = { 'stream-id': stream_id }
+        result['objects'][object_id]['streams'][stream_id].update( message )
+        
+    '''
+    Return the requests of a multiple request packet that were removed
+    by the schema validation, as (request level, ids, schema error). 
+    Entities that only hold the requests of their children (such as an 
+    object with streams but without object-details) are not requests.
+    '''
+    def prunedRequests(self,packet,schema_packet,network_id):
+        pruned = []
+        if not isinstance(packet,dict) or not isinstance(schema_packet,dict):
+            return pruned
+        if 'network-schema-error' in schema_packet and 'network-details' in packet:
+            pruned.append( ('network',(network_id,),schema_packet['network-schema-error']) )
+        objects = packet.get('objects')
+        objects_schema = schema_packet.get('objects')
+        if not isinstance(objects,dict) or not isinstance(objects_schema,dict):
+            return pruned
+        for object_id, object_schema in objects_schema.items():
+            the_object = objects.get(object_id)
+            if not isinstance(the_object,dict) or not isinstance(object_schema,dict):
+                continue
+            if 'object-schema-error' in object_schema and \
+                ('object-details' in the_object or 'streams' not in the_object):
+                pruned.append( ('object',(network_id,object_id),object_schema['object-schema-error']) )
+            streams = the_object.get('streams')
+            streams_schema = object_schema.get('streams')
+            if not isinstance(streams,dict) or not isinstance(streams_schema,dict):
+                continue
+            for stream_id, stream_schema in streams_schema.items():
+                the_stream = streams.get(stream_id)
+                if not isinstance(the_stream,dict) or not isinstance(stream_schema,dict):
+                    continue
+                ids = (network_id,object_id,stream_id)
+                if 'stream-schema-error' in stream_schema and \
+                    ('stream-details' in the_stream or 'points-details' in the_stream or 'points' not in the_stream):
+                    pruned.append( ('stream',ids,stream_schema['stream-schema-error']) )
+                points_schema = stream_schema.get('points')
+                if isinstance(points_schema,dict) and 'points-schema-error' in points_schema:
+                    pruned.append( ('points',ids,points_schema['points-schema-error']) )
+        return pruned
+        
+    '''
+    Forget the codes added by the rolled back transaction.
+    '''
+    def discardCodes(self):
+        self.local.dictionary_pending = {}
+        
+    '''
+    Return the segment changes of the current transaction, as 
+    (method, args) of the segment store, in order. Appends, deletes 
+    and drops are applied once the transaction is committed.
+    '''
+    def pendingSegments(self):
+        if getattr(self.local,'segments_pending',None) is None:
+            self.local.segments_pending = []
+        return self.local.segments_pending
+        
+    '''
+    Apply the segment changes of the committed transaction. Appended
+    records are checked before the commit, so this only fails if 
+    another process appended newer points to the stream in between.
+    '''
+    def applySegments(self):
+        pending = self.pendingSegments()
+        self.local.segments_pending = []
+        for method, args in pending:
+            getattr(self.segments,method)( *args )
+            
+    '''
+    Forget the segment changes of the rolled back transaction.
+    '''
+    def discardSegments(self):
+        self.local.segments_pending = []
+        
+    '''
+    Forget the codes of a deleted stream.
+    '''
+    def dropCodes(self,ids,points_details):
+        key = self.dictionaryKey(ids,points_details)
+        self.pendingCodes().pop(key,None)
+        with self.dictionaries_lock:
+            self.dictionaries.pop(key,None)
+            
+    '''
+    Add a committed code to the cache. The lock must be held.
+    '''
+    def cacheCode(self,key,value,code):
+        codes, values = self.dictionaries.setdefault(key,({},{}))
+        if len(codes) < self.dictionary_cache_size:
+            codes[value] = code
+            values[code] = value
+            
+    '''
+    Return the dictionary entries of a stream with a value (or code) 
+    in keys. Keys are queried in groups to stay below the limit on
+    SQL variables.
+    '''
+    def queryDictionary(self,ids,column,keys):
+        network_id,object_id,stream_id = ids
+        keys = list(keys)
+        entries = []
+        for i in range(0,len(keys),500):
+            entries.extend( PointsDictionary.query.filter_by(
+                network_id=network_id,
+                object_id=object_id,
+                stream_id=stream_id).filter(
+                getattr(PointsDictionary,column).in_(keys[i:i+500])).all() )
+        return entries
+        
+    '''
+    Return the code of each value, as a dict. Values without a code
+    are added to the dictionary of the stream.
+    '''
+    def encodeValues(self,ids,points_details,values):
+        network_id,object_id,stream_id = ids
+        key = self.dictionaryKey(ids,points_details)
+        pending = self.pendingCodes().setdefault(key,{})
+        codes = {}
+        missing = set()
+        with self.dictionaries_lock:
+            cached = self.dictionaries.get(key,({},{}))[0]
+            for value in set(values):
+                if value in pending:
+                    codes[value] = pending[value]
+                elif value in cached:
+                    codes[value] = cached[value]
+                else:
+                    missing.add(value)
+        self.countCache('dictionary',len(codes),len(missing))
+                    
+        if len(missing) > 0:
+            # Values added by other processes are already committed
+            entries = self.queryDictionary(ids,'value',missing)
+            with self.dictionaries_lock:
+                for entry in entries:
+                    codes[entry.value] = entry.code
+                    missing.discard(entry.value)
+                    self.cacheCode(key,entry.value,entry.code)
+                    
+        attempt = 0
+        while len(missing) > 0:
+            # New values. Other processes may add the same values, or 
+            # take the next codes, at the same time. Conflicting entries
+            # are skipped by the insert and the codes are read back, so 
+            # values without a code are tried again with the next codes.
+            if attempt == self.dictionary_attempts:
+                raise DictionaryError('Dictionary codes could not be added')
+            attempt += 1
+            last_code = self.db.session.query( func.max(PointsDictionary.code) ).filter_by(
+                network_id=network_id,
+                object_id=object_id,
+                stream_id=stream_id).scalar()
+            code = 0 if last_code is None else last_code + 1
+            entries = []
+            for value in sorted(missing):
+                entries.append({
+                    'network_id': network_id,
+                    'object_id': object_id,
+                    'stream_id': stream_id,
+                    'code': code,
+                    'value': value
+                })
+                code += 1
+            try:
+                self.db.session.execute( self.insertCodes(), entries )
+            except IntegrityError, err:
+                # Databases without insert-or-ignore
+                raise DictionaryError('Dictionary codes could not be added: '+str(err.orig))
+            for entry in self.queryDictionary(ids,'value',missing):
+                codes[entry.value] = entry.code
+                pending[entry.value] = entry.code
+                missing.discard(entry.value)
+            
+        return codes
+        
+    '''
+    Return the insert statement of dictionary entries, which skips
+    entries with an existing code or value where the database allows.
+    '''
+    def insertCodes(self):
+        dialect = self.db.engine.dialect.name
+        if dialect == 'sqlite':
+            return PointsDictionary.__table__.insert().prefix_with('OR IGNORE')
+        elif dialect == 'postgresql':
+            # Imported here, so SQLite servers start without it
+            from sqlalchemy.dialects import postgresql
+            return postgresql.insert(PointsDictionary.__table__).on_conflict_do_nothing()
+        return PointsDictionary.__table__.insert()
+        
+    '''
+    Return a context manager of a trace span (see WallflowerTracer).
+    '''
+    def span(self,name,tags=None):
+        if self.tracer is None:
+            return no_span
+        return self.tracer.span(name,tags)
+        
+    '''
+    Count the hits and misses of a cache.
+    '''
+    def countCache(self,cache,hits,misses):
+        if self.metrics is None:
+            return
+        if hits > 0:
+            self.metrics.inc( 'wallflower_cache_requests_total', (('cache',cache),('result','hit')), hits )
+        if misses > 0:
+            self.metrics.inc( 'wallflower_cache_requests_total', (('cache',cache),('result','miss')), misses )
+        
+    '''
+    Replace the codes of (timestamp, code, ...) rows with their values.
+    '''
+    def decodeRows(self,ids,points_details,rows):
+        key = self.dictionaryKey(ids,points_details)
+        pending = dict( (code, value) for value, code in self.pendingCodes().get(key,{}).items() )
+        values = {}
+        missing = set()
+        with self.dictionaries_lock:
+            cached = self.dictionaries.get(key,({},{}))[1]
+            for row in rows:
+                for code in row[1:]:
+                    if code is None or code in values:
+                        continue
+                    if code in pending:
+                        values[code] = pending[code]
+                    elif code in cached:
+                        values[code] = cached[code]
                     else:
-                        limit = 1000
+                        missing.add(code)
+        self.countCache('dictionary',len(values),len(missing))
+                        
+        if len(missing) > 0:
+            entries = self.queryDictionary(ids,'code',missing)
+            with self.dictionaries_lock:
+                for entry in entries:
+                    values[entry.code] = entry.value
+                    self.cacheCode(key,entry.value,entry.code)
+                    
+        values[None] = None
+        return [ (row[0],) + tuple( values.get(code) for code in row[1:] ) for row in rows ]
+        
+    '''
+    Return the (since, start, end) datetimes of a points search, 
+    None where not given.
+    '''
+    def searchBounds(self,search_points_details):
+        since, start, end = None, None, None
+        if 'since' in search_points_details:
+            since = self.parseTimestamp( search_points_details['since'] )
+        if 'start' in search_points_details:
+            start = datetime.datetime.strptime( 
+                search_points_details['start'], 
+                self.datetime_format_full
+            )
+        if 'end' in search_points_details:
+            end = datetime.datetime.strptime( 
+                search_points_details['end'], 
+                self.datetime_format_full
+            )
+        return since, start, end
+        
+    '''
+    Run a points search on the segment files of a stream, in the order
+    of pointsStatement. Returns the rows and the since timestamp.
+    '''
+    def segmentRows(self,ids,points_details,search_points_details,limit=None,ascending=None):
+        since, start, end = self.searchBounds(search_points_details)
+        low = start
+        if since is not None:
+            # Segment timestamps are whole microseconds
+            since_low = since + datetime.timedelta(microseconds=1)
+            if low is None or since_low > low:
+                low = since_low
+        if ascending is None:
+            ascending = since is not None
+        rows = self.segments.select(ids,points_details,low,end,limit,ascending)
+        return rows, since
+        
+    '''
+    Build the select statement of a points search (start, end, and 
+    since), without a limit. Returns the statement and the parsed 
+    since timestamp (None if not given).
+    '''
+    def pointsStatement(self,points_table,search_points_details):
+        # Start search statement
+        statement = select([points_table]).order_by(points_table.c.timestamp.desc())
+        
+        # Expand statement according to details
+        since = None
+        if 'since' in search_points_details:
+            # Only return points newer than the client's cursor.
+            # Walk forward from the cursor along the timestamp
+            # index, so that a limited result can be resumed.
+            since = self.parseTimestamp( search_points_details['since'] )
+            statement = select([points_table]).\
+                where( points_table.c.timestamp > since ).\
+                order_by(points_table.c.timestamp.asc())
+        if 'start' in search_points_details:
+            start = datetime.datetime.strptime( 
+                search_points_details['start'], 
+                self.datetime_format_full
+            )
+            statement = statement.where( points_table.c.timestamp >= start )
+        if 'end' in search_points_details:
+            end = datetime.datetime.strptime( 
+                search_points_details['end'], 
+                self.datetime_format_full
+            )
+            statement = statement.where( points_table.c.timestamp <= end )
+            
+        return statement, since
+        
+    '''
+    Yield the rows of a points result in chunks, merged in timestamp 
+    order with the cold rows (oldest first, or None) of the same search.
+    '''
+    def rowChunks(self,result,cold_rows,chunk_size,limit=None):
+        def hotRows():
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    yield tuple(row)
+                    
+        try:
+            if cold_rows is None:
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if len(rows) == 0:
+                        break
+                    yield rows
+            else:
+                merged = heapq.merge( cold_rows, hotRows() )
+                if limit is not None:
+                    merged = itertools.islice( merged, limit )
+                while True:
+                    rows = list( itertools.islice( merged, chunk_size ) )
+                    if len(rows) == 0:
+                        break
+                    yield rows
+        finally:
+            result.close()
+        
+    '''
+    Decode a compressed chunk into (timestamp, value, ...) rows.
+    '''
+    def chunkRows(self,chunk):
+        timestamps, columns = decodeChunk( chunk.data )
+        return zip( 
+            [ microsecondsToDatetime(timestamp) for timestamp in timestamps ],
+            *columns
+        )
+        
+    '''
+    Compress (timestamp, value, ...) rows, oldest first, into a new chunk.
+    '''
+    def newChunk(self,ids,points_details,rows):
+        network_id,object_id,stream_id = ids
+        columns = zip(*rows)
+        data = encodeChunk(
+            self.storedType(points_details),
+            [ datetimeToMicroseconds(timestamp) for timestamp in columns[0] ],
+            [ list(column) for column in columns[1:] ]
+        )
+        return PointsChunk(
+            network_id, object_id, stream_id,
+            rows[0][0], rows[-1][0], len(rows), data
+        )
+        
+    '''
+    Return the rows of the compressed chunks of a stream that match a 
+    points search (start, end, and since), newest first or oldest first. 
+    Chunks are read in order until no further chunk can hold one of 
+    the first limit rows. Chunks that end before bound (or start after 
+    bound, if ascending) are not read, which lets a search skip cold 
+    storage once the points table has returned limit points.
+    '''
+    def coldRows(self,ids,points_details,search_points_details,limit=None,ascending=False,bound=None):
+        query, since, start, end = self.chunkQuery(ids,search_points_details)
+        if bound is not None and ascending:
+            query = query.filter( PointsChunk.start_at <= bound )
+        elif bound is not None:
+            query = query.filter( PointsChunk.end_at >= bound )
+        if ascending:
+            query = query.order_by( PointsChunk.start_at.asc() )
+        else:
+            query = query.order_by( PointsChunk.end_at.desc() )
+        
+        rows = []
+        for chunk in query.all():
+            if limit is not None and len(rows) >= limit:
+                rows.sort( key=lambda row: row[0], reverse=not ascending )
+                del rows[limit:]
+                if ascending and chunk.start_at > rows[-1][0]:
+                    break
+                if not ascending and chunk.end_at < rows[-1][0]:
+                    break
+            for row in self.chunkRows(chunk):
+                if since is not None and row[0] <= since:
+                    continue
+                if start is not None and row[0] < start:
+                    continue
+                if end is not None and row[0] > end:
+                    continue
+                rows.append( row )
+                
+        rows.sort( key=lambda row: row[0], reverse=not ascending )
+        if limit is not None:
+            del rows[limit:]
+        return rows
+        
+    '''
+    Yield the rows of the compressed chunks of a stream that match a 
+    points search, oldest first. Chunks are decoded one at a time, in 
+    order of their first point, and only while they may hold the next
+    row, so the cold points of a stream are never all held in memory.
+    '''
+    def coldRowsAscending(self,ids,points_details,search_points_details):
+        query, since, start, end = self.chunkQuery(ids,search_points_details)
+        chunks = iter( query.order_by( PointsChunk.start_at.asc() ).all() )
+        next_chunk = next(chunks,None)
+        rows = []
+        while len(rows) > 0 or next_chunk is not None:
+            # Chunks may overlap, if older points were sealed later
+            while next_chunk is not None and (len(rows) == 0 or next_chunk.start_at <= rows[0][0]):
+                for row in self.chunkRows(next_chunk):
+                    if since is not None and row[0] <= since:
+                        continue
+                    if start is not None and row[0] < start:
+                        continue
+                    if end is not None and row[0] > end:
+                        continue
+                    heapq.heappush( rows, row )
+                # Do not keep the compressed data in the session
+                self.db.session.expire( next_chunk, ['data'] )
+                next_chunk = next(chunks,None)
+            if len(rows) > 0:
+                yield heapq.heappop( rows )
+                
+    '''
+    Return the sealed points of a stream with one of the timestamps, 
+    by timestamp, as (chunk, row). Only the chunks whose time range
+    holds one of the timestamps are decoded.
+    '''
+    def sealedPoints(self,ids,timestamps):
+        network_id,object_id,stream_id = ids
+        sealed = {}
+        if len(timestamps) == 0:
+            return sealed
+        chunks = PointsChunk.query.filter_by(
+            network_id=network_id,
+            object_id=object_id,
+            stream_id=stream_id).\
+            filter( PointsChunk.end_at >= min(timestamps) ).\
+            filter( PointsChunk.start_at <= max(timestamps) ).all()
+        for chunk in chunks:
+            candidates = set( timestamp for timestamp in timestamps 
+                if chunk.start_at <= timestamp <= chunk.end_at )
+            if len(candidates) == 0:
+                continue
+            for row in self.chunkRows(chunk):
+                if row[0] in candidates:
+                    sealed[row[0]] = (chunk, row)
+        return sealed
+        
+    '''
+    Remove sealed points, as returned by sealedPoints, from their chunks.
+    Each chunk is replaced by a chunk of its remaining points.
+    '''
+    def unsealPoints(self,ids,points_details,sealed):
+        chunks = {}
+        for timestamp, (chunk, row) in sealed.items():
+            chunks.setdefault( chunk.id, (chunk, set()) )[1].add( timestamp )
+        for chunk, timestamps in chunks.values():
+            rows = [ row for row in self.chunkRows(chunk) if row[0] not in timestamps ]
+            self.db.session.delete(chunk)
+            if len(rows) > 0:
+                self.db.session.add( self.newChunk(ids,points_details,rows) )
+                
+    '''
+    Return the rows of a points table at timestamps, by timestamp. Only
+    the given columns are read, all columns by default. Timestamps are
+    queried 500 at a time, as in queryDictionary.
+    '''
+    def existingRows(self,points_table,timestamps,columns=None):
+        if columns is None:
+            columns = list(points_table.c)
+        timestamps = list(set(timestamps))
+        rows = {}
+        for i in range(0,len(timestamps),500):
+            statement = select(columns).where( 
+                points_table.c.timestamp.in_(timestamps[i:i+500]) )
+            for row in self.db.session.execute(statement):
+                rows[row[0]] = row
+        return rows
+        
+    '''
+    Return the timestamps of a points table that are in timestamps.
+    '''
+    def existingTimestamps(self,points_table,timestamps):
+        return set( self.existingRows(points_table,timestamps,[points_table.c.timestamp]) )
+        
+    '''
+    Return the query of the chunks of a stream that may hold points of
+    a search, and the since, start, and end bounds of the search.
+    '''
+    def chunkQuery(self,ids,search_points_details):
+        network_id,object_id,stream_id = ids
+        query = PointsChunk.query.filter_by(
+            network_id=network_id,
+            object_id=object_id,
+            stream_id=stream_id)
+            
+        since, start, end = self.searchBounds(search_points_details)
+        if since is not None:
+            query = query.filter( PointsChunk.end_at > since )
+        if start is not None:
+            query = query.filter( PointsChunk.end_at >= start )
+        if end is not None:
+            query = query.filter( PointsChunk.start_at <= end )
+        return query, since, start, end
+        
+    '''
+    Remove the points between after and before (either may be None) 
+    from the compressed chunks of a stream. Chunks that are partly 
+    removed are replaced by a new chunk of the remaining points.
+    '''
+    def deleteColdPoints(self,ids,points_details,before=None,after=None):
+        network_id,object_id,stream_id = ids
+        query = PointsChunk.query.filter_by(
+            network_id=network_id,
+            object_id=object_id,
+            stream_id=stream_id)
+        if before is not None:
+            query = query.filter( PointsChunk.start_at < before )
+        if after is not None:
+            query = query.filter( PointsChunk.end_at > after )
+            
+        for chunk in query.all():
+            self.db.session.delete(chunk)
+            if (before is None or chunk.end_at < before) and \
+                (after is None or chunk.start_at > after):
+                continue
+            rows = [ row for row in self.chunkRows(chunk) 
+                if not ((before is None or row[0] < before) and (after is None or row[0] > after)) ]
+            if len(rows) > 0:
+                self.db.session.add( self.newChunk(ids,points_details,rows) )
+                
+    '''
+    Seal the points of a stream older than before into compressed 
+    chunks of chunk_size points (cold storage), and remove them from 
+    the points table. Sealed points are still returned by searches.
+    If limit is given, only the oldest limit points are sealed.
+    '''
+    def sealPoints(self,ids,before,at=None,limit=None):
+        network_id,object_id,stream_id = ids
+        the_id = network_id+'.'+object_id+'.'+stream_id
+        sealed = False
+        self.db_message = {}
+        
+        if not self.cold_storage:
+            self.db_message['points-error'] = 'Cold storage is not enabled'
+            self.db_message['points-code'] = 400
+            return sealed
+            
+        points_details = self.getPointsDetails(ids)
+        if points_details is None:
+            self.db_message['points-error'] =\
+                'Points '+the_id+' does not exist and seal request cannot be completed.'
+            self.db_message['points-code'] = 404
+            self.info( self.db_message['points-error'] )
+            return sealed
+            
+        if self.isSegmentStream(points_details):
+            self.db_message['points-error'] = 'Points '+the_id+' are stored in segment files'
+            self.db_message['points-code'] = 400
+            return sealed
+            
+        try:
+            # Lock the stream, where supported, so that 
+            # the same points are not sealed twice
+            Stream.query.filter_by(
+                network_id=network_id,
+                object_id=object_id,
+                stream_id=stream_id).with_for_update().one()
+            
+            before = self.parseTimestamp( before )
+            points_table = self.getPointsTable(ids,points_details)
+            statement = select([points_table]).\
+                where( points_table.c.timestamp < before ).\
+                order_by( points_table.c.timestamp.asc() )
+            if limit is not None:
                 statement = statement.limit(limit)
+            
+            count = 0
+            chunks = 0
+            last = None
+            result = self.db.session.execute(statement)
+            while True:
+                rows = result.fetchmany(self.chunk_size)
+                if len(rows) == 0:
+                    break
+                self.db.session.add( self.newChunk(ids,points_details,rows) )
+                count += len(rows)
+                chunks += 1
+                last = rows[-1][0]
+            result.close()
+            
+            if count > 0:
+                deleted = self.db.session.execute(
+                    points_table.delete().where( points_table.c.timestamp <= last )
+                ).rowcount
+                if deleted != count:
+                    # Points were added while sealing
+                    raise SealConflictError('Points changed while sealing')
+                self.commit()
+            
+            sealed = True
+            self.db_message['points-sealed'] = count
+            self.db_message['points-chunks'] = chunks
+            self.db_message['points-message'] = "Points "+the_id+".points Sealed"
+            self.db_message['points-code'] = 200
+            self.debug( "Points %s.points Sealed", the_id )
+            
+        except CompressionError, err:
+            self.db_message['points-error'] = str(err)
+            self.db_message['points-code'] = 406
+            self.rollback()
+            
+        except SealConflictError, err:
+            self.db_message['points-error'] = "Points "+the_id+".points Not Sealed: "+str(err)
+            self.db_message['points-code'] = 409
+            self.info( self.db_message['points-error'] )
+            self.rollback()
+            
+        except OperationalError, err:
+            self.db_message['points-error'] = "Points "+the_id+".points Not Sealed"
+            self.db_message['points-code'] = 400
+            self.warning( "Error: Points %s.points Not Sealed", the_id )
+            self.warning( err )
+            self.rollback()
+            
+        except:
+            # There was an error.
+            self.db_message['points-error'] = "Points "+the_id+".points Not Sealed"
+            self.db_message['points-code'] = 400
+            self.error( "Unexpected error (18)", exc_info=True )
+            self.rollback()
+            
+        return sealed
+        
+    '''
+    Seal the points of all table streams older than age seconds, 
+    batch_size points at a time. Returns the number of points sealed.
+    '''
+    def migratePoints(self,age,batch_size,at=None):
+        before = datetime.datetime.utcnow() - datetime.timedelta(seconds=age)
+        before = before.strftime(self.datetime_format_full)
+        moved = 0
+        for stm in Stream.query.all():
+            ids = (stm.network_id,stm.object_id,stm.stream_id)
+            if self.isSegmentStream( json.loads(stm.points_details) ):
+                continue
+            while self.sealPoints(ids,before,at,batch_size):
+                moved += self.db_message['points-sealed']
+                if self.db_message['points-sealed'] < batch_size:
+                    break
+            if self.db_message.get('points-code') != 200:
+                self.warning( "Points %s Not Migrated", '.'.join(ids) )
+        return moved
+        
+    '''
+    Count a points update of a stream, for the stream statistics.
+    '''
+    def countStreamWrite(self,ids,points,at):
+        if self.stream_counters is not None:
+            self.stream_counters.add(ids,writes=1,points_written=points,last_write_at=at)
+            
+    '''
+    Count a points read of a stream, for the stream statistics.
+    '''
+    def countStreamRead(self,ids,points):
+        if self.stream_counters is not None:
+            self.stream_counters.add(ids,reads=1,points_read=points)
+            
+    '''
+    Add the counts of this process to the stream_stats table. Rates are
+    computed over windows of window seconds. The rows and bytes of a 
+    stream are estimated again when it was written to, at most every 
+    estimate_interval seconds. Returns the number of streams flushed.
+    '''
+    def flushStreamStats(self,window=60,estimate_interval=300):
+        if self.stream_counters is None:
+            return 0
+        counts = self.stream_counters.take()
+        if len(counts) == 0:
+            return 0
+        now = time.time()
+        try:
+            for ids, (writes, points_written, reads, points_read, last_write_at) in counts.items():
+                network_id, object_id, stream_id = ids
+                stats = StreamStats.query.filter_by(
+                    network_id=network_id,
+                    object_id=object_id,
+                    stream_id=stream_id).first()
+                if stats is None:
+                    stm = Stream.query.filter_by(
+                        network_id=network_id,
+                        object_id=object_id,
+                        stream_id=stream_id).first()
+                    if stm is None:
+                        continue
+                    stats = StreamStats(network_id,object_id,stream_id)
+                    stats.window_start = now
+                    self.db.session.add(stats)
+                    
+                # Totals are incremented in SQL, since all processes flush
+                if stats.id is None:
+                    stats.writes = writes
+                    stats.reads = reads
+                    stats.points_written = points_written
+                    stats.points_read = points_read
+                else:
+                    stats.writes = StreamStats.writes + writes
+                    stats.reads = StreamStats.reads + reads
+                    stats.points_written = StreamStats.points_written + points_written
+                    stats.points_read = StreamStats.points_read + points_read
+                    
+                if now - stats.window_start >= window:
+                    elapsed = now - stats.window_start
+                    stats.write_rate = (stats.window_points_written + points_written) / elapsed
+                    stats.read_rate = (stats.window_reads + reads) / elapsed
+                    stats.window_points_written = 0
+                    stats.window_reads = 0
+                    stats.window_start = now
+                elif stats.id is None:
+                    stats.window_points_written = points_written
+                    stats.window_reads = reads
+                else:
+                    stats.window_points_written = StreamStats.window_points_written + points_written
+                    stats.window_reads = StreamStats.window_reads + reads
+                    
+                if last_write_at is not None and \
+                    (stats.last_write_at is None or last_write_at > stats.last_write_at):
+                    stats.last_write_at = last_write_at
+                    
+                if stats.estimated_at is None or \
+                    (writes > 0 and now - stats.estimated_at >= estimate_interval):
+                    stm = Stream.query.filter_by(
+                        network_id=network_id,
+                        object_id=object_id,
+                        stream_id=stream_id).first()
+                    if stm is not None:
+                        stats.rows, stats.bytes = self.storageEstimate( ids, json.loads(stm.points_details) )
+                        stats.estimated_at = now
+                stats.updated_at = datetime.datetime.utcnow()
+            self.commit()
+            return len(counts)
+        except:
+            self.rollback()
+            self.stream_counters.restore(counts)
+            self.error( "Unexpected error (22)", exc_info=True )
+            return 0
+            
+    '''
+    Return the estimated rows and bytes of the points of a stream, over 
+    all tiers. Either is None if the database does not report it.
+    '''
+    def storageEstimate(self,ids,points_details):
+        if self.isSegmentStream(points_details):
+            count, start, end, size = self.segments.stats(ids,points_details)
+            return count, size
+        network_id, object_id, stream_id = ids
+        table_name = network_id+'.'+object_id+'.'+stream_id
+        schema = self.pointsSchema(points_details)
+        rows = self.tableRows(table_name,schema)
+        size = self.tableBytes(table_name,schema)
+        chunk_rows, chunk_bytes = self.db.session.query(
+            func.sum(PointsChunk.count),
+            func.sum(func.length(PointsChunk.data))
+        ).filter_by(
+            network_id=network_id,
+            object_id=object_id,
+            stream_id=stream_id).one()
+        if rows is not None:
+            rows += int(chunk_rows or 0)
+        if size is not None:
+            size += int(chunk_bytes or 0)
+        return rows, size
+        
+    '''
+    Return an estimate of the rows of a points table, without counting
+    them, or None if the database does not report it. On SQLite, this
+    is the span of the rowids, which counts deleted rows in between.
+    '''
+    def tableRows(self,table_name,schema=None):
+        try:
+            dialect = self.db.engine.dialect.name
+            if dialect == 'sqlite':
+                name = '"'+(schema or 'main')+'"."'+table_name.replace('"','""')+'"'
+                return int( self.db.session.execute(
+                    'SELECT COALESCE(MAX(rowid) - MIN(rowid) + 1, 0) FROM '+name
+                ).scalar() )
+            elif dialect == 'postgresql':
+                return max( int( self.db.session.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)',
+                    {'name': '"'+table_name+'"'}
+                ).scalar() ), 0 )
+        except:
+            self.info( "Table %s rows not available", table_name )
+        return None
+        
+    '''
+    Return the statistics of a stream, or None if it has none yet.
+    '''
+    @replicaRead
+    def readStreamStats(self,ids):
+        network_id, object_id, stream_id = ids
+        stats = StreamStats.query.filter_by(
+            network_id=network_id,
+            object_id=object_id,
+            stream_id=stream_id).first()
+        if stats is None:
+            return None
+        return self.streamStatsDict(stats)
+        
+    def streamStatsDict(self,stats):
+        def timestamp(value):
+            if value is None:
+                return None
+            return value.strftime(self.datetime_format_full)
+        return {
+            'writes': stats.writes,
+            'reads': stats.reads,
+            'points-written': stats.points_written,
+            'points-read': stats.points_read,
+            'write-rate': stats.write_rate,
+            'read-rate': stats.read_rate,
+            'last-write': timestamp(stats.last_write_at),
+            'rows': stats.rows,
+            'bytes': stats.bytes,
+            'updated': timestamp(stats.updated_at)
+        }
+        
+    # Orders of the top streams
+    stats_orders = {
+        'write-rate': 'write_rate',
+        'read-rate': 'read_rate',
+        'points-written': 'points_written',
+        'points-read': 'points_read',
+        'rows': 'rows',
+        'bytes': 'bytes',
+        'last-write': 'last_write_at'
+    }
+        
+    '''
+    Return the statistics of the top limit streams of a network, by 
+    order (see stats_orders). Raises ValueError for other orders.
+    '''
+    @replicaRead
+    def readTopStreams(self,network_id,order='write-rate',limit=10):
+        if order not in self.stats_orders:
+            raise ValueError('Invalid stats order '+str(order))
+        column = getattr(StreamStats,self.stats_orders[order])
+        top = StreamStats.query.filter_by(network_id=network_id).order_by(
+            column.is_(None), column.desc()).limit(limit).all()
+        streams = []
+        for stats in top:
+            stream_stats = self.streamStatsDict(stats)
+            stream_stats['object-id'] = stats.object_id
+            stream_stats['stream-id'] = stats.stream_id
+            streams.append(stream_stats)
+        return streams
+        
+    '''
+    Report the storage of all streams of the database: for each points
+    table, the estimated rows, the bytes of the table and its indexes, 
+    the unused bytes (SQLite), the time range, and the cold chunks. 
+    Problems are flagged: tables without a stream (orphan-table), 
+    streams without a table (missing-table) or in another shard 
+    (wrong-shard), streams without points (empty), and chunks, 
+    dictionaries, or statistics of deleted streams. Sizes are read 
+    from the catalog in one query per schema, and rows and time ranges
+    from the primary key index, so no table is scanned. With 
+    flagged_only, only flagged entries are listed.
+    '''
+    @replicaRead
+    def storageReport(self,flagged_only=False):
+        def timestamp(value):
+            if value is None:
+                return None
+            return value.strftime(self.datetime_format_full)
+            
+        tables = self.pointsTables()
+        streams = {}
+        for stm in Stream.query.all():
+            streams[(stm.network_id,stm.object_id,stm.stream_id)] = json.loads(stm.points_details)
+            
+        chunks = {}
+        for row in self.db.session.query(
+            PointsChunk.network_id, PointsChunk.object_id, PointsChunk.stream_id,
+            func.count(PointsChunk.id), func.sum(PointsChunk.count),
+            func.min(PointsChunk.start_at), func.max(PointsChunk.end_at),
+            func.sum(func.length(PointsChunk.data))
+        ).group_by(PointsChunk.network_id, PointsChunk.object_id, PointsChunk.stream_id):
+            chunks[tuple(row[:3])] = row[3:]
+            
+        report = {
+            'streams': [],
+            'orphans': [],
+            'totals': {'streams': len(streams), 'tables': len(tables), 'rows': 0, 'bytes': 0, 'flagged': 0}
+        }
+        
+        for ids in sorted(streams):
+            points_details = streams[ids]
+            table_name = '.'.join(ids)
+            schema = self.pointsSchema(points_details) or 'main'
+            entry = {
+                'object-id': ids[1],
+                'stream-id': ids[2],
+                'table': table_name,
+                'storage': 'segment' if self.isSegmentStream(points_details) else 'table',
+                'flags': []
+            }
+            found = [ table_schema for table_schema, name in tables if name == table_name ]
+            if len(found) == 0:
+                entry['flags'].append('missing-table')
+            elif self.db.engine.dialect.name == 'sqlite' and schema not in found:
+                entry['flags'].append('wrong-shard')
                 
-                contents = self.db.session.execute(statement).fetchall()
+            rows, start, end, size = 0, None, None, 0
+            if self.isSegmentStream(points_details):
+                rows, start, end, size = self.segments.stats(ids,points_details)
+            elif len(found) > 0:
+                table = tables[(found[0],table_name)]
+                entry['schema'] = found[0]
+                start, end = self.tableRange(table_name,found[0])
+                rows = table.get('rows')
+                size = table.get('bytes')
+                entry['index-bytes'] = table.get('index-bytes')
+                entry['unused-bytes'] = table.get('unused-bytes')
                 
-                points = []
-                for point in contents:
-                    if 0 == points_details['points-length']:
-                        points.append({'at':point[0].strftime(self.datetime_format_full),'value':point[1]})
-                    else:
-                        points.append({'at':point[0].strftime(self.datetime_format_full),'value':point[1:]})
+            chunk_count, chunk_points, chunk_start, chunk_end, chunk_bytes = chunks.pop(ids,(0,0,None,None,0))
+            entry['rows'] = rows
+            entry['bytes'] = size
+            entry['chunks'] = chunk_count
+            entry['chunk-points'] = int(chunk_points or 0)
+            entry['chunk-bytes'] = int(chunk_bytes or 0)
+            entry['start'] = timestamp( min( [ value for value in (start,chunk_start) if value is not None ] or [None] ) )
+            entry['end'] = timestamp( max( [ value for value in (end,chunk_end) if value is not None ] or [None] ) )
+            if (rows or 0) == 0 and entry['chunk-points'] == 0 and 'missing-table' not in entry['flags']:
+                entry['flags'].append('empty')
+                
+            report['totals']['rows'] += (rows or 0) + entry['chunk-points']
+            report['totals']['bytes'] += (size or 0) + entry['chunk-bytes']
+            if len(entry['flags']) > 0:
+                report['totals']['flagged'] += 1
+            if len(entry['flags']) > 0 or not flagged_only:
+                report['streams'].append(entry)
+                
+        # Tables and records of deleted streams
+        for (table_schema, table_name), table in sorted(tables.items()):
+            if tuple(table_name.split('.')) not in streams:
+                report['orphans'].append({
+                    'table': table_name,
+                    'schema': table_schema,
+                    'rows': table.get('rows'),
+                    'bytes': table.get('bytes'),
+                    'flags': ['orphan-table']
+                })
+        for ids, row in sorted(chunks.items()):
+            report['orphans'].append({'table': '.'.join(ids), 'chunks': row[0], 'flags': ['orphan-chunks']})
+        for model, flag in ((PointsDictionary,'orphan-dictionary'), (StreamStats,'orphan-stats')):
+            for row in self.db.session.query(
+                model.network_id, model.object_id, model.stream_id, func.count(model.id)
+            ).group_by(model.network_id, model.object_id, model.stream_id):
+                if tuple(row[:3]) not in streams:
+                    report['orphans'].append({'table': '.'.join(row[:3]), 'records': row[3], 'flags': [flag]})
+        report['totals']['flagged'] += len(report['orphans'])
+        return report
+        
+    '''
+    Return the points tables of the database (tables named 
+    network.object.stream), by (schema, name), with the estimated rows,
+    and the bytes of the table, of its indexes, and unused (SQLite), 
+    where the database reports them.
+    '''
+    def pointsTables(self):
+        tables = {}
+        model_tables = set( self.db.metadata.tables.keys() )
+        def isPointsTable(name):
+            return name not in model_tables and name.count('.') == 2
+            
+        dialect = self.db.engine.dialect.name
+        if dialect == 'sqlite':
+            schemas = ['main'] + [ 'shard'+str(i) for i in range(self.shards) ]
+            for schema in schemas:
+                owners = {}
+                for name, table_name, entry_type in self.db.session.execute(
+                    'SELECT name, tbl_name, type FROM "'+schema+'".sqlite_master' ):
+                    if isPointsTable(table_name):
+                        owners[name] = table_name
+                        if entry_type == 'table':
+                            tables[(schema,table_name)] = {}
+                try:
+                    sizes = self.db.session.execute(
+                        'SELECT name, SUM(pgsize), SUM(unused) FROM dbstat WHERE schema = :schema GROUP BY name',
+                        {'schema': schema} ).fetchall()
+                except OperationalError:
+                    self.info( "Table sizes not available (dbstat)" )
+                    self.rollback()
+                    sizes = []
+                for name, size, unused in sizes:
+                    if name not in owners:
+                        continue
+                    table = tables.setdefault( (schema,owners[name]), {} )
+                    key = 'bytes' if name == owners[name] else 'index-bytes'
+                    table[key] = table.get(key,0) + int(size or 0)
+                    table['unused-bytes'] = table.get('unused-bytes',0) + int(unused or 0)
+                for (table_schema, table_name), table in tables.items():
+                    if table_schema == schema:
+                        table['rows'] = self.tableRows(table_name,schema)
+                        if 'index-bytes' in table:
+                            table['bytes'] = table.get('bytes',0) + table['index-bytes']
+        elif dialect == 'postgresql':
+            for name, schema, rows, size, index_size in self.db.session.execute(
+                'SELECT c.relname, n.nspname, c.reltuples, pg_total_relation_size(c.oid), pg_indexes_size(c.oid) '
+                'FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace '
+                'WHERE c.relkind = \'r\' AND n.nspname = current_schema()' ):
+                if isPointsTable(name):
+                    tables[(schema,name)] = {
+                        'rows': max(int(rows),0),
+                        'bytes': int(size),
+                        'index-bytes': int(index_size)
+                    }
+        return tables
+        
+    '''
+    Return the first and last timestamps of a points table in schema,
+    read from the primary key index.
+    '''
+    def tableRange(self,table_name,schema):
+        points_table = createPointsTable( table_name, int, 0,
+            None if schema in ['main','public'] else schema )
+        start = self.db.session.execute( select([func.min(points_table.c.timestamp)]) ).scalar()
+        end = self.db.session.execute( select([func.max(points_table.c.timestamp)]) ).scalar()
+        return start, end
+        
+    '''
+    Return the size on disk of a points table, or None if the database 
+    does not report it.
+    '''
+    def tableBytes(self,table_name,schema=None):
+        try:
+            dialect = self.db.engine.dialect.name
+            if dialect == 'sqlite':
+                return self.db.session.execute(
+                    'SELECT SUM(pgsize) FROM dbstat WHERE name = :name AND schema = :schema',
+                    {'name': table_name, 'schema': schema or 'main'}
+                ).scalar()
+            elif dialect == 'postgresql':
+                return self.db.session.execute(
+                    'SELECT pg_total_relation_size(CAST(:name AS regclass))',
+                    {'name': '"'+table_name+'"'}
+                ).scalar()
+        except:
+            self.info( "Table %s size not available", table_name )
+        return None
+        
+    '''
+    Report the storage tiers of a stream. For each tier, the number of 
+    points, the first and last timestamps, and the bytes used. The 
+    points-boundary is the end of the cold tier.
+    '''
+    @replicaRead
+    def readPointsTiers(self,ids,at=None):
+        network_id,object_id,stream_id = ids
+        the_id = network_id+'.'+object_id+'.'+stream_id
+        read = False
+        self.db_message = {}
+        
+        points_details = self.getPointsDetails(ids)
+        if points_details is None:
+            self.db_message['points-error'] =\
+                'Points '+the_id+' does not exist and tiers request cannot be completed.'
+            self.db_message['points-code'] = 404
+            self.info( self.db_message['points-error'] )
+            return read
+            
+        def timestamp(value):
+            if value is None:
+                return None
+            return value.strftime(self.datetime_format_full)
+            
+        try:
+            tiers = {}
+            if self.isSegmentStream(points_details):
+                count, start, end, size = self.segments.stats(ids,points_details)
+                tiers['segment'] = {
+                    'count': count,
+                    'start': timestamp(start),
+                    'end': timestamp(end),
+                    'bytes': size
+                }
+            else:
+                points_table = self.getPointsTable(ids,points_details)
+                count, start, end = self.db.session.execute( select([
+                    func.count(points_table.c.timestamp),
+                    func.min(points_table.c.timestamp),
+                    func.max(points_table.c.timestamp)
+                ]) ).fetchone()
+                tiers['hot'] = {
+                    'count': count,
+                    'start': timestamp(start),
+                    'end': timestamp(end),
+                    'bytes': self.tableBytes(the_id,self.pointsSchema(points_details))
+                }
+                
+                chunks, count, start, end, size = self.db.session.query(
+                    func.count(PointsChunk.id),
+                    func.sum(PointsChunk.count),
+                    func.min(PointsChunk.start_at),
+                    func.max(PointsChunk.end_at),
+                    func.sum(func.length(PointsChunk.data))
+                ).filter_by(
+                    network_id=network_id,
+                    object_id=object_id,
+                    stream_id=stream_id).one()
+                tiers['cold'] = {
+                    'chunks': chunks,
+                    'count': count or 0,
+                    'start': timestamp(start),
+                    'end': timestamp(end),
+                    'bytes': size or 0
+                }
+                self.db_message['points-boundary'] = timestamp(end)
+                
+            read = True
+            self.db_message['points-tiers'] = tiers
+            self.db_message['points-message'] = "Points "+the_id+".points Tiers Read"
+            self.db_message['points-code'] = 200
+            self.debug( "Points %s.points Tiers Read", the_id )
+            
+        except OperationalError, err:
+            self.db_message['points-error'] = "Points "+the_id+".points Tiers Not Read"
+            self.db_message['points-code'] = 400
+            self.warning( "Error: Points %s.points Tiers Not Read", the_id )
+            self.warning( err )
+            self.rollback()
+            
+        except:
+            # There was an error.
+            self.db_message['points-error'] = "Points "+the_id+".points Tiers Not Read"
+            self.db_message['points-code'] = 400
+            self.error( "Unexpected error (19)", exc_info=True )
+            
+        return read
+        
+    '''
+    Search points from stream.
+    '''
+    @replicaRead
+    def searchPoints(self,ids,search_points_request,at):
+        network_id,object_id,stream_id = ids
+        searched = False
+        
+        try:
+            # Check for stream
+            stm = Stream.query.filter_by(
+                network_id=network_id,
+                object_id=object_id,
+                stream_id=stream_id).one()
+            if stm is None:
+                # TODO stream-error or points-error
+                self.db_message['stream-error'] = \
+                    "Stream "+network_id+"."+object_id+"."+stream_id+" Not Found"
+                self.db_message['stream-code'] = 400
+                self.warning( "Error: Stream %s.%s.%s Not Found", network_id, object_id, stream_id )
+            else:
+                
+                points_details = json.loads( stm.points_details )
+                
+                # Search for points in table
+                points, cursor = self.queryPoints( 
+                    ids, 
+                    points_details, 
+                    search_points_request['points']
+                )
+                self.countStreamRead( ids, len(points) )
+                
+                # High-water mark for the next points-since request
+                if cursor is not None:
+                    self.db_message['points-cursor'] = cursor
                 
                 self.db_message['points-details'] = points_details
                 if len(points) > 1 and isinstance(points[0]['value'],(int,long,float)):
@@ -1563,38 +3604,366 @@ class WallflowerDB:
                 self.db_message['points-message'] =\
                     "Points "+network_id+"."+object_id+"."+stream_id+".points Searched"
                 self.db_message['points-code'] = 200
-                self.debug( "Points "+network_id+"."+object_id+"."+stream_id+".points Searched" )
+                self.debug( "Points %s.%s.%s.points Searched", network_id, object_id, stream_id )
                         
         except OperationalError, err:
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Searched"
             self.db_message['points-code'] = 400
-            self.debug( "Error: Points "+network_id+"."+object_id+"."+stream_id+".points Not Searched" )
-            self.debug( err )
-            self.db.session.rollback()
+            self.warning( "Error: Points %s.%s.%s.points Not Searched", network_id, object_id, stream_id )
+            self.warning( err )
+            self.rollback()
     
         except:
             # There was an error.
             self.db_message['points-error'] =\
                 "Points "+network_id+"."+object_id+"."+stream_id+".points Not Searched"
             self.db_message['points-code'] = 400
-            self.debug( "Unexpected error (14):"+str(sys.exc_info()) )
+            self.error( "Unexpected error (14)", exc_info=True )
         
         return searched
         
     
     
+    '''
+    Export points from stream as columns, oldest first. Rows are fetched 
+    from the search (start, end, since, and limit, without the search 
+    maximum) in chunks and packed into contiguous typed columns, without 
+    building a point for each row. Returns a list of (name, descr, count, 
+    data) columns, or None if there was an error.
+    '''
+    @replicaRead
+    def exportPoints(self,ids,export_points_request,at=None,chunk_size=10000):
+        network_id,object_id,stream_id = ids
+        the_id = network_id+'.'+object_id+'.'+stream_id
+        columns = None
+        self.db_message = {}
+        
+        # Validate the search
+        validated_request, schema_message = \
+            WallflowerSchema().validatePointsRequest(export_points_request,'search')
+        if not schema_message['points-valid-request']:
+            self.db_message.update( schema_message )
+            self.db_message['points-error'] = 'Invalid request'
+            self.db_message['points-code'] = 400
+            return columns
+        search_points_details = validated_request['points']
+            
+        points_details = self.getPointsDetails(ids)
+        if points_details is None:
+            self.db_message['points-error'] =\
+                'Points '+the_id+' does not exist and export request cannot be completed.'
+            self.db_message['points-code'] = 404
+            self.info( self.db_message['points-error'] )
+            return columns
+            
+        try:
+            code, descr = getColumnFormat(points_details)
+        except BinaryPointsError, err:
+            self.db_message['points-error'] = str(err)
+            self.db_message['points-code'] = 406
+            return columns
+        
+        try:
+            if self.isSegmentStream(points_details):
+                rows, since = self.segmentRows(
+                    ids,
+                    points_details,
+                    search_points_details,
+                    search_points_details.get('limit'),
+                    True
+                )
+                result = SegmentResult(rows)
+            else:
+                points_table = self.getPointsTable(ids,points_details)
+                statement, since = self.pointsStatement(points_table,search_points_details)
+                statement = statement.order_by(None).order_by(points_table.c.timestamp.asc())
+                if 'limit' in search_points_details:
+                    statement = statement.limit(search_points_details['limit'])
+                # Use a server side cursor where the database supports it
+                statement = statement.execution_options(stream_results=True)
+                result = self.db.session.execute(statement)
+            
+            value_count = max(points_details['points-length'],1)
+            timestamp_chunks = []
+            value_chunks = [ [] for j in range(value_count) ]
+            count = 0
+            last = None
+            
+            cold_rows = None
+            if self.cold_storage and not self.isSegmentStream(points_details):
+                cold_rows = self.coldRowsAscending( ids, points_details, search_points_details )
+            
+            for rows in self.rowChunks(result,cold_rows,chunk_size,search_points_details.get('limit')):
+                # Transpose the chunk into columns
+                chunk_columns = zip(*rows)
+                timestamp_chunks.append( packTimestampColumn(chunk_columns[0]) )
+                for j in range(value_count):
+                    value_chunks[j].append( packColumn(code,chunk_columns[j+1]) )
+                count += len(rows)
+                last = chunk_columns[0][-1]
+            
+            columns = [('at',timestamp_descr,count,''.join(timestamp_chunks))]
+            if 0 == points_details['points-length']:
+                columns.append( ('value',descr,count,''.join(value_chunks[0])) )
+            else:
+                for j in range(value_count):
+                    columns.append( ('value'+str(j),descr,count,''.join(value_chunks[j])) )
+            
+            # High-water mark for the next points-since export
+            if last is not None:
+                self.db_message['points-cursor'] = last.strftime(self.datetime_format_full)
+            elif since is not None:
+                self.db_message['points-cursor'] = since.strftime(self.datetime_format_full)
+                
+            self.db_message['points-count'] = count
+            self.db_message['points-details'] = points_details
+            self.db_message['points-message'] = "Points "+the_id+".points Exported"
+            self.db_message['points-code'] = 200
+            self.debug( "Points %s.points Exported", the_id )
+            
+        except BinaryPointsError, err:
+            columns = None
+            self.db_message['points-error'] = str(err)
+            self.db_message['points-code'] = 406
+            
+        except OperationalError, err:
+            columns = None
+            self.db_message['points-error'] = "Points "+the_id+".points Not Exported"
+            self.db_message['points-code'] = 400
+            self.warning( "Error: Points %s.points Not Exported", the_id )
+            self.warning( err )
+            self.rollback()
+            
+        except:
+            # There was an error.
+            columns = None
+            self.db_message['points-error'] = "Points "+the_id+".points Not Exported"
+            self.db_message['points-code'] = 400
+            self.error( "Unexpected error (17)", exc_info=True )
+            
+        return columns
+        
+    '''
+    Search points from multiple streams of a network with one shared
+    search (start, end, since, and limit). stream_ids is a list of 
+    (object_id, stream_id) pairs. The network and all streams are 
+    loaded with one query each, then each points table is queried once.
+    '''
+    @replicaRead
+    def searchMultiplePoints(self,ids,stream_ids,search_points_request,at=None):
+        network_id = ids[0]
+        searched = False
+        self.db_message = {}
+        
+        # Validate the shared search
+        validated_request, schema_message = \
+            WallflowerSchema().validatePointsRequest(search_points_request,'search')
+        if not schema_message['points-valid-request']:
+            self.db_message.update( schema_message )
+            self.db_message['points-error'] = 'Invalid request'
+            self.db_message['points-code'] = 400
+            return searched
+        
+        # Check for the network
+        network_exists, net = self.networkExists((network_id,))
+        if not network_exists:
+            self.db_message['network-error'] =\
+                'Network '+network_id+' does not exist and '+\
+                'points search request cannot be completed.'
+            self.db_message['network-code'] = 404
+            self.info( self.db_message['network-error'] )
+            return searched
+        
+        try:
+            # Load the metadata of all requested streams
+            object_ids = list(set( object_id for object_id, stream_id in stream_ids ))
+            all_stream_ids = list(set( stream_id for object_id, stream_id in stream_ids ))
+            streams = {}
+            if len(stream_ids) > 0:
+                for stm in Stream.query.filter(
+                        Stream.network_id == network_id,
+                        Stream.object_id.in_(object_ids),
+                        Stream.stream_id.in_(all_stream_ids)).all():
+                    streams[(stm.object_id,stm.stream_id)] = stm
+                    
+            self.db_message['objects'] = {}
+            for object_id, stream_id in stream_ids:
+                if object_id not in self.db_message['objects']:
+                    self.db_message['objects'][object_id] = {
+                        'object-id': object_id,
+                        'streams': {}
+                    }
+                stream_message = { 'stream-id': stream_id }
+                self.db_message['objects'][object_id]['streams'][stream_id] = stream_message
+                the_id = network_id+'.'+object_id+'.'+stream_id
+                
+                if (object_id,stream_id) not in streams:
+                    stream_message['points-error'] =\
+                        'Points '+the_id+' does not exist and search request cannot be completed.'
+                    stream_message['points-code'] = 404
+                    continue
+                    
+                points_details = json.loads( streams[(object_id,stream_id)].points_details )
+                try:
+                    points, cursor = self.queryPoints( 
+                        (network_id,object_id,stream_id), 
+                        points_details, 
+                        validated_request['points']
+                    )
+                    self.countStreamRead( (network_id,object_id,stream_id), len(points) )
+                    if cursor is not None:
+                        stream_message['points-cursor'] = cursor
+                    stream_message['points-details'] = points_details
+                    stream_message['points'] = points
+                    stream_message['points-code'] = 200
+                except OperationalError, err:
+                    stream_message['points-error'] = "Points "+the_id+".points Not Searched"
+                    stream_message['points-code'] = 400
+                    self.warning( "Error: Points %s.points Not Searched", the_id )
+                    self.warning( err )
+                    self.rollback()
+                    
+            searched = True
+            self.db_message['points-message'] = "Points "+network_id+".points Searched"
+            self.db_message['points-code'] = 200
+            self.debug( "Points %s.points Searched", network_id )
+            
+        except OperationalError, err:
+            self.db_message['points-error'] = "Points "+network_id+".points Not Searched"
+            self.db_message['points-code'] = 400
+            self.warning( "Error: Points %s.points Not Searched", network_id )
+            self.warning( err )
+            self.rollback()
+            
+        except:
+            # There was an error.
+            self.db_message['points-error'] = "Points "+network_id+".points Not Searched"
+            self.db_message['points-code'] = 400
+            self.error( "Unexpected error (25)", exc_info=True )
+            
+        return searched
+        
+    '''
+    Claim an Idempotency-Key for a request. Returns ('new', None) if the
+    request should run, ('replay', record) if it has completed, 
+    ('in-progress', None) if it is running, or ('mismatch', None) if the 
+    key was used for a different request. Keys expire after ttl seconds, 
+    and the oldest keys are removed beyond max_keys (see 
+    pruneIdempotencyKeys). A request in progress for longer than 
+    lock_timeout seconds is assumed lost.
+    '''
+    def claimIdempotencyKey(self,key,fingerprint,ttl,max_keys,lock_timeout):
+        now = datetime.datetime.utcnow()
+        self.pruneIdempotencyKeys(ttl,max_keys)
+        try:
+            record = IdempotencyKey.query.filter_by(key=key).first()
+            if record is None:
+                self.db.session.add( IdempotencyKey(key,fingerprint) )
+                self.commit()
+                return 'new', None
+            if record.created_at < now - datetime.timedelta(seconds=ttl):
+                # Expired, but not pruned yet
+                record.fingerprint = fingerprint
+                record.response_status = None
+                record.response_type = None
+                record.response_data = None
+                record.created_at = now
+                self.commit()
+                return 'new', None
+            self.commit()
+            
+            if record.fingerprint != fingerprint:
+                return 'mismatch', None
+            if record.response_status is not None:
+                return 'replay', record
+            if record.created_at < now - datetime.timedelta(seconds=lock_timeout):
+                record.created_at = now
+                self.commit()
+                return 'new', None
+            return 'in-progress', None
+            
+        except IntegrityError:
+            # Claimed by a concurrent request
+            self.rollback()
+            return 'in-progress', None
+            
+    '''
+    Remove the expired keys, and the oldest keys beyond max_keys. Keys
+    are pruned at most every idempotency_prune_interval seconds by each
+    process, so claims do not add write transactions of their own.
+    '''
+    def pruneIdempotencyKeys(self,ttl,max_keys):
+        with self.idempotency_lock:
+            if time.time() < self.idempotency_pruned_at + self.idempotency_prune_interval:
+                return
+            self.idempotency_pruned_at = time.time()
+        try:
+            IdempotencyKey.query.filter(
+                IdempotencyKey.created_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+            ).delete(synchronize_session=False)
+            last_id = self.db.session.query( func.max(IdempotencyKey.id) ).scalar()
+            if last_id is not None and last_id > max_keys:
+                IdempotencyKey.query.filter(
+                    IdempotencyKey.id <= last_id - max_keys
+                ).delete(synchronize_session=False)
+            self.commit()
+        except OperationalError, err:
+            # Pruned by a later claim
+            self.rollback()
+            self.warning( "Idempotency keys not pruned: %s", err )
+            
+    '''
+    Store the response of a request with an Idempotency-Key.
+    '''
+    def storeIdempotentResponse(self,key,status,mimetype,data):
+        try:
+            IdempotencyKey.query.filter_by(key=key).update({
+                'response_status': status,
+                'response_type': mimetype,
+                'response_data': data
+            })
+            self.commit()
+        except:
+            self.rollback()
+            self.error( "Unexpected error (20)", exc_info=True )
+            
+    '''
+    Release an Idempotency-Key whose request failed, so it can be retried.
+    '''
+    def releaseIdempotencyKey(self,key):
+        try:
+            IdempotencyKey.query.filter_by(key=key).delete()
+            self.commit()
+        except:
+            self.rollback()
+            self.error( "Unexpected error (21)", exc_info=True )
+        
+    '''
+    Parse a timestamp in either of the accepted ISO 8601 formats.
+    '''
+    def parseTimestamp(self,timestamp):
+        try:
+            return datetime.datetime.strptime( timestamp, self.datetime_format_full )
+        except ValueError:
+            return datetime.datetime.strptime( timestamp, self.datetime_format_min )
+    
     '''
     Check if network exists.    
     '''
     def networkExists(self,ids):
         network_id = ids[0]
+        exists = getattr(self.local,'exists',None)
+        if exists is not None:
+            # Records loaded for the batch
+            record = exists.get(tuple(ids))
+            return record is not None, record
         network_record = Network.query.filter_by(network_id=network_id).first()
         if network_record is None:
-            self.debug( "Network "+network_id+" Not Found" )
+            self.debug( "Network %s Not Found", network_id )
             return False, None
         else:
-            self.debug( "Network "+network_id+" Found" )
+            self.debug( "Network %s Found", network_id )
             return True, network_record
         
     '''
@@ -1602,12 +3971,17 @@ class WallflowerDB:
     '''
     def objectExists(self,ids):
         network_id,object_id = ids
+        exists = getattr(self.local,'exists',None)
+        if exists is not None:
+            # Records loaded for the batch
+            record = exists.get(tuple(ids))
+            return record is not None, record
         object_record = Object.query.filter_by(network_id=network_id,object_id=object_id).first()
         if object_record is None:
-            self.debug( "Object "+network_id+"."+object_id+" Not Found" )
+            self.debug( "Object %s.%s Not Found", network_id, object_id )
             return False, None
         else:
-            self.debug( "Object "+network_id+"."+object_id+" Found" )
+            self.debug( "Object %s.%s Found", network_id, object_id )
             return True, object_record
         
     '''
@@ -1615,19 +3989,24 @@ class WallflowerDB:
     '''
     def streamExists(self,ids):
         network_id,object_id,stream_id = ids
+        exists = getattr(self.local,'exists',None)
+        if exists is not None:
+            # Records loaded for the batch
+            record = exists.get(tuple(ids))
+            return record is not None, record
         stream_record = Stream.query.filter_by(network_id=network_id,object_id=object_id,stream_id=stream_id).first()
         if stream_record is None:
-            self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Not Found" )
+            self.debug( "Stream %s.%s.%s Not Found", network_id, object_id, stream_id )
             return False, None
         else:
-            self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" Found" )
+            self.debug( "Stream %s.%s.%s Found", network_id, object_id, stream_id )
             return True, stream_record
             '''
             try:
                 contents = self.db.session.execute(select([points_table]).limit(1)).fetchall()
 
             except:
-                self.debug( "Stream "+network_id+"."+object_id+"."+stream_id+" DB Not Found" )
-                self.debug( err )
+                self.debug( "Stream %s.%s.%s DB Not Found", network_id, object_id, stream_id )
+                self.warning( err )
                 return False, None
             '''
\ No newline at end of file
@@ -0,0 +1,189 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import Queue
+
+'''
+Formats records as one JSON object per line.
+'''
+class JSONFormatter(logging.Formatter):
+
+    def format(self,record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S',time.gmtime(record.created))+\
+                '.%03dZ' % record.msecs,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif getattr(record,'exc_text',None):
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+'''
+Keeps one of every n DEBUG and INFO records with the same logger and
+message template. Rates are given by logger name (0.01 keeps 1 in 100),
+and apply to child loggers. Warnings and errors are never sampled.
+'''
+class SamplingFilter(logging.Filter):
+
+    def __init__(self,rates):
+        logging.Filter.__init__(self)
+        self.rates = rates
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self,record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name = record.name
+        rate = None
+        while rate is None and name:
+            rate = self.rates.get(name)
+            name = name.rpartition('.')[0]
+        if rate is None or rate >= 1:
+            return True
+        every = max( int(round(1.0/rate)), 1 ) if rate > 0 else 0
+        if every == 0:
+            return False
+        key = (record.name, record.msg)
+        with self.lock:
+            count = self.counts.get(key,0)
+            self.counts[key] = count + 1
+            if len(self.counts) > 10000:
+                self.counts.clear()
+        return count % every == 0
+
+'''
+Puts records on a bounded queue, to be written by a background thread,
+so requests never block on output. Records are formatted before they
+are queued. When the queue is full, records are dropped and counted.
+The writer thread is started by the first record of each process, so
+gunicorn workers forked after configuration have their own writer.
+'''
+class QueueHandler(logging.Handler):
+
+    def __init__(self,target,size=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue.Queue(size)
+        self.dropped = 0
+        self.pid = None
+        self.writer_lock = threading.Lock()
+
+    def emit(self,record):
+        if self.pid != os.getpid():
+            self.startWriter()
+        try:
+            # Format now, so arguments and tracebacks are not kept
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+        except:
+            self.handleError(record)
+
+    def startWriter(self):
+        with self.writer_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            writer = threading.Thread(target=self.write)
+            writer.daemon = True
+            writer.start()
+
+    def write(self):
+        while True:
+            record = self.queue.get()
+            try:
+                self.target.handle(record)
+            except:
+                pass
+
+    '''
+    Return the number of queued records.
+    '''
+    def depth(self):
+        return self.queue.qsize()
+
+    '''
+    Wait until the queued records are written, or timeout seconds.
+    '''
+    def flush(self,timeout=1.0):
+        end = time.time() + timeout
+        while not self.queue.empty() and time.time() < end:
+            time.sleep(0.01)
+        self.target.flush()
+
+'''
+Return the logger of a part of the server, such as 'db' or 'server'.
+'''
+def getLogger(name):
+    return logging.getLogger('wallflower.'+name)
+
+'''
+Configure the wallflower loggers from the logging section of the config:
+level (default WARNING), levels by logger name (e.g. 'wallflower.db'),
+format (text or json), stream (stdout or stderr), queue-size, and
+sample rates by logger name. Returns the QueueHandler.
+'''
+def configureLogging(config):
+    root = logging.getLogger('wallflower')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel( logging.getLevelName( str(config.get('level','WARNING')).upper() ) )
+    for name, level in config.get('levels',{}).items():
+        logging.getLogger(name).setLevel( logging.getLevelName( str(level).upper() ) )
+
+    target = logging.StreamHandler( sys.stderr if config.get('stream') == 'stderr' else sys.stdout )
+    if config.get('format','text') == 'json':
+        target.setFormatter( JSONFormatter() )
+    else:
+        target.setFormatter( logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s') )
+
+    handler = QueueHandler( target, config.get('queue-size',10000) )
+    if len(config.get('sample',{})) > 0:
+        handler.addFilter( SamplingFilter(config['sample']) )
+    root.addHandler(handler)
+    root.propagate = False
+    return handler
@@ -0,0 +1,366 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import os
+import json
+import time
+import uuid
+import glob
+import errno
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''
+Return the series name of a metric with labels, as in the Prometheus
+text format. Labels are given as a sequence of (name, value) pairs.
+'''
+def seriesName(name,labels=()):
+    if len(labels) == 0:
+        return name
+    return name+'{'+','.join(
+        label+'="'+str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')+'"'
+        for label, value in labels
+    )+'}'
+
+'''
+Counters, histograms and gauges of a server process, exported in the
+Prometheus text format. When path is given, each process writes its
+values to a file in path every interval seconds (and when scraped),
+and the values of all files are summed, so the metrics of all gunicorn
+workers are aggregated. When scraped, the files of stopped workers are
+merged into one aggregate file, so counters never go backwards and the
+number of files does not grow with restarts. Gauges are only read from
+recently written files.
+'''
+class WallflowerMetrics(object):
+
+    # Upper bounds of the histogram buckets, in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # File of the merged values of stopped workers
+    aggregate_name = 'aggregate.json'
+
+    def __init__(self,path=None,interval=5):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.pid = None
+        self.file_name = None
+
+    '''
+    Describe a metric. Kind is counter, histogram, or gauge.
+    '''
+    def describe(self,name,kind,description,buckets=None):
+        self.kinds[name] = (kind, buckets or self.buckets)
+        self.descriptions[name] = description
+
+    '''
+    Add value to a counter.
+    '''
+    def inc(self,name,labels=(),value=1):
+        series = seriesName(name,labels)
+        with self.lock:
+            self.counters[series] = self.counters.get(series,0) + value
+        self.started()
+
+    '''
+    Add an observation to a histogram.
+    '''
+    def observe(self,name,value,labels=()):
+        series = seriesName(name,labels)
+        buckets = self.kinds.get(name,(None,self.buckets))[1]
+        with self.lock:
+            histogram = self.histograms.get(series)
+            if histogram is None:
+                histogram = self.histograms[series] = {
+                    'name': name,
+                    'labels': list(labels),
+                    'buckets': [0]*len(buckets),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            for i in range(len(buckets)):
+                if value <= buckets[i]:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.started()
+
+    '''
+    Register a gauge. Function is called when the gauge is collected
+    and returns the current value.
+    '''
+    def gauge(self,name,function,labels=()):
+        self.gauges[seriesName(name,labels)] = function
+
+    '''
+    Start the writer of a process on its first update. Processes forked
+    by gunicorn start their own writer and file.
+    '''
+    def started(self):
+        if self.path is None or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.file_name = os.path.join( self.path, str(self.pid)+'-'+uuid.uuid4().hex[:8]+'.json' )
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass
+        writer = threading.Thread(target=self.writeLoop)
+        writer.daemon = True
+        writer.start()
+
+    def writeLoop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except (IOError, OSError):
+                pass
+
+    '''
+    Return the values of this process.
+    '''
+    def snapshot(self):
+        with self.lock:
+            values = {
+                'counters': dict(self.counters),
+                'histograms': json.loads( json.dumps(self.histograms) ),
+            }
+        values['gauges'] = {}
+        for series, function in self.gauges.items():
+            try:
+                values['gauges'][series] = function()
+            except:
+                pass
+        return values
+
+    '''
+    Write the values of this process to its file.
+    '''
+    def write(self):
+        if self.file_name is None:
+            return
+        temp_name = self.file_name+'.tmp'
+        with open(temp_name,'wb') as f:
+            json.dump( self.snapshot(), f )
+        os.rename( temp_name, self.file_name )
+
+    '''
+    Add the counters and histograms of values to total.
+    '''
+    def add(self,total,values):
+        for series, value in values['counters'].items():
+            total['counters'][series] = total['counters'].get(series,0) + value
+        for series, histogram in values['histograms'].items():
+            if series not in total['histograms']:
+                total['histograms'][series] = histogram
+                continue
+            merged = total['histograms'][series]
+            merged['buckets'] = [ a+b for a, b in zip(merged['buckets'],histogram['buckets']) ]
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+
+    '''
+    Return True when the worker of a file is stopped: its process is
+    gone, or the file was not written for many intervals (the pid was
+    reused). Running workers write their file every interval.
+    '''
+    def stopped(self,file_name):
+        try:
+            pid = int( os.path.basename(file_name).split('-',1)[0] )
+        except ValueError:
+            return False
+        if pid == self.pid:
+            return False
+        try:
+            os.kill(pid,0)
+        except OSError, err:
+            if err.errno == errno.ESRCH:
+                return True
+        try:
+            return os.path.getmtime(file_name) < time.time() - 60*self.interval
+        except OSError:
+            return False
+
+    '''
+    Merge the files of stopped workers into the aggregate file and
+    remove them. Gauges of stopped workers are dropped. Called with
+    the lock file held, so files are merged once and never read while
+    they are merged.
+    '''
+    def merge(self):
+        file_names = [
+            file_name for file_name in glob.glob( os.path.join(self.path,'*-*.json') )
+            if self.stopped(file_name)
+        ]
+        if len(file_names) == 0:
+            return
+        aggregate_name = os.path.join(self.path,self.aggregate_name)
+        total = {'counters': {}, 'histograms': {}, 'gauges': {}}
+        try:
+            with open(aggregate_name,'rb') as f:
+                self.add( total, json.load(f) )
+        except (IOError, ValueError):
+            pass
+        merged = []
+        for file_name in file_names:
+            try:
+                with open(file_name,'rb') as f:
+                    self.add( total, json.load(f) )
+            except (IOError, ValueError):
+                continue
+            merged.append(file_name)
+        temp_name = aggregate_name+'.tmp'
+        with open(temp_name,'wb') as f:
+            json.dump( total, f )
+        os.rename( temp_name, aggregate_name )
+        for file_name in merged:
+            os.remove(file_name)
+
+    '''
+    Return the values of all processes, summed.
+    '''
+    def collect(self):
+        if self.path is None:
+            return self.snapshot()
+        self.started()
+        self.write()
+
+        # Files of stopped workers are only merged where files can be
+        # locked, and their processes checked
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open( os.path.join(self.path,'aggregate.lock'), 'a' )
+            fcntl.flock(lock_file,fcntl.LOCK_EX)
+        try:
+            if lock_file is not None:
+                try:
+                    self.merge()
+                except (IOError, OSError):
+                    pass
+
+            total = {'counters': {}, 'histograms': {}, 'gauges': {}}
+            now = time.time()
+            for file_name in glob.glob( os.path.join(self.path,'*.json') ):
+                try:
+                    with open(file_name,'rb') as f:
+                        values = json.load(f)
+                    modified = os.path.getmtime(file_name)
+                except (IOError, OSError, ValueError):
+                    continue
+                self.add( total, values )
+                if modified >= now - 3*self.interval:
+                    for series, value in values.get('gauges',{}).items():
+                        total['gauges'][series] = total['gauges'].get(series,0) + value
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file,fcntl.LOCK_UN)
+                lock_file.close()
+        return total
+
+    '''
+    Return all metrics in the Prometheus text format.
+    '''
+    def render(self):
+        values = self.collect()
+        lines = []
+        described = set()
+
+        def header(series):
+            name = series.split('{',1)[0]
+            if name in described:
+                return
+            described.add(name)
+            if name in self.descriptions:
+                lines.append( '# HELP '+name+' '+self.descriptions[name] )
+                lines.append( '# TYPE '+name+' '+self.kinds[name][0] )
+
+        for series in sorted(values['counters']):
+            header(series)
+            lines.append( series+' '+repr(float(values['counters'][series])) )
+        for series in sorted(values['gauges']):
+            header(series)
+            lines.append( series+' '+repr(float(values['gauges'][series])) )
+        for series in sorted(values['histograms']):
+            histogram = values['histograms'][series]
+            name = histogram['name']
+            labels = [ tuple(label) for label in histogram['labels'] ]
+            buckets = self.kinds.get(name,(None,self.buckets))[1]
+            header(name)
+            for i in range(len(buckets)):
+                lines.append( seriesName(name+'_bucket',labels+[('le',repr(float(buckets[i])))])+\
+                    ' '+str(histogram['buckets'][i]) )
+            lines.append( seriesName(name+'_bucket',labels+[('le','+Inf')])+' '+str(histogram['count']) )
+            lines.append( seriesName(name+'_sum',labels)+' '+repr(histogram['sum']) )
+            lines.append( seriesName(name+'_count',labels)+' '+str(histogram['count']) )
+        return '\n'.join(lines)+'\n'
+
+'''
+Times the phases of the startup of a server process. Each mark ends
+the phase started by the previous mark (or by start_time).
+'''
+class WallflowerStartup(object):
+
+    def __init__(self,start_time=None):
+        self.start_time = start_time or time.time()
+        self.last_time = self.start_time
+        self.phases = []
+
+    def mark(self,phase):
+        now = time.time()
+        self.phases.append( (phase, now-self.last_time) )
+        self.last_time = now
+
+    '''
+    Return the seconds from the start to the last mark.
+    '''
+    def total(self):
+        return self.last_time - self.start_time
+
+    def dict(self):
+        return {
+            'startup-seconds': self.total(),
+            'startup-phases': [ {'phase': phase, 'seconds': seconds} for phase, seconds in self.phases ]
+        }
@@ -39,9 +39,25 @@ import uuid
 from base.wallflower_packet import WallflowerPacket
 from base.wallflower_schema import getPythonType
 
-from flask.ext.sqlalchemy import SQLAlchemy
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, inspect
 
-db = SQLAlchemy()
+'''
+Session that sends queries to the 'replica' bind while the session 
+info has replica set (see WallflowerDB.readReplica). Flushes always 
+go to the primary.
+'''
+class WallflowerSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if self.info.get('replica') and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind='replica')
+        return SignallingSession.get_bind(self, mapper, clause)
+        
+class WallflowerSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return WallflowerSession(self, **options)
+
+db = WallflowerSQLAlchemy()
         
 class Network(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
@@ -138,8 +154,163 @@ class Stream(db.Model):
     def dict(self):
         return dict((col, getattr(self, col)) for col in self.__table__.columns.keys())
         
+'''
+Compressed chunk of the older points of a stream (cold storage). 
+Chunks are immutable, data is encoded by base.wallflower_compression.
+'''
+class PointsChunk(db.Model):
+    id = db.Column(db.Integer(), primary_key=True)
+    network_id = db.Column(db.String(80), unique=False)
+    object_id = db.Column(db.String(80), unique=False)
+    stream_id = db.Column(db.String(80), unique=False)
+    start_at = db.Column(db.DateTime())
+    end_at = db.Column(db.DateTime())
+    count = db.Column(db.Integer())
+    data = db.deferred(db.Column(db.LargeBinary()))
+    created_at = db.Column(db.DateTime())
+    
+    __table_args__ = (
+        db.Index('ix_points_chunk_stream_end', 'network_id', 'object_id', 'stream_id', 'end_at'),
+    )
+    
+    def __init__(self, network_id, object_id, stream_id, start_at, end_at, count, data):
+        self.network_id = network_id
+        self.object_id = object_id
+        self.stream_id = stream_id
+        self.start_at = start_at
+        self.end_at = end_at
+        self.count = count
+        self.data = data
+        self.created_at = datetime.datetime.utcnow()
+        
+    def __repr__(self):
+        return '<PointsChunk %r>' % self.network_id+'.'+self.object_id+'.'+self.stream_id
+
+
+'''
+Dictionary of a stream with points-encoding 'dictionary'. The points
+table holds the integer code of each value. Codes are never changed
+or reused while the stream exists.
+'''
+class PointsDictionary(db.Model):
+    id = db.Column(db.Integer(), primary_key=True)
+    network_id = db.Column(db.String(80), unique=False)
+    object_id = db.Column(db.String(80), unique=False)
+    stream_id = db.Column(db.String(80), unique=False)
+    code = db.Column(db.Integer())
+    value = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.UniqueConstraint('network_id', 'object_id', 'stream_id', 'code', name='uq_points_dictionary_code'),
+        db.UniqueConstraint('network_id', 'object_id', 'stream_id', 'value', name='uq_points_dictionary_value'),
+    )
+
+    def __init__(self, network_id, object_id, stream_id, code, value):
+        self.network_id = network_id
+        self.object_id = object_id
+        self.stream_id = stream_id
+        self.code = code
+        self.value = value
+
+    def __repr__(self):
+        return '<PointsDictionary %r>' % self.network_id+'.'+self.object_id+'.'+self.stream_id
+
+
+'''
+Idempotency-Key of a recent points update or bulk request, with its 
+response. The response is None while the request is in progress.
+'''
+class IdempotencyKey(db.Model):
+    id = db.Column(db.Integer(), primary_key=True)
+    key = db.Column(db.String(255), unique=True)
+    fingerprint = db.Column(db.String(40))
+    response_status = db.Column(db.Integer())
+    response_type = db.Column(db.String(80))
+    response_data = db.deferred(db.Column(db.LargeBinary()))
+    created_at = db.Column(db.DateTime(), index=True)
+    
+    def __init__(self, key, fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.created_at = datetime.datetime.utcnow()
+        
+    def __repr__(self):
+        return '<IdempotencyKey %r>' % self.key
+
+
+'''
+Usage statistics of a stream, flushed from the counters of the server
+processes (see WallflowerDB.flushStreamStats). Rates are points written
+and read requests per second over the last completed window. Rows and 
+bytes are estimates of the points stored, over all tiers.
+'''
+class StreamStats(db.Model):
+    id = db.Column(db.Integer(), primary_key=True)
+    network_id = db.Column(db.String(80), unique=False)
+    object_id = db.Column(db.String(80), unique=False)
+    stream_id = db.Column(db.String(80), unique=False)
+    writes = db.Column(db.BigInteger(), default=0)
+    reads = db.Column(db.BigInteger(), default=0)
+    points_written = db.Column(db.BigInteger(), default=0)
+    points_read = db.Column(db.BigInteger(), default=0)
+    write_rate = db.Column(db.Float(), default=0.0)
+    read_rate = db.Column(db.Float(), default=0.0)
+    window_points_written = db.Column(db.BigInteger(), default=0)
+    window_reads = db.Column(db.BigInteger(), default=0)
+    window_start = db.Column(db.Float())
+    last_write_at = db.Column(db.DateTime())
+    rows = db.Column(db.BigInteger())
+    bytes = db.Column(db.BigInteger())
+    estimated_at = db.Column(db.Float())
+    updated_at = db.Column(db.DateTime())
+    
+    __table_args__ = (
+        db.UniqueConstraint('network_id', 'object_id', 'stream_id', name='uq_stream_stats_stream'),
+    )
+    
+    def __init__(self, network_id, object_id, stream_id):
+        self.network_id = network_id
+        self.object_id = object_id
+        self.stream_id = stream_id
+        self.writes = 0
+        self.reads = 0
+        self.points_written = 0
+        self.points_read = 0
+        self.write_rate = 0.0
+        self.read_rate = 0.0
+        self.window_points_written = 0
+        self.window_reads = 0
+        self.updated_at = datetime.datetime.utcnow()
+        
+    def __repr__(self):
+        return '<StreamStats %r>' % self.network_id+'.'+self.object_id+'.'+self.stream_id
         
-def createPointsTable( table_name, data_type, data_length=0 ):
+
+'''
+Attach the shard files of the points tables to each new connection
+of a SQLite engine, as the schemas shard0, shard1, ...
+'''
+def attachShards( engine, shard_files ):
+    @event.listens_for(engine, 'connect')
+    def attach(dbapi_connection, connection_record):
+        for i in range(len(shard_files)):
+            dbapi_connection.execute( 'ATTACH DATABASE ? AS shard'+str(i), (shard_files[i],) )
+
+'''
+Create the tables of the models that do not exist yet. The existing
+tables are listed with one catalog query, instead of one query per
+table as with db.create_all(), so a worker starting on an existing
+database does not check or lock the schema. Returns the created tables.
+'''
+def createModelTables( engine ):
+    existing = set( inspect(engine).get_table_names() )
+    missing = [ table for table in db.metadata.sorted_tables if table.name not in existing ]
+    if len(missing) > 0:
+        db.metadata.create_all( engine, tables=missing )
+    return [ table.name for table in missing ]
+
+
+def createPointsTable( table_name, data_type, data_length=0, schema=None ):
     metadata = db.MetaData()
     '''
     timestamp date
@@ -154,42 +325,50 @@ def createPointsTable( table_name, data_type, data_length=0 ):
         if data_type is basestring:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                 db.Column('value', db.String(255))
+                 db.Column('value', db.String(255)),
+                 schema=schema
             )
         elif data_type is int:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                 db.Column('value', db.Integer())
+                 db.Column('value', db.Integer()),
+                 schema=schema
             )
         elif data_type is float:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                 db.Column('value', db.Float())
+                 db.Column('value', db.Float()),
+                 schema=schema
             )
         elif data_type is bool:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                 db.Column('value', db.Boolean())
+                 db.Column('value', db.Boolean()),
+                 schema=schema
             )
     else:
         if data_type is basestring:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                *(db.Column('value'+str(i), db.String(255)) for i in range(data_length))
+                *(db.Column('value'+str(i), db.String(255)) for i in range(data_length)),
+                 schema=schema
             )
         elif data_type is int:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                *(db.Column('value'+str(i), db.Integer()) for i in range(data_length))
+                *(db.Column('value'+str(i), db.Integer()) for i in range(data_length)),
+                 schema=schema
             )
         elif data_type is float:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                *(db.Column('value'+str(i), db.Float()) for i in range(data_length))
+                *(db.Column('value'+str(i), db.Float()) for i in range(data_length)),
+                 schema=schema
             )
         elif data_type is bool:
             return db.Table(table_name, metadata,
                  db.Column('timestamp', db.DateTime(), primary_key=True),
-                *(db.Column('value'+str(i), db.Boolean()) for i in range(data_length))
+                *(db.Column('value'+str(i), db.Boolean()) for i in range(data_length)),
+                 schema=schema
             )
         
\ No newline at end of file
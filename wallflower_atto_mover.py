@@ -0,0 +1,109 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''
+Background mover of points from the hot tier (points tables) to the 
+cold tier (compressed chunks). Every interval seconds, the points older 
+than age seconds are sealed, batch points at a time per stream. When 
+the server runs as several processes, the lock file lets only one of 
+them move points at a time.
+'''
+class WallflowerPointsMover(threading.Thread):
+    
+    def __init__(self,app,atto_db,age,interval=60,batch=10000,lock_path='wallflower_mover.lock'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.app = app
+        self.atto_db = atto_db
+        self.age = age
+        self.interval = interval
+        self.batch = batch
+        self.lock_path = lock_path
+        
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.movePoints()
+            except Exception, err:
+                self.atto_db.error( "Points mover error: %s", err )
+                
+    '''
+    Move the points older than age to the cold tier. Returns the number 
+    of points moved, or None if another process is moving points.
+    '''
+    def movePoints(self):
+        lock_file = open(self.lock_path,'a')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file,fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return None
+            with self.app.app_context():
+                moved = self.atto_db.migratePoints(self.age,self.batch)
+            if moved > 0:
+                self.atto_db.info( "Points mover: %s points moved", moved )
+            return moved
+        finally:
+            lock_file.close()
+
+'''
+Background flusher of the stream usage counters of this process to 
+the stream_stats table, every interval seconds.
+'''
+class WallflowerStatsFlusher(threading.Thread):
+    
+    def __init__(self,app,atto_db,interval=10,window=60,estimate_interval=300):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.app = app
+        self.atto_db = atto_db
+        self.interval = interval
+        self.window = window
+        self.estimate_interval = estimate_interval
+        
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.atto_db.flushStreamStats(self.window,self.estimate_interval)
+            except Exception, err:
+                self.atto_db.error( "Stream stats flush error: %s", err )
@@ -0,0 +1,140 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import os
+import sys
+import time
+import thread
+import threading
+
+'''
+Statistical profiler of the threads of a server process. A sampler
+thread only runs while a profile is taken, and reads the stacks of the
+other threads every interval seconds. Stacks are counted in the
+collapsed format of flamegraph.pl (frames from root to leaf separated
+by ';'). Frames of methods are labelled by class, e.g. 
+WallflowerDB.readNetwork or WallflowerSchema.validateRequest.
+'''
+class WallflowerProfiler(object):
+
+    def __init__(self,max_seconds=60,interval=0.01):
+        self.max_seconds = max_seconds
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.labels = {}
+        
+    '''
+    Sample the stacks for seconds. Returns the count of each collapsed
+    stack, and the number of samples, or None if a profile is already
+    being taken. Threads in ignore (and the sampler) are not sampled.
+    '''
+    def profile(self,seconds,interval=None,ignore=()):
+        if not self.lock.acquire(False):
+            return None
+        try:
+            seconds = min( max(seconds,0), self.max_seconds )
+            interval = max( interval or self.interval, 0.001 )
+            stacks = {}
+            result = {'samples': 0}
+            ignore = set(ignore)
+            
+            def sample():
+                ignore.add( thread.get_ident() )
+                end = time.time() + seconds
+                while time.time() < end:
+                    for thread_id, frame in sys._current_frames().items():
+                        if thread_id in ignore:
+                            continue
+                        stack = self.collapse(frame)
+                        stacks[stack] = stacks.get(stack,0) + 1
+                    result['samples'] += 1
+                    time.sleep(interval)
+                    
+            sampler = threading.Thread(target=sample)
+            sampler.daemon = True
+            sampler.start()
+            sampler.join()
+            return stacks, result['samples']
+        finally:
+            self.lock.release()
+            
+    '''
+    Return the collapsed stack of frame.
+    '''
+    def collapse(self,frame):
+        labels = []
+        while frame is not None:
+            labels.append( self.label(frame) )
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+        
+    '''
+    Return the label of the code of a frame, by class for methods and
+    by module for functions. Labels are cached by code object.
+    '''
+    def label(self,frame):
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            module = os.path.splitext( os.path.basename(code.co_filename) )[0]
+            label = module+'.'+code.co_name
+            for value in frame.f_globals.values():
+                if isinstance(value,type) and value.__module__ == frame.f_globals.get('__name__'):
+                    method = value.__dict__.get(code.co_name)
+                    if code in wrappedCodes(method):
+                        label = value.__name__+'.'+code.co_name
+                        break
+            self.labels[code] = label
+        return label
+
+'''
+Return the code of a function and of the functions it wraps (through
+decorators such as WallflowerDB.do).
+'''
+def wrappedCodes(function,depth=3):
+    code = getattr(function,'func_code',None)
+    if code is None:
+        return []
+    codes = [code]
+    if depth > 0:
+        for cell in getattr(function,'func_closure',None) or ():
+            try:
+                codes += wrappedCodes(cell.cell_contents,depth-1)
+            except ValueError:
+                pass
+    return codes
+
+'''
+Return stacks in the collapsed format, one stack and count per line.
+'''
+def collapsedProfile(stacks):
+    return ''.join( stack+' '+str(count)+'\n' for stack, count in sorted(stacks.items()) )
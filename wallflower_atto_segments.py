@@ -0,0 +1,438 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import os
+import mmap
+import shutil
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from base.wallflower_binary import getRecordFormat, datetimeToMicroseconds, microsecondsToDatetime
+
+'''
+Append-only segment files for streams with points-storage 'segment'.
+
+The points of a stream are fixed-width records (see getRecordFormat), 
+appended in time order to memory-mapped segment files in the directory 
+<path>/<network-id>.<object-id>.<stream-id>. Each segment file has a 
+header with the record size and count, followed by room for segment_size 
+records. The record count is updated after the records are written, so 
+readers only see complete records. A sparse time index, the timestamp of 
+every index_interval-th record, is kept in memory for each segment, and 
+range reads unpack records directly from the mapping.
+
+Stream metadata stays in the Stream table. Records are appended, and
+points or streams deleted, once the transaction of the request (or of
+the bulk request) is committed (see WallflowerDB.commit). A rolled back
+transaction leaves the segment files unchanged.
+
+Segment streams support the reject and ignore conflict policies: a 
+point at the timestamp of a stored point is rejected (409) or skipped.
+Other points older than the last point are always rejected (400), and
+the overwrite policy is not supported.
+'''
+
+segment_magic = 'WFSEG\x01'
+segment_header = struct.Struct('<6sHQ')
+segment_header_size = 32
+
+class SegmentError(Exception):
+    pass
+    
+'''
+Raised when a point has the timestamp of a stored point.
+'''
+class SegmentConflictError(SegmentError):
+    pass
+    
+'''
+One memory-mapped segment file.
+'''
+class WallflowerSegment(object):
+    
+    def __init__(self,path,record_format,index_interval,capacity=None):
+        self.path = path
+        self.record = struct.Struct(record_format)
+        self.timestamp = struct.Struct('<q')
+        self.index_interval = index_interval
+        self.index = []
+        
+        if capacity is not None:
+            # Create the segment. Unwritten space is sparse where
+            # the file system supports it.
+            with open(path,'wb') as f:
+                f.write( segment_header.pack(segment_magic,self.record.size,0) )
+                f.truncate( segment_header_size + capacity * self.record.size )
+        
+        self.file = open(path,'r+b')
+        self.mm = mmap.mmap(self.file.fileno(),0)
+        magic, record_size, count = segment_header.unpack_from(self.mm,0)
+        if magic != segment_magic or record_size != self.record.size:
+            self.close()
+            raise SegmentError('Invalid segment file '+path)
+        self.capacity = (len(self.mm) - segment_header_size) // self.record.size
+        
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+        
+    '''
+    Number of records written.
+    '''
+    def count(self):
+        return segment_header.unpack_from(self.mm,0)[2]
+        
+    def timestampAt(self,i):
+        return self.timestamp.unpack_from(self.mm,segment_header_size + i * self.record.size)[0]
+        
+    def recordAt(self,i):
+        return self.record.unpack_from(self.mm,segment_header_size + i * self.record.size)
+        
+    '''
+    Extend the sparse time index to the records written.
+    '''
+    def updateIndex(self,count):
+        while len(self.index) * self.index_interval < count:
+            self.index.append( self.timestampAt( len(self.index) * self.index_interval ) )
+            
+    '''
+    Return the position of the first record with a timestamp of at 
+    least timestamp. The sparse index gives the block, which is then 
+    searched by reading timestamps from the mapping.
+    '''
+    def lowerBound(self,timestamp,count):
+        self.updateIndex(count)
+        lo, hi = 0, len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.index[mid] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        # The record is in the block before index entry lo
+        hi = min( lo * self.index_interval, count )
+        lo = max( (lo - 1) * self.index_interval, 0 )
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestampAt(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+        
+    '''
+    Append records, (timestamp in microseconds, value, ...) tuples. 
+    Returns the number of records written, which is less than the 
+    number of records if the segment is full.
+    '''
+    def append(self,records):
+        count = self.count()
+        written = min( len(records), self.capacity - count )
+        if written > 0:
+            offset = segment_header_size + count * self.record.size
+            data = ''.join( self.record.pack(*record) for record in records[:written] )
+            self.mm[offset:offset+len(data)] = data
+            # Publish the records
+            struct.pack_into('<Q',self.mm,8,count + written)
+        return written
+        
+
+'''
+Result of a segment search, with the fetchmany and close methods of 
+a database result.
+'''
+class SegmentResult(object):
+    
+    def __init__(self,rows):
+        self.rows = rows
+        
+    def fetchmany(self,size):
+        rows = []
+        for row in self.rows:
+            rows.append( row )
+            if len(rows) >= size:
+                break
+        return rows
+        
+    def fetchall(self):
+        return list(self.rows)
+        
+    def close(self):
+        self.rows = iter([])
+        
+        
+'''
+The segment files of all segment streams.
+'''
+class WallflowerSegmentStore(object):
+    
+    def __init__(self,path,segment_size=1048576,index_interval=256):
+        self.path = path
+        self.segment_size = segment_size
+        self.index_interval = index_interval
+        self.lock = threading.RLock()
+        # Open segments by stream path, as {name: (inode, segment)}
+        self.streams = {}
+        
+    def streamPath(self,ids):
+        return os.path.join( self.path, '.'.join(ids) )
+        
+    '''
+    Return the open segments of a stream, in order. Segments added, 
+    replaced, or removed by other processes are picked up here.
+    '''
+    def segments(self,ids,points_details):
+        stream_path = self.streamPath(ids)
+        record_format = getRecordFormat(points_details)
+        with self.lock:
+            opened = self.streams.setdefault(stream_path,{})
+            names = []
+            if os.path.isdir(stream_path):
+                names = sorted( name for name in os.listdir(stream_path) if name.endswith('.seg') )
+            segments = []
+            for name in names:
+                path = os.path.join(stream_path,name)
+                try:
+                    inode = os.stat(path).st_ino
+                except OSError:
+                    continue
+                if name in opened and opened[name][0] == inode:
+                    segments.append( opened[name][1] )
+                    continue
+                if name in opened:
+                    opened[name][1].close()
+                segment = WallflowerSegment(path,record_format,self.index_interval)
+                opened[name] = (inode, segment)
+                segments.append( segment )
+            for name in set(opened) - set(names):
+                opened.pop(name)[1].close()
+            return segments
+            
+    '''
+    Hold the stream lock of this process and, where supported, 
+    the lock file of the stream for other processes.
+    '''
+    def lockStream(self,ids):
+        stream_path = self.streamPath(ids)
+        if not os.path.isdir(stream_path):
+            os.makedirs(stream_path)
+        lock_file = open( os.path.join(stream_path,'lock'), 'a' )
+        if fcntl is not None:
+            fcntl.flock(lock_file,fcntl.LOCK_EX)
+        return lock_file
+        
+    def unlockStream(self,lock_file):
+        if fcntl is not None:
+            fcntl.flock(lock_file,fcntl.LOCK_UN)
+        lock_file.close()
+        
+    '''
+    Return the records to append for rows, (datetime, value, ...) tuples,
+    in time order. Points at the timestamp of a stored point or of an
+    earlier row raise SegmentConflictError, or are skipped with the 
+    ignore policy. Other points must be newer than the last point.
+    '''
+    def prepare(self,ids,points_details,rows,points_conflict='reject'):
+        if points_conflict == 'overwrite':
+            raise SegmentError('Segment streams do not support the overwrite conflict policy')
+        # Sorted by timestamp only, so the first of equal points is kept
+        records = sorted( 
+            [ (datetimeToMicroseconds(row[0]),) + tuple(row[1:]) for row in rows ],
+            key=lambda record: record[0]
+        )
+        unique = []
+        for record in records:
+            if len(unique) > 0 and record[0] == unique[-1][0]:
+                if points_conflict == 'ignore':
+                    continue
+                raise SegmentConflictError('A point with the same timestamp exists')
+            unique.append( record )
+            
+        last = None
+        segments = self.segments(ids,points_details)
+        for segment in reversed(segments):
+            count = segment.count()
+            if count > 0:
+                last = segment.timestampAt(count - 1)
+                break
+        if last is None or len(unique) == 0 or unique[0][0] > last:
+            return unique
+            
+        stored = set( datetimeToMicroseconds(row[0]) for row in self.select(ids,points_details,
+            microsecondsToDatetime(unique[0][0]), microsecondsToDatetime(last), ascending=True) )
+        for record in unique:
+            if record[0] > last:
+                break
+            if record[0] not in stored:
+                raise SegmentError('Points of segment streams must be newer than the last point')
+            if points_conflict != 'ignore':
+                raise SegmentConflictError('A point with the same timestamp exists')
+        return [ record for record in unique if record[0] > last ]
+        
+    '''
+    Append records, as returned by prepare, to a stream. Points must 
+    be newer than the last point of the stream.
+    '''
+    def append(self,ids,points_details,records):
+        if len(records) == 0:
+            return
+        with self.lock:
+            lock_file = self.lockStream(ids)
+            try:
+                self.appendRecords(ids,points_details,records)
+            finally:
+                self.unlockStream(lock_file)
+                
+    def appendRecords(self,ids,points_details,records):
+        for i in range(1,len(records)):
+            if records[i][0] <= records[i-1][0]:
+                raise SegmentError('Points of segment streams must have distinct timestamps')
+                
+        segments = self.segments(ids,points_details)
+        if len(segments) > 0:
+            last = segments[-1]
+            count = last.count()
+            if count > 0 and records[0][0] <= last.timestampAt(count - 1):
+                raise SegmentError('Points of segment streams must be newer than the last point')
+                
+        while len(records) > 0:
+            if len(segments) == 0 or segments[-1].count() >= segments[-1].capacity:
+                sequence = 0
+                if len(segments) > 0:
+                    sequence = int( os.path.basename(segments[-1].path).split('.')[0] ) + 1
+                path = os.path.join( self.streamPath(ids), '%08d.seg' % sequence )
+                WallflowerSegment(path,getRecordFormat(points_details),self.index_interval,self.segment_size).close()
+                segments = self.segments(ids,points_details)
+            written = segments[-1].append(records)
+            records = records[written:]
+            
+    '''
+    Yield (datetime, value, ...) rows of a stream between the low and 
+    high timestamps (datetimes, inclusive, either may be None), oldest 
+    first or newest first.
+    '''
+    def select(self,ids,points_details,low=None,high=None,limit=None,ascending=False):
+        low = datetimeToMicroseconds(low) if low is not None else None
+        high = datetimeToMicroseconds(high) if high is not None else None
+        segments = self.segments(ids,points_details)
+        if not ascending:
+            segments = list(reversed(segments))
+        returned = 0
+        for segment in segments:
+            count = segment.count()
+            if count == 0:
+                continue
+            if low is not None and segment.timestampAt(count - 1) < low:
+                continue
+            if high is not None and segment.timestampAt(0) > high:
+                continue
+            first = 0 if low is None else segment.lowerBound(low,count)
+            last = count if high is None else segment.lowerBound(high + 1,count)
+            positions = xrange(first,last) if ascending else xrange(last - 1,first - 1,-1)
+            for i in positions:
+                if limit is not None and returned >= limit:
+                    return
+                record = segment.recordAt(i)
+                returned += 1
+                yield (microsecondsToDatetime(record[0]),) + record[1:]
+                
+    '''
+    Remove the points between after and before (datetimes, exclusive, 
+    either may be None). Segments with only removed points are deleted, 
+    and segments from the first partly removed segment on are rewritten.
+    '''
+    def delete(self,ids,points_details,before=None,after=None):
+        before = datetimeToMicroseconds(before) if before is not None else None
+        after = datetimeToMicroseconds(after) if after is not None else None
+        with self.lock:
+            if not os.path.isdir(self.streamPath(ids)):
+                return
+            lock_file = self.lockStream(ids)
+            try:
+                rewrite = None
+                removed = []
+                for segment in self.segments(ids,points_details):
+                    count = segment.count()
+                    first = 0 if after is None else segment.lowerBound(after + 1,count)
+                    last = count if before is None else segment.lowerBound(before,count)
+                    if rewrite is not None:
+                        rewrite.extend( segment.recordAt(i) for i in xrange(0,count) if not first <= i < last )
+                        removed.append( segment.path )
+                    elif first >= last:
+                        continue
+                    elif first == 0 and last == count:
+                        removed.append( segment.path )
+                    else:
+                        rewrite = [ segment.recordAt(i) for i in xrange(0,count) if not first <= i < last ]
+                        removed.append( segment.path )
+                for path in removed:
+                    os.remove(path)
+                if rewrite is not None and len(rewrite) > 0:
+                    self.appendRecords(ids,points_details,rewrite)
+                self.segments(ids,points_details)
+            finally:
+                self.unlockStream(lock_file)
+                
+    '''
+    Return the number of points, the first and last timestamps 
+    (datetimes), and the bytes on disk of the segments of a stream.
+    '''
+    def stats(self,ids,points_details):
+        count, start, end, size = 0, None, None, 0
+        for segment in self.segments(ids,points_details):
+            segment_count = segment.count()
+            stat = os.stat(segment.path)
+            size += getattr(stat,'st_blocks',0) * 512 or stat.st_size
+            if segment_count == 0:
+                continue
+            if start is None:
+                start = microsecondsToDatetime( segment.timestampAt(0) )
+            end = microsecondsToDatetime( segment.timestampAt(segment_count - 1) )
+            count += segment_count
+        return count, start, end, size
+        
+    '''
+    Remove all segments of a stream.
+    '''
+    def drop(self,ids):
+        stream_path = self.streamPath(ids)
+        with self.lock:
+            for name, (inode, segment) in self.streams.pop(stream_path,{}).items():
+                segment.close()
+            if os.path.isdir(stream_path):
+                shutil.rmtree(stream_path)
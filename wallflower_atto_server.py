@@ -30,13 +30,40 @@
 __version__ = '0.0.1'
 
 import json
+import os
+import time
 
-from flask import Flask, request, jsonify, make_response, send_from_directory, render_template
-from wallflower_atto_models import db
-from wallflower_atto_db import WallflowerDB
+# Start of the process, for the startup phase times
+start_time = time.time()
+
+from flask import Flask, request, make_response, send_from_directory, render_template, g
+from flask import jsonify as flask_jsonify
+from wallflower_atto_models import db, attachShards, createModelTables
+from wallflower_atto_db import WallflowerDB, WallflowerStreamCounters
+from wallflower_atto_segments import WallflowerSegmentStore
+from wallflower_atto_mover import WallflowerPointsMover, WallflowerStatsFlusher
+from wallflower_atto_metrics import WallflowerMetrics, WallflowerStartup
+from wallflower_atto_logging import configureLogging, getLogger
+from wallflower_atto_statements import WallflowerStatements
+from wallflower_atto_profiler import WallflowerProfiler, collapsedProfile
+from wallflower_atto_tracing import WallflowerTracer, TraceExporter, parseTraceparent
+from base.wallflower_schema import WallflowerSchema
+from base.wallflower_binary import packPoints, unpackPoints, getRecordFormat, BinaryPointsError, writeNPZ
 
 #import re
 import datetime
+import hashlib
+import hmac
+import threading
+import thread
+import functools
+from StringIO import StringIO
+
+# Time each phase of the startup. Phases are logged to wallflower.startup
+# at INFO level once the server is started.
+startup = WallflowerStartup(start_time)
+startup.mark('imports')
+startup_logger = getLogger('startup')
 
 # Load config
 config = {
@@ -44,9 +71,76 @@ config = {
     'enable_ws': False,
     'http_port': 5000,
     'ws_port': 5050,
+    # Longest points-wait, in seconds. A waiting long-poll holds one of
+    # the request threads of its worker (gunicorn --threads, see the 
+    # Procfile), so the cap bounds how long waiting clients can take 
+    # all threads from other requests.
+    'points-wait-max': 10,
+    'points-conflict': 'reject',
+    'logging': {
+        'level': 'WARNING',
+        'levels': {},
+        'format': 'text',
+        'stream': 'stdout',
+        'queue-size': 10000,
+        'sample': {}
+    },
+    'admin': {
+        'token': None
+    },
+    'profiler': {
+        'enabled': False,
+        'max-seconds': 60,
+        'interval': 0.01
+    },
+    'stream-stats': {
+        'enabled': True,
+        'flush-interval': 10,
+        'rate-window': 60,
+        'estimate-interval': 300
+    },
+    'tracing': {
+        'enabled': False,
+        'sample-rate': 1.0,
+        'file': 'wallflower_traces.jsonl',
+        'url': None,
+        'service-name': 'wallflower-atto'
+    },
+    'sql': {
+        'server-timing': False,
+        'slow-query-time': 0.5
+    },
+    'metrics': {
+        'enabled': True,
+        'path': 'wallflower_metrics',
+        'interval': 5
+    },
+    'idempotency': {
+        'ttl': 86400,
+        'max-keys': 100000,
+        'lock-timeout': 60,
+        'prune-interval': 60
+    },
+    'cold-storage': {
+        'enabled': False,
+        'chunk-size': 1000,
+        'seal-age': None,
+        'seal-interval': 60,
+        'seal-batch': 10000
+    },
+    'segments': {
+        'enabled': False,
+        'path': 'wallflower_segments',
+        'segment-size': 1048576,
+        'index-interval': 256
+    },
     'database': {
         'name': 'wallflower_db',
-        'type': 'sqlite'
+        'type': 'sqlite',
+        'shards': {
+            'count': 0,
+            'paths': ['.']
+        }
     }
 }
 
@@ -57,6 +151,11 @@ try:
 except:
     print( "Invalid wallflower_config.json file" )
 
+# Log through a background writer. Levels are set per logger,
+# such as 'wallflower.db', and DEBUG/INFO records can be sampled.
+log_handler = configureLogging( config['logging'] )
+startup.mark('config')
+
 app = Flask(__name__)
 
 if config['database']['type'] == 'sqlite':
@@ -64,23 +163,531 @@ if config['database']['type'] == 'sqlite':
 elif config['database']['type'] == 'postgresql':
     app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres://'+config['database']['user']+':'+config['database']['password']+'@'+config['database']['host']+':'+str(config['database']['port'])+'/'+config['database']['database']
 elif config['database']['type'] == 'postgresql-heroku':
-    import os
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ["DATABASE_URL"]
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Read replica (Optional). Reads are sent to the replica, except for
+# clients that wrote within the last replica-window seconds.
+if config['database'].get('replica-uri') is not None:
+    app.config['SQLALCHEMY_BINDS'] = { 'replica': config['database']['replica-uri'] }
+
 # Create database connection object
 db.init_app(app)
 atto_db = WallflowerDB()
 atto_db.db = db
+atto_db.cold_storage = config['cold-storage'].get('enabled',False)
+atto_db.chunk_size = config['cold-storage'].get('chunk-size',1000)
+if config['segments'].get('enabled',False):
+    atto_db.segments = WallflowerSegmentStore(
+        config['segments'].get('path','wallflower_segments'),
+        config['segments'].get('segment-size',1048576),
+        config['segments'].get('index-interval',256)
+    )
+
+# Shard the points tables of SQLite across count files.
+# Shard i is placed in paths[i % len(paths)]. SQLite attaches
+# at most 10 databases to a connection.
+shards = config['database'].get('shards',{})
+if config['database']['type'] == 'sqlite' and shards.get('count',0) > 0:
+    shard_paths = shards.get('paths',['.'])
+    shard_count = shards['count']
+    if shard_count > 10:
+        startup_logger.warning( "SQLite attaches at most 10 shards, using 10 of the %s configured", shard_count )
+        shard_count = 10
+    shard_files = [ 
+        os.path.join( shard_paths[i % len(shard_paths)], config['database']['name']+'_shard'+str(i)+'.sqlite' )
+        for i in range( shard_count )
+    ]
+    with app.app_context():
+        attachShards( db.engine, shard_files )
+    atto_db.shards = len(shard_files)
+    
+if config['database'].get('replica-uri') is not None:
+    atto_db.replica = True
+atto_db.points_conflict = config['points-conflict']
+atto_db.idempotency_prune_interval = config['idempotency'].get('prune-interval',60)
+startup.mark('database')
+
+# Metrics, exported at /metrics. Workers of one server share the path.
+if config['metrics'].get('enabled',True):
+    metrics = WallflowerMetrics(
+        config['metrics'].get('path','wallflower_metrics'),
+        config['metrics'].get('interval',5)
+    )
+    metrics.describe('wallflower_requests_total','counter','HTTP requests by route, method, and status.')
+    metrics.describe('wallflower_request_duration_seconds','histogram','HTTP request latency by route and method.')
+    metrics.describe('wallflower_request_sql_statements','histogram','SQL statements per HTTP request, by route.',
+        (0,1,2,5,10,20,50,100,200,500))
+    metrics.describe('wallflower_request_sql_duration_seconds','histogram','SQL time per HTTP request, by route.')
+    metrics.describe('wallflower_sql_statements_total','counter','SQL statements executed.')
+    metrics.describe('wallflower_db_requests_total','counter','Database requests by level, type, and result code.')
+    metrics.describe('wallflower_db_request_duration_seconds','histogram','Database request latency by level and type.')
+    metrics.describe('wallflower_points_ingested_total','counter','Points written, by points type.')
+    metrics.describe('wallflower_cache_requests_total','counter','Cache lookups by cache and result.')
+    metrics.describe('wallflower_points_waiting','gauge','Long-poll points requests waiting for new points.')
+    metrics.describe('wallflower_log_queue_depth','gauge','Log records waiting to be written.')
+    metrics.describe('wallflower_log_dropped','gauge','Log records dropped because the log queue was full.')
+    metrics.gauge('wallflower_points_waiting',atto_db.points_notifier.waiting)
+    metrics.gauge('wallflower_log_queue_depth',log_handler.depth)
+    metrics.gauge('wallflower_log_dropped',lambda: log_handler.dropped)
+    atto_db.metrics = metrics
+    
+# Count and time the SQL statements of each request. Statements slower
+# than slow-query-time seconds are logged to wallflower.sql.
+statements = WallflowerStatements( config['sql'].get('slow-query-time') )
+with app.app_context():
+    statements.listen(db.engine)
+    if atto_db.replica:
+        statements.listen(db.get_engine(app,bind='replica'))
+
+# Sampling profiler of the worker, at /admin/profile (Optional)
+profiler = None
+if config['profiler'].get('enabled',False):
+    profiler = WallflowerProfiler(
+        config['profiler'].get('max-seconds',60),
+        config['profiler'].get('interval',0.01)
+    )
+
+# Request tracing (Optional). Spans are written to the file and/or 
+# posted to a Zipkin compatible collector url.
+if config['tracing'].get('enabled',False):
+    trace_exporter = TraceExporter( config['tracing'].get('file'), config['tracing'].get('url') )
+    atto_db.tracer = WallflowerTracer(
+        trace_exporter,
+        config['tracing'].get('sample-rate',1.0),
+        config['tracing'].get('service-name','wallflower-atto')
+    )
+    if atto_db.metrics is not None:
+        atto_db.metrics.describe('wallflower_trace_queue_depth','gauge','Traces waiting to be exported.')
+        atto_db.metrics.gauge('wallflower_trace_queue_depth',trace_exporter.depth)
+startup.mark('instrumentation')
 
 # Initialize db with Flask app context   
 # Note: current_app points to app               
 with app.app_context():
-    # Create database and tables
+    # Create the missing tables. Points tables are not reflected,
+    # they are built from the stream record when first used. One
+    # connection is used, as SQLite reads the schema of all tables
+    # on each new connection.
     #db.drop_all() 
-    db.create_all()
+    created = createModelTables( db.session.connection() )
+    if len(created) > 0:
+        startup_logger.info( "Created tables: %s", ', '.join(created) )
+    startup.mark('tables')
+    
+    # Check if the network exists and create, if necessary
+    exists, net = atto_db.networkExists((config['network-id'],))
+    if not exists:
+        # Create the default network
+        network_request = {
+            'network-id': config['network-id'],
+            'network-details': {
+                'network-name': 'Local Wallflower.cc Network'
+            }
+        }
+        at = datetime.datetime.utcnow().isoformat() + 'Z'
+        atto_db.do(network_request,'create','network',(config['network-id'],),at)
+    db.session.commit()
+startup.mark('network')
+
+# Move points older than seal-age seconds to cold storage
+if atto_db.cold_storage and config['cold-storage'].get('seal-age') is not None:
+    WallflowerPointsMover(
+        app,
+        atto_db,
+        config['cold-storage']['seal-age'],
+        config['cold-storage'].get('seal-interval',60),
+        config['cold-storage'].get('seal-batch',10000)
+    ).start()
+    
+# Count the writes and reads of each stream, and flush the counts to
+# the stream_stats table every flush-interval seconds
+if config['stream-stats'].get('enabled',True):
+    atto_db.stream_counters = WallflowerStreamCounters()
+    WallflowerStatsFlusher(
+        app,
+        atto_db,
+        config['stream-stats'].get('flush-interval',10),
+        config['stream-stats'].get('rate-window',60),
+        config['stream-stats'].get('estimate-interval',300)
+    ).start()
+startup.mark('background')
+
+'''
+Time of the last write of each client address, for read-your-writes. 
+Writes are also recorded in a cookie, which is seen by all workers.
+'''
+recent_writes = {}
+recent_writes_lock = threading.Lock()
+write_cookie = 'wallflower-write'
+
+'''
+Start the trace of the request, continuing the trace of the caller 
+if a traceparent header is sent.
+'''
+@app.before_request
+def startTrace():
+    if atto_db.tracer is not None:
+        trace_id, parent_id = parseTraceparent( request.headers.get('traceparent') )
+        atto_db.tracer.startTrace( request.endpoint or 'none', 
+            {'http.method': request.method, 'http.path': request.path}, trace_id, parent_id )
+
+'''
+Tag the trace with the response status.
+'''
+@app.after_request
+def tagTrace(response):
+    if atto_db.tracer is not None:
+        atto_db.tracer.tagTrace({'http.status_code': response.status_code})
+    return response
+
+'''
+End and export the trace of the request.
+'''
+@app.teardown_request
+def endTrace(exception=None):
+    if atto_db.tracer is not None:
+        atto_db.tracer.endTrace()
+        
+'''
+Serialize a JSON response, in a span of the request trace.
+'''
+def jsonify(*args,**kwargs):
+    with atto_db.span('http.serialize'):
+        return flask_jsonify(*args,**kwargs)
+    
+'''
+Start the request metrics and the SQL statement counter.
+'''
+@app.before_request
+def startMetrics():
+    g.metrics_start = time.time()
+    statements.start()
+        
+'''
+Add the SQL statements and time of the request to the Server-Timing 
+header, if enabled.
+'''
+@app.after_request
+def serverTiming(response):
+    if config['sql'].get('server-timing',False) and getattr(g,'metrics_start',None) is not None:
+        response.headers['Server-Timing'] = 'db;dur=%.1f;desc="%d statements", total;dur=%.1f' % (
+            statements.time()*1000, statements.count(), (time.time()-g.metrics_start)*1000 )
+    return response
+        
+'''
+Record the request metrics: count, latency, and SQL statements and 
+time by route (the Flask endpoint) and method, and conditional GET hits.
+'''
+@app.after_request
+def recordMetrics(response):
+    metrics = atto_db.metrics
+    if metrics is None or getattr(g,'metrics_start',None) is None:
+        return response
+    route = request.endpoint or 'none'
+    count = statements.count()
+    metrics.inc( 'wallflower_requests_total', 
+        (('route',route),('method',request.method),('status',response.status_code)) )
+    metrics.observe( 'wallflower_request_duration_seconds', time.time()-g.metrics_start, 
+        (('route',route),('method',request.method)) )
+    metrics.observe( 'wallflower_request_sql_statements', count, (('route',route),) )
+    metrics.observe( 'wallflower_request_sql_duration_seconds', statements.time(), (('route',route),) )
+    if count > 0:
+        metrics.inc( 'wallflower_sql_statements_total', value=count )
+    if request.method == 'GET' and (request.if_none_match or request.if_modified_since):
+        atto_db.countCache( 'http', int(response.status_code == 304), int(response.status_code != 304) )
+    return response
+    
+'''
+Read from the primary if the client wrote within the replica window.
+'''
+@app.before_request
+def routeReads():
+    if not atto_db.replica:
+        return
+    since = time.time() - config['database'].get('replica-window',5)
+    try:
+        last_write = float( request.cookies.get(write_cookie,0) )
+    except ValueError:
+        last_write = 0
+    with recent_writes_lock:
+        last_write = max( last_write, recent_writes.get(request.remote_addr,0) )
+    atto_db.setReadPrimary( last_write > since )
+    
+'''
+Conflict policy of the points updates of the request (Optional): 
+reject, ignore, or overwrite points with an existing timestamp.
+'''
+@app.before_request
+def pointsConflict():
+    atto_db.setPointsConflict( request.args.get('points-conflict',None,type=str) )
+    
+'''
+Record the writes of each client.
+'''
+@app.after_request
+def recordWrites(response):
+    if not atto_db.replica or request.method not in ['PUT','POST','DELETE']:
+        return response
+    now = time.time()
+    window = config['database'].get('replica-window',5)
+    with recent_writes_lock:
+        recent_writes[request.remote_addr] = now
+        if len(recent_writes) > 10000:
+            # Forget clients outside of the window
+            for address, last_write in recent_writes.items():
+                if last_write < now - window:
+                    del recent_writes[address]
+    response.set_cookie( write_cookie, repr(now), max_age=window )
+    return response
+
+'''
+Code of a response, from the *-code of a JSON body or from a CSV body 
+such as pc,200. Routes answer with HTTP 200 and give the code in the 
+body. None when no code is found.
+'''
+def responseCode(response):
+    if response.status_code != 200:
+        return response.status_code
+    data = response.get_data()
+    if response.mimetype == 'text/csv':
+        try:
+            return int( data.split('\n',1)[0].split(',',1)[1] )
+        except (IndexError, ValueError):
+            return None
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(body,dict):
+        return None
+    for key in body:
+        if key.endswith('-code') and isinstance(body[key],int):
+            return body[key]
+    return None
+
+# Client errors that a retry of the same request would repeat
+idempotent_codes = [406,409]
+
+'''
+Decorator for POST routes that accept an Idempotency-Key header. The 
+response of the first request with a key is stored and replayed for 
+retries of the same request, which are not executed again. Only 
+successful and deterministic responses are stored. Others, such as 
+a locked database, release the key so that the request can be retried.
+'''
+def idempotent(route):
+    @functools.wraps(route)
+    def handle(*args,**kwargs):
+        key = request.headers.get('Idempotency-Key',None)
+        if key is None or request.method != 'POST':
+            return route(*args,**kwargs)
+        if len(key) > 255:
+            return jsonify(**{'server-error':'Idempotency-Key is too long','server-code':400})
+            
+        fingerprint = hashlib.sha1( 
+            request.method+'|'+request.full_path.encode('utf-8')+'|'+request.get_data()
+        ).hexdigest()
+        state, record = atto_db.claimIdempotencyKey(
+            key, fingerprint,
+            config['idempotency'].get('ttl',86400),
+            config['idempotency'].get('max-keys',100000),
+            config['idempotency'].get('lock-timeout',60)
+        )
+        if state == 'replay':
+            response = make_response( record.response_data, record.response_status )
+            response.mimetype = record.response_type
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        elif state == 'in-progress':
+            return jsonify(**{'server-error':'A request with this Idempotency-Key is in progress','server-code':409})
+        elif state == 'mismatch':
+            return jsonify(**{'server-error':'Idempotency-Key was used for a different request','server-code':422})
+            
+        try:
+            response = make_response( route(*args,**kwargs) )
+        except:
+            atto_db.releaseIdempotencyKey(key)
+            raise
+        code = responseCode(response)
+        if code is None or not ( 200 <= code < 300 or code in idempotent_codes ):
+            atto_db.releaseIdempotencyKey(key)
+        else:
+            atto_db.storeIdempotentResponse( 
+                key, response.status_code, response.mimetype, response.get_data() 
+            )
+        return response
+    return handle
+    
+'''
+Allow admin routes only with the admin token of the config, sent as 
+Authorization: Bearer <token>. Without a token, admin routes are 
+disabled.
+'''
+def admin(route):
+    @functools.wraps(route)
+    def handle(*args,**kwargs):
+        token = config['admin'].get('token')
+        if not token:
+            return jsonify(**{'server-error':'Admin routes are not enabled','server-code':404})
+        authorization = request.headers.get('Authorization','')
+        if not authorization.startswith('Bearer ') or \
+            not hmac.compare_digest( authorization[7:].strip().encode('utf-8'), token.encode('utf-8') ):
+            return jsonify(**{'server-error':'Not authorized','server-code':401})
+        return route(*args,**kwargs)
+    return handle
+    
+'''
+Build the ETag and Last-Modified validators for a GET request
+from the updated_at timestamps of the requested records.
+'''
+def getValidators(request_level,ids):
+    version = atto_db.lastModified(request_level,ids)
+    if version is None:
+        return None, None
+    updated_at, count = version
+    
+    # The query string is included, since it changes the response
+    etag = hashlib.sha1( 
+        request.full_path+'|'+updated_at.isoformat()+'|'+str(count)
+    ).hexdigest()
+    
+    # HTTP dates only have second resolution. Wait until the second of 
+    # the last change has passed before sending Last-Modified, so that
+    # a later change can never share the same Last-Modified date.
+    last_modified = updated_at.replace(microsecond=0)
+    if last_modified >= datetime.datetime.utcnow().replace(microsecond=0):
+        last_modified = None
+        
+    return etag, last_modified
+    
+'''
+Check the If-None-Match and If-Modified-Since request headers.
+If-None-Match takes precedence, when present.
+'''
+def isNotModified(etag,last_modified):
+    if etag is None:
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+    
+'''
+Add the validators to a response.
+'''
+def addValidators(response,etag,last_modified):
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+    
+'''
+Read the points search (limit, start, end, and since) from the query string.
+'''
+def getPointsSearch():
+    # Max number of data points (Optional)
+    limit = request.args.get('points-limit',None,type=int)
+    # Start date/time (Optional)
+    start = request.args.get('points-start',None,type=str)
+    # End date/time (Optional)
+    end = request.args.get('points-end',None,type=str)
+    # Only points newer than the date/time cursor (Optional)
+    since = request.args.get('points-since',None,type=str)
+    
+    # Points Search Input
+    point_search = {}
+    if limit is not None and isinstance(limit,int):
+        point_search['limit'] = limit
+    if start is not None and isinstance(start,str):
+        point_search['start'] = start
+    if end is not None and isinstance(end,str):
+        point_search['end'] = end
+    if since is not None and isinstance(since,str):
+        point_search['since'] = since
+    return point_search
+    
+'''
+Respond with points from multiple streams.
+'''
+def multiplePointsResponse(response,response_type):
+    if response_type == 'csv':
+        if response.get('points-code') == 200:
+            s = "pc,200\n"
+            for object_id in response['objects']:
+                streams = response['objects'][object_id]['streams']
+                for stream_id in streams:
+                    for point in streams[stream_id].get('points',[]):
+                        s += object_id+","+stream_id+","+point['at']+","+str(point['value'])+"\n"
+            response = make_response(s[:-1])
+        else:
+            response = make_response( 'pc,'+str(response.get('points-code',400)) )
+        response.headers["Content-type"] = "text/csv"
+        return response
+    else:
+        return jsonify(**response)
+
+'''
+Respond with 304 Not Modified.
+'''
+def notModified(etag,last_modified):
+    response = make_response('',304)
+    return addValidators(response,etag,last_modified)
+    
 
 # Routes
+# Route metrics, in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if atto_db.metrics is None:
+        return jsonify(**{'server-error':'Metrics are not enabled','server-code':404})
+    response = make_response( atto_db.metrics.render() )
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
+# Route profile of this worker, in the collapsed stack format
+# (flamegraph.pl) or as JSON. Only one profile is taken at a time.
+@app.route('/admin/profile', methods=['GET'])
+@admin
+def admin_profile():
+    if profiler is None:
+        return jsonify(**{'server-error':'Profiler is not enabled','server-code':404})
+    seconds = request.args.get('profile-seconds',10,type=float)
+    interval = request.args.get('profile-interval',None,type=float)
+    response_format = request.args.get('format','collapsed',type=str)
+    
+    result = profiler.profile( seconds, interval, (thread.get_ident(),) )
+    if result is None:
+        return jsonify(**{'server-error':'A profile is already being taken','server-code':409})
+    stacks, samples = result
+    if response_format == 'json':
+        return jsonify(**{
+            'profile-pid': os.getpid(),
+            'profile-samples': samples,
+            'profile-stacks': stacks,
+            'server-code': 200
+        })
+    response = make_response( collapsedProfile(stacks) )
+    response.headers['Content-Type'] = 'text/plain'
+    return response
+
+# Route storage footprint and table health report of all streams
+@app.route('/admin/storage', methods=['GET'])
+@admin
+def admin_storage():
+    # Only streams and tables with problems (Optional)
+    flagged_only = request.args.get('report-flagged','false',type=str).lower() == 'true'
+    try:
+        return jsonify(**{
+            'storage-report': atto_db.storageReport(flagged_only),
+            'storage-code': 200
+        })
+    except:
+        atto_db.error( "Unexpected error (23)", exc_info=True )
+        return jsonify(**{'storage-error':'The storage report is not available','storage-code':500})
+
 # Route index/dashboard html file
 @app.route('/', methods=['GET'])
 def root():
@@ -130,7 +737,13 @@ def networks(network_id):
         'network-id': config['network-id']
     }
     
+    etag, last_modified = None, None
     if request.method == 'GET':
+        # Conditional GET
+        etag, last_modified = getValidators('network',(config['network-id'],))
+        if isNotModified(etag,last_modified):
+            return notModified(etag,last_modified)
+            
         # Read Network Details
         network_request = {
             'network-id': config['network-id']
@@ -139,12 +752,15 @@ def networks(network_id):
         atto_db.do(network_request,'read','network',(config['network-id'],),at)
         response.update( atto_db.db_message )
         
+    if response.get('network-code') != 200:
+        etag, last_modified = None, None
+        
     if response_type == 'csv':
         response = make_response( 'nc,'+str(response['network-code']) )
         response.headers["Content-type"] = "text/csv"
-        return response
+        return addValidators(response,etag,last_modified)
     else:
-        return jsonify(**response)
+        return addValidators(jsonify(**response),etag,last_modified)
 
 # Route Object Requests
 @app.route('/n/'+config['network-id']+'/o/<object_id>', methods=['GET','PUT','POST','DELETE'])
@@ -164,7 +780,13 @@ def objects(object_id):
         'object-id': object_id
     }
     
+    etag, last_modified = None, None
     if request.method == 'GET': # Read
+        # Conditional GET
+        etag, last_modified = getValidators('object',(config['network-id'],object_id))
+        if isNotModified(etag,last_modified):
+            return notModified(etag,last_modified)
+            
         # Read Object Details
         atto_db.do(object_request,'read','object',(config['network-id'],object_id),at)
         response.update( atto_db.db_message )
@@ -198,12 +820,15 @@ def objects(object_id):
         atto_db.do(object_request,'delete','object',(config['network-id'],object_id),at)
         response.update( atto_db.db_message )
         
+    if response.get('object-code') != 200:
+        etag, last_modified = None, None
+        
     if response_type == 'csv':
         response = make_response( 'oc,'+str(response['object-code']) )
         response.headers["Content-type"] = "text/csv"
-        return response
+        return addValidators(response,etag,last_modified)
     else:
-        return jsonify(**response)
+        return addValidators(jsonify(**response),etag,last_modified)
 
 
 # Route Object Requests
@@ -225,10 +850,23 @@ def streams(object_id,stream_id):
         'stream-id': stream_id
     }
     
+    etag, last_modified = None, None
     if request.method == 'GET': # Read
+        # Usage statistics of the stream (Optional)
+        # Statistics change without the stream, so they are not cached
+        stats = request.args.get('stream-stats','false',type=str).lower() in ['true','1']
+        
+        # Conditional GET
+        if not stats:
+            etag, last_modified = getValidators('stream',(config['network-id'],object_id,stream_id))
+            if isNotModified(etag,last_modified):
+                return notModified(etag,last_modified)
+            
         # Read Object Details
         atto_db.do(stream_request,'read','stream',(config['network-id'],object_id,stream_id),at)
         response.update( atto_db.db_message )
+        if stats and response.get('stream-code') == 200:
+            response['stream-stats'] = atto_db.readStreamStats((config['network-id'],object_id,stream_id))
         
     elif request.method == 'PUT': # Create
         # Create Stream
@@ -245,9 +883,29 @@ def streams(object_id,stream_id):
             stream_request['stream-details']['stream-name'] = stream_name
             
         points_type = request.args.get('points-type',None,type=str)
-        if stream_name is not None and points_type in ['i','f','s']:
+        if stream_name is not None and points_type in WallflowerSchema.data_type_list:
             stream_request['points-details']['points-type'] = points_type
         
+        # Values per point, for fixed-length list points (Optional)
+        points_length = request.args.get('points-length',None,type=int)
+        if points_length is not None and points_length >= 0:
+            stream_request['points-details']['points-length'] = points_length
+            
+        # Points storage, table or segment (Optional)
+        points_storage = request.args.get('points-storage',None,type=str)
+        if points_storage is not None:
+            stream_request['points-details']['points-storage'] = points_storage
+
+        # Points encoding, plain or dictionary (Optional)
+        points_encoding = request.args.get('points-encoding',None,type=str)
+        if points_encoding is not None:
+            stream_request['points-details']['points-encoding'] = points_encoding
+            
+        # Default conflict policy of points updates (Optional)
+        points_conflict = request.args.get('points-conflict',None,type=str)
+        if points_conflict is not None:
+            stream_request['points-details']['points-conflict'] = points_conflict
+
         atto_db.do(stream_request,'create','stream',(config['network-id'],object_id,stream_id),at)
         response.update( atto_db.db_message )
         
@@ -268,12 +926,15 @@ def streams(object_id,stream_id):
         atto_db.do(stream_request,'delete','stream',(config['network-id'],object_id,stream_id),at)
         response.update( atto_db.db_message )
         
+    if response.get('stream-code') != 200:
+        etag, last_modified = None, None
+        
     if response_type == 'csv':
         response = make_response( 'sc,'+str(response['stream-code']) )
         response.headers["Content-type"] = "text/csv"
-        return response
+        return addValidators(response,etag,last_modified)
     else:
-        return jsonify(**response)
+        return addValidators(jsonify(**response),etag,last_modified)
     
 
 
@@ -281,9 +942,13 @@ def streams(object_id,stream_id):
 # Route Stream Requests
 @app.route('/n/'+config['network-id']+'/o/<object_id>/s/<stream_id>/p', methods=['GET','POST','DELETE'])
 @app.route('/networks/'+config['network-id']+'/objects/<object_id>/streams/<stream_id>/points', methods=['GET','POST','DELETE'])
+@idempotent
 def points(object_id,stream_id):
     response_type = request.args.get('response-type','json',type=str)
     response_type = request.args.get('rt',response_type,type=str)
+    # Binary points, as response-type or Accept header
+    if request.accept_mimetypes.best == 'application/octet-stream':
+        response_type = 'binary'
     
     at = datetime.datetime.utcnow().isoformat() + 'Z'
     
@@ -298,29 +963,93 @@ def points(object_id,stream_id):
         'stream-id': stream_id
     }
     
+    etag, last_modified = None, None
     if request.method == 'GET':
-        # Read Points (Use Search Instead Of Read)
-        # Max number of data points (Optional)
-        limit = request.args.get('points-limit',None,type=int)
-        # Start date/time (Optional)
-        start = request.args.get('points-start',None,type=str)
-        # End date/time (Optional)
-        end = request.args.get('points-end',None,type=str)
+        # Seconds to wait for points newer than the cursor (Optional)
+        wait = request.args.get('points-wait',None,type=float)
         
+        # Conditional GET. Not for long-polls, which would be answered
+        # at once with 304 and never wait.
+        if wait is None:
+            etag, last_modified = getValidators('points',(config['network-id'],object_id,stream_id))
+            if isNotModified(etag,last_modified):
+                return notModified(etag,last_modified)
+            
+        # Export Points As NPZ Columns
+        if response_type == 'npz':
+            columns = atto_db.exportPoints(
+                (config['network-id'],object_id,stream_id),
+                {'points': getPointsSearch()},
+                at
+            )
+            response.update( atto_db.db_message )
+            if columns is None:
+                return jsonify(**response)
+            
+            data = StringIO()
+            writeNPZ(data,columns)
+            filename = config['network-id']+'.'+object_id+'.'+stream_id+'.npz'
+            
+            cursor = response.get('points-cursor')
+            response = make_response( data.getvalue() )
+            response.headers["Content-type"] = "application/octet-stream"
+            response.headers["Content-Disposition"] = 'attachment; filename="'+filename+'"'
+            response.headers["X-Points-Count"] = str(columns[0][2])
+            if cursor is not None:
+                response.headers["X-Points-Cursor"] = cursor
+            return addValidators(response,etag,last_modified)
+            
+        # Read Points (Use Search Instead Of Read)
         # Points Search Input
-        point_search = {}
-        if limit is not None and isinstance(limit,int):
-            point_search['limit'] = limit
-        if start is not None and isinstance(start,str):
-            point_search['start'] = start
-        if end is not None and isinstance(end,str):
-            point_search['end'] = end
+        point_search = getPointsSearch()
         
         points_request['points'] = point_search
         
+        # Read the stream version first, so that points added 
+        # during the search also end the wait
+        stream_key = config['network-id']+'.'+object_id+'.'+stream_id
+        version = atto_db.points_notifier.version(stream_key)
+        
         atto_db.do(points_request,'search','points',(config['network-id'],object_id,stream_id),at)
+        
+        # Long-poll. Without new points, wait for updatePoints 
+        # to signal the stream, then search again. Points written by
+        # other processes do not signal the stream, so the search is
+        # also repeated when the wait times out.
+        if wait is not None and 'since' in point_search and \
+            atto_db.db_message.get('points-code') == 200 and \
+            len(atto_db.db_message['points']) == 0:
+            wait = min( max(wait,0), config['points-wait-max'] )
+            # Return the connection to the pool while waiting
+            db.session.remove()
+            atto_db.points_notifier.wait(stream_key,version,wait)
+            # The new points may not have reached the replica yet
+            atto_db.setReadPrimary(True)
+            atto_db.do(points_request,'search','points',(config['network-id'],object_id,stream_id),at)
+            
         response.update( atto_db.db_message )
         
+    elif request.method == 'POST' and request.mimetype == 'application/octet-stream':
+        # Update Points From Binary Records
+        points_details = atto_db.getPointsDetails((config['network-id'],object_id,stream_id))
+        if points_details is not None:
+            try:
+                points_request['points'] = unpackPoints( request.get_data(), points_details )
+            except BinaryPointsError, err:
+                response['points-code'] = 400
+                response['points-message'] = 'Invalid binary points: '+str(err)
+                
+        if response.get('points-code') is None and \
+            points_details is not None and len(points_request['points']) == 0:
+            response['points-code'] = 406
+            response['points-message'] = 'No value received'
+            
+        if response.get('points-code') is None:
+            atto_db.do(points_request,'update','points',(config['network-id'],object_id,stream_id),at)
+            response.update( atto_db.db_message )
+            # Do not echo the points back
+            response.pop('points',None)
+            
     elif request.method == 'POST':
         # Update Points
         # Point value (Required)
@@ -382,20 +1111,220 @@ def points(object_id,stream_id):
         atto_db.do(points_request,'delete','points',(config['network-id'],object_id,stream_id),at)
         response.update( atto_db.db_message )
     
-    if response_type == 'csv':
+    if response.get('points-code') != 200:
+        etag, last_modified = None, None
+        
+    if response_type == 'binary' and request.method == 'GET' and \
+        response['points-code'] == 200:
+        try:
+            data = packPoints( response['points'], response['points-details'] )
+            response_format = getRecordFormat( response['points-details'] )
+        except BinaryPointsError, err:
+            response['points-code'] = 406
+            response['points-message'] = str(err)
+            return jsonify(**response)
+        cursor = response.get('points-cursor')
+        response = make_response( data )
+        response.headers["Content-type"] = "application/octet-stream"
+        # Struct format of each record, newest point first
+        response.headers["X-Points-Format"] = response_format
+        if cursor is not None:
+            response.headers["X-Points-Cursor"] = cursor
+        return addValidators(response,etag,last_modified)
+    elif response_type == 'csv':
         if request.method == 'GET' and response['points-code'] == 200:
             s = "pc,200\n"
             for point in response['points']:
                 s += point['at']+","+str(point['value'])+"\n"
             response = make_response(s[:-1])
             response.headers["Content-type"] = "text/csv"
-            return response
+            return addValidators(response,etag,last_modified)
         else:
             response = make_response( 'pc,'+str(response['points-code']) )
             response.headers["Content-type"] = "text/csv"
             return response
+    else:
+        return addValidators(jsonify(**response),etag,last_modified)
+
+
+# Route Points Seal Requests
+# Move the points of a stream older than points-before 
+# into compressed chunks (cold storage).
+@app.route('/n/'+config['network-id']+'/o/<object_id>/s/<stream_id>/p/seal', methods=['POST'])
+@app.route('/networks/'+config['network-id']+'/objects/<object_id>/streams/<stream_id>/points/seal', methods=['POST'])
+def points_seal(object_id,stream_id):
+    response_type = request.args.get('response-type','json',type=str)
+    response_type = request.args.get('rt',response_type,type=str)
+    
+    at = datetime.datetime.utcnow().isoformat() + 'Z'
+    
+    response = {
+        'network-id': config['network-id'],
+        'object-id': object_id,
+        'stream-id': stream_id
+    }
+    
+    # Before date/time (Required)
+    before = request.args.get('points-before',None,type=str)
+    try:
+        datetime.datetime.strptime(before, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except:
+        response['points-code'] = 400
+        response['points-message'] = 'Invalid timestamp'
+    
+    if 'points-code' not in response:
+        atto_db.sealPoints((config['network-id'],object_id,stream_id),before,at)
+        response.update( atto_db.db_message )
+    
+    if response_type == 'csv':
+        response = make_response( 'pc,'+str(response['points-code']) )
+        response.headers["Content-type"] = "text/csv"
+        return response
+    else:
+        return jsonify(**response)
+        
+        
+# Route Points Tiers Requests
+# Report the points of a stream in each storage tier.
+@app.route('/n/'+config['network-id']+'/o/<object_id>/s/<stream_id>/p/tiers', methods=['GET'])
+@app.route('/networks/'+config['network-id']+'/objects/<object_id>/streams/<stream_id>/points/tiers', methods=['GET'])
+def points_tiers(object_id,stream_id):
+    at = datetime.datetime.utcnow().isoformat() + 'Z'
+    
+    response = {
+        'network-id': config['network-id'],
+        'object-id': object_id,
+        'stream-id': stream_id
+    }
+    
+    atto_db.readPointsTiers((config['network-id'],object_id,stream_id),at)
+    response.update( atto_db.db_message )
+    
+    return jsonify(**response)
+    
+    
+# Route Bulk Requests
+# The JSON body is a network, objects, streams, and points tree, 
+# as for WallflowerMultiplePackets. The request type (create, read, 
+# update, delete, or search) is given by the request-type parameter
+# or the method key of the body.
+@app.route('/n/'+config['network-id']+'/b', methods=['POST'])
+@app.route('/networks/'+config['network-id']+'/bulk', methods=['POST'])
+@idempotent
+def bulk():
+    response_type = request.args.get('response-type','json',type=str)
+    response_type = request.args.get('rt',response_type,type=str)
+    
+    at = datetime.datetime.utcnow().isoformat() + 'Z'
+    
+    response = {
+        'network-id': config['network-id']
+    }
+    
+    bulk_request = request.get_json(force=True,silent=True)
+    if not isinstance(bulk_request,dict):
+        bulk_request = {}
+    request_type = bulk_request.pop('method',None)
+    request_type = request.args.get('request-type',request_type,type=str)
+    bulk_request['network-id'] = config['network-id']
+    
+    if request_type not in ['create','read','update','delete','search']:
+        response['bulk-error'] = 'Invalid request type'
+        response['bulk-code'] = 400
+    else:
+        atto_db.doMultiple(bulk_request,request_type,at)
+        response.update( atto_db.db_message )
+    
+    if response_type == 'csv':
+        response = make_response( 'bc,'+str(response['bulk-code']) )
+        response.headers["Content-type"] = "text/csv"
+        return response
     else:
         return jsonify(**response)
+    
+    
+# Route Multiple Stream Points Requests
+# Streams are given as a comma-separated list of object-id.stream-id
+@app.route('/n/'+config['network-id']+'/p', methods=['GET'])
+@app.route('/networks/'+config['network-id']+'/points', methods=['GET'])
+def network_points():
+    response_type = request.args.get('response-type','json',type=str)
+    response_type = request.args.get('rt',response_type,type=str)
+    
+    at = datetime.datetime.utcnow().isoformat() + 'Z'
+    
+    stream_ids = []
+    for stream in request.args.get('stream-ids','',type=str).split(','):
+        if '.' in stream:
+            stream_ids.append( tuple(stream.split('.',1)) )
+    
+    points_request = {
+        'points': getPointsSearch()
+    }
+    
+    response = {
+        'network-id': config['network-id']
+    }
+    
+    atto_db.searchMultiplePoints((config['network-id'],),stream_ids,points_request,at)
+    response.update( atto_db.db_message )
+    
+    return multiplePointsResponse(response,response_type)
+    
+# Route Multiple Stream Points Requests for one Object
+# Streams are given as a comma-separated list of stream-ids
+@app.route('/n/'+config['network-id']+'/o/<object_id>/p', methods=['GET'])
+@app.route('/networks/'+config['network-id']+'/objects/<object_id>/points', methods=['GET'])
+def object_points(object_id):
+    response_type = request.args.get('response-type','json',type=str)
+    response_type = request.args.get('rt',response_type,type=str)
+    
+    at = datetime.datetime.utcnow().isoformat() + 'Z'
+    
+    stream_ids = []
+    for stream_id in request.args.get('stream-ids','',type=str).split(','):
+        if stream_id != '':
+            stream_ids.append( (object_id,stream_id) )
+            
+    points_request = {
+        'points': getPointsSearch()
+    }
+    
+    response = {
+        'network-id': config['network-id']
+    }
+    
+    atto_db.searchMultiplePoints((config['network-id'],),stream_ids,points_request,at)
+    response.update( atto_db.db_message )
+    
+    return multiplePointsResponse(response,response_type)
+
+
+# Route the usage statistics of the top streams of the network
+@app.route('/n/'+config['network-id']+'/stats', methods=['GET'])
+@app.route('/networks/'+config['network-id']+'/stats', methods=['GET'])
+def stats():
+    # Order of the streams (Optional): write-rate, read-rate, 
+    # points-written, points-read, rows, bytes, or last-write
+    order = request.args.get('stats-order','write-rate',type=str)
+    # Number of streams (Optional), at most 100
+    limit = request.args.get('stats-limit',10,type=int)
+    
+    response = {
+        'network-id': config['network-id'],
+        'stats-order': order
+    }
+    if atto_db.stream_counters is None:
+        response['stats-error'] = 'Stream statistics are not enabled'
+        response['stats-code'] = 404
+        return jsonify(**response)
+    try:
+        response['stats-streams'] = atto_db.readTopStreams( config['network-id'], order, max(min(limit,100),1) )
+        response['stats-code'] = 200
+    except ValueError, err:
+        response['stats-error'] = str(err)
+        response['stats-code'] = 400
+    return jsonify(**response)
 
 
 @app.errorhandler(500)
@@ -406,20 +1335,13 @@ def internal_error(error):
 def not_found(error):
     return jsonify(**{'server-message':'Not a valid endpoint','server-code':404})
             
-# Check if the network exists and create, if necessary
-with app.app_context():
-    exists, net = atto_db.networkExists((config['network-id'],))
-    if not exists:
-        # Create the default network
-        network_request = {
-            'network-id': config['network-id'],
-            'network-details': {
-                'network-name': 'Local Wallflower.cc Network'
-            }
-        }
-        at = datetime.datetime.utcnow().isoformat() + 'Z'
-        atto_db.do(network_request,'create','network',(config['network-id'],),at)
+startup.mark('routes')
+
+for phase, seconds in startup.phases:
+    startup_logger.info( "Startup phase %s: %.1f ms", phase, seconds*1000 )
+startup_logger.info( "Started in %.1f ms (pid %s)", startup.total()*1000, os.getpid() )
         
 if __name__ == '__main__':
     # Start the Flask app
-    app.run(host='0.0.0.0',port=config["http_port"])
+    # Threaded, so that waiting points requests do not block others
+    app.run(host='0.0.0.0',port=config["http_port"],threaded=True)
@@ -0,0 +1,110 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import os
+import sys
+import time
+import threading
+from sqlalchemy import event
+from wallflower_atto_logging import getLogger
+
+'''
+Counts and times the SQL statements of each request (of each thread), 
+using the engine events of SQLAlchemy. Statements that take longer
+than slow_time seconds are logged to wallflower.sql with their
+parameters and the wallflower call site that executed them.
+'''
+class WallflowerStatements(object):
+
+    logger = getLogger('sql')
+    
+    # Longest parameters written to the slow query log
+    max_parameters_length = 1000
+    
+    def __init__(self,slow_time=None):
+        self.slow_time = slow_time
+        self.local = threading.local()
+        
+    '''
+    Count and time the statements of engine.
+    '''
+    def listen(self,engine):
+        event.listen(engine,'before_cursor_execute',self.beforeExecute)
+        event.listen(engine,'after_cursor_execute',self.afterExecute)
+        
+    def beforeExecute(self,conn,cursor,statement,parameters,context,executemany):
+        conn.info.setdefault('wallflower_statement_start',[]).append(time.time())
+        
+    def afterExecute(self,conn,cursor,statement,parameters,context,executemany):
+        starts = conn.info.get('wallflower_statement_start')
+        if not starts:
+            return
+        elapsed = time.time() - starts.pop()
+        self.local.count = getattr(self.local,'count',0) + 1
+        self.local.time = getattr(self.local,'time',0.0) + elapsed
+        if self.slow_time is not None and elapsed >= self.slow_time:
+            parameters = repr(parameters)
+            if len(parameters) > self.max_parameters_length:
+                parameters = parameters[:self.max_parameters_length]+'...'
+            self.logger.warning( "Slow query (%.1f ms) at %s: %s; parameters %s",
+                elapsed*1000, callSite(), ' '.join(statement.split()), parameters )
+        
+    '''
+    Start counting the statements of a request.
+    '''
+    def start(self):
+        self.local.count = 0
+        self.local.time = 0.0
+        
+    '''
+    Return the number of statements of the current request.
+    '''
+    def count(self):
+        return getattr(self.local,'count',0)
+        
+    '''
+    Return the time of the statements of the current request, in seconds.
+    '''
+    def time(self):
+        return getattr(self.local,'time',0.0)
+
+'''
+Return the innermost wallflower frame of the current stack, as
+file:line in function.
+'''
+def callSite():
+    frame = sys._getframe(1)
+    while frame is not None:
+        file_name = os.path.basename(frame.f_code.co_filename)
+        if file_name.startswith('wallflower_') and file_name != 'wallflower_atto_statements.py':
+            return file_name+':'+str(frame.f_lineno)+' in '+frame.f_code.co_name
+        frame = frame.f_back
+    return 'unknown'
@@ -0,0 +1,253 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+#
+#  GNU Affero General Public License Version 3 (AGPLv3)
+#
+#  Should you enter into a separate license agreement after having received a copy of
+#  this software, then the terms of such license agreement replace the terms below at
+#  the time at which such license agreement becomes effective.
+#
+#  In case a separate license agreement ends, and such agreement ends without being
+#  replaced by another separate license agreement, the license terms below apply
+#  from the time at which said agreement ends.
+#
+#  LICENSE TERMS
+#
+#  This program is free software: you can redistribute it and/or modify it under the
+#  terms of the GNU Affero General Public License, version 3, as published by the
+#  Free Software Foundation. This program is distributed in the hope that it will be
+#  useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  See the GNU Affero General Public License Version 3 for more details.
+#
+#  You should have received a copy of the GNU Affero General Public license along
+#  with this program. If not, see <http://www.gnu.org/licenses/agpl-3.0.en.html>.
+#
+#####################################################################################
+
+__version__ = '0.0.1'
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+import urllib2
+import Queue
+from contextlib import contextmanager
+
+'''
+Context manager of a span that is not recorded.
+'''
+class NoSpan(object):
+    def __enter__(self):
+        return None
+    def __exit__(self,*args):
+        return False
+
+no_span = NoSpan()
+
+'''
+Records the spans of sampled requests, in the Zipkin v2 JSON format
+(times in microseconds). A trace is started for each request by 
+startTrace, and spans opened by span() within the request (in the same
+thread) become its children. Outside of a sampled trace, span() does 
+nothing. Finished traces are handed to the exporter.
+'''
+class WallflowerTracer(object):
+
+    def __init__(self,exporter,sample_rate=1.0,service_name='wallflower-atto'):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.local = threading.local()
+        
+    '''
+    Start the trace of a request, with the root span name. A trace id 
+    and parent span id can be continued from the caller (traceparent).
+    '''
+    def startTrace(self,name,tags=None,trace_id=None,parent_id=None):
+        if trace_id is None and random.random() >= self.sample_rate:
+            self.local.stack = None
+            return
+        self.local.trace_id = trace_id or '%032x' % random.getrandbits(128)
+        self.local.spans = []
+        self.local.stack = []
+        self.openSpan(name,tags,parent_id)
+        
+    '''
+    Tag the root span of the current trace.
+    '''
+    def tagTrace(self,tags):
+        stack = getattr(self.local,'stack',None)
+        if stack:
+            stack[0]['tags'].update( (key,str(value)) for key, value in tags.items() )
+            
+    '''
+    End the current trace and export its spans.
+    '''
+    def endTrace(self):
+        stack = getattr(self.local,'stack',None)
+        if not stack:
+            return
+        while stack:
+            self.closeSpan()
+        self.local.stack = None
+        self.exporter.export(self.local.spans)
+        
+    def openSpan(self,name,tags=None,parent_id=None):
+        stack = self.local.stack
+        span = {
+            'traceId': self.local.trace_id,
+            'id': '%016x' % random.getrandbits(64),
+            'name': name,
+            'timestamp': int(time.time()*1000000),
+            'localEndpoint': {'serviceName': self.service_name},
+            'tags': dict( (key,str(value)) for key, value in (tags or {}).items() )
+        }
+        if stack:
+            span['parentId'] = stack[-1]['id']
+        else:
+            span['kind'] = 'SERVER'
+            if parent_id is not None:
+                span['parentId'] = parent_id
+        stack.append(span)
+        return span
+        
+    def closeSpan(self):
+        span = self.local.stack.pop()
+        span['duration'] = max( int(time.time()*1000000) - span['timestamp'], 1 )
+        self.local.spans.append(span)
+        
+    '''
+    Return a context manager of a child span of the current span.
+    '''
+    def span(self,name,tags=None):
+        if not getattr(self.local,'stack',None):
+            return no_span
+        return self.recordSpan(name,tags)
+        
+    @contextmanager
+    def recordSpan(self,name,tags):
+        self.openSpan(name,tags)
+        try:
+            yield
+        finally:
+            self.closeSpan()
+
+'''
+Exports the spans of finished traces from a background thread, so
+requests never wait on the export. Traces are dropped (and counted)
+when the queue is full. Spans are written to a file as JSON lines, 
+and/or posted as JSON arrays to a Zipkin compatible collector URL
+(e.g. http://127.0.0.1:9411/api/v2/spans).
+'''
+class TraceExporter(object):
+
+    def __init__(self,path=None,url=None,size=10000,batch=100):
+        self.path = path
+        self.url = url
+        self.batch = batch
+        self.queue = Queue.Queue(size)
+        self.dropped = 0
+        self.errors = 0
+        self.pid = None
+        self.lock = threading.Lock()
+        
+    def export(self,spans):
+        if self.pid != os.getpid():
+            self.startWriter()
+        try:
+            self.queue.put_nowait(spans)
+        except Queue.Full:
+            self.dropped += 1
+            
+    def startWriter(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            writer = threading.Thread(target=self.write)
+            writer.daemon = True
+            writer.start()
+            
+    def write(self):
+        while True:
+            spans = self.queue.get()
+            # Collect the waiting traces, up to batch
+            try:
+                while len(spans) < self.batch:
+                    spans = spans + self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+            try:
+                if self.path is not None:
+                    with open(self.path,'ab') as f:
+                        f.write( ''.join( json.dumps(span)+'\n' for span in spans ) )
+                if self.url is not None:
+                    request = urllib2.Request( self.url, json.dumps(spans), {'Content-Type': 'application/json'} )
+                    urllib2.urlopen(request,timeout=5).read()
+            except (IOError, OSError, urllib2.URLError):
+                self.errors += 1
+                
+    '''
+    Return the number of queued traces.
+    '''
+    def depth(self):
+        return self.queue.qsize()
+        
+'''
+Parse a W3C traceparent header. Returns the trace id and the parent 
+span id, or None, None.
+'''
+def parseTraceparent(header):
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1],16)
+        int(parts[2],16)
+    except ValueError:
+        return None, None
+    return parts[1], parts[2]
+    
+'''
+Print the duration percentiles of each span name by request, from a 
+file of exported spans:
+    python wallflower_atto_tracing.py wallflower_traces.jsonl
+'''
+def summarizeTraces(path):
+    traces = {}
+    with open(path,'rb') as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            traces.setdefault(span['traceId'],[]).append(span)
+            
+    durations = {}
+    for spans in traces.values():
+        roots = [ span for span in spans if span.get('kind') == 'SERVER' ]
+        if len(roots) == 0:
+            continue
+        root = roots[0]
+        request = root['name']+' '+root['tags'].get('http.method','')
+        for span in spans:
+            name = span['name']
+            if 'db.level' in span['tags']:
+                name += ' ('+' '.join( span['tags'][tag] for tag in ('db.level','db.type') if tag in span['tags'] )+')'
+            durations.setdefault(request,{}).setdefault(name,[]).append( span['duration']/1000.0 )
+            
+    print('%-40s %-36s %7s %9s %9s %9s' % ('request', 'span', 'count', 'p50 ms', 'p90 ms', 'p99 ms'))
+    for request in sorted(durations):
+        for name, values in sorted( durations[request].items(), key=lambda item: -sum(item[1]) ):
+            values.sort()
+            p = lambda q: values[ int(round( q/100.0*(len(values)-1) )) ]
+            print('%-40s %-36s %7d %9.2f %9.2f %9.2f' % (request, name, len(values), p(50), p(90), p(99)))
+
+if __name__ == '__main__':
+    summarizeTraces(sys.argv[1] if len(sys.argv) > 1 else 'wallflower_traces.jsonl')
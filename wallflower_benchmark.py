@@ -0,0 +1,427 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+# 
+#  MIT License (MIT)
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy 
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+#  copies of the Software, and to permit persons to whom the Software is 
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+#  SOFTWARE.
+#
+#####################################################################################
+
+"""
+ The program below benchmarks the ingest, query, and dashboard paths of
+ the server, and writes the results as JSON, so that results can be 
+ compared between commits. The server is either run in-process (with
+ the Flask test client) on a new SQLite or PostgreSQL database, or is a
+ running server given by --url.
+ 
+ Benchmarks:
+   ingest-single    POST of one point
+   ingest-batch     bulk update of --batch-sizes points
+   search-points    GET of points ranges of --range-sizes points
+   read-network     GET of the network, by number of objects and streams
+   schema-points    validation of points update requests (in-process only)
+   cold-start       new server process until its first response, by number
+                    of streams in the database (SQLite, in-process only)
+ 
+ Usage: python wallflower_benchmark.py [--database sqlite|postgresql] 
+            [--postgresql user:password@host:port/database] [--url URL]
+            [--repeat N] [--startup-streams N,N] [--output FILE] [--only NAME]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='Wallflower.cc server benchmark')
+parser.add_argument('--database', default='sqlite', choices=['sqlite','postgresql'],
+    help='database of the in-process server')
+parser.add_argument('--postgresql', default='wallflower:wallflower@127.0.0.1:5432/wallflower_benchmark',
+    help='user:password@host:port/database of an empty PostgreSQL database')
+parser.add_argument('--url', default=None, help='benchmark a running server, e.g. http://127.0.0.1:5000')
+parser.add_argument('--repeat', type=int, default=200, help='timed requests per benchmark')
+parser.add_argument('--batch-sizes', default='10,100,1000')
+parser.add_argument('--range-sizes', default='10,100,1000,10000')
+parser.add_argument('--network-sizes', default='1x1,10x5,50x10', help='objects x streams per object')
+parser.add_argument('--startup-streams', default='0,1000,10000', help='streams in the database of cold-start')
+parser.add_argument('--startup-repeat', type=int, default=5, help='server processes started per stream count')
+parser.add_argument('--only', default=None, help='comma-separated benchmark names')
+parser.add_argument('--output', default='wallflower_benchmark.json', help='JSON results file, - for stdout')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+repo_path = os.path.dirname(os.path.abspath(__file__))
+network_id = 'local'
+start_at = datetime.datetime(2017,1,1)
+
+'''
+Client of the in-process server, with the Flask test client.
+'''
+class AppClient(object):
+
+    def __init__(self,database):
+        # The server reads wallflower_config.json of the working directory
+        self.path = tempfile.mkdtemp(prefix='wallflower_benchmark_')
+        config = {
+            'network-id': network_id,
+            'metrics': {'enabled': False},
+            'database': {'name': os.path.join(self.path,'wallflower_db'), 'type': 'sqlite'}
+        }
+        if database == 'postgresql':
+            credentials, location = args.postgresql.rsplit('@',1)
+            host_port, name = location.split('/',1)
+            host, port = host_port.split(':')
+            user, password = credentials.split(':',1)
+            config['database'] = {
+                'type': 'postgresql', 'user': user, 'password': password,
+                'host': host, 'port': int(port), 'database': name
+            }
+        with open(os.path.join(self.path,'wallflower_config.json'),'wb') as f:
+            json.dump(config,f)
+        self.cwd = os.getcwd()
+        os.chdir(self.path)
+        sys.path.insert(0,repo_path)
+        import wallflower_atto_server
+        self.server = wallflower_atto_server
+        self.client = wallflower_atto_server.app.test_client()
+        
+    def request(self,method,path,params=None,data=None):
+        if data is not None:
+            data = json.dumps(data)
+        response = self.client.open(path,method=method,query_string=params,
+            data=data,content_type='application/json')
+        return response.status_code, response.data
+        
+    def close(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path,True)
+
+'''
+Client of a running server, with keep-alive connections.
+'''
+class HTTPClient(object):
+
+    def __init__(self,url):
+        import requests
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.server = None
+        
+    def request(self,method,path,params=None,data=None):
+        response = self.session.request(method,self.url+path,params=params,json=data,timeout=120)
+        return response.status_code, response.content
+        
+    def close(self):
+        self.session.close()
+
+'''
+Return the p-th percentile (nearest rank) of sorted values.
+'''
+def percentile(values,p):
+    if len(values) == 0:
+        return None
+    rank = int( round( p/100.0 * (len(values)-1) ) )
+    return values[rank]
+    
+'''
+Summarize the times of a benchmark, in milliseconds.
+'''
+def summarize(name,params,times,items=1,errors=0):
+    times = sorted(times)
+    total = sum(times)
+    result = {
+        'name': name,
+        'params': params,
+        'count': len(times),
+        'errors': errors,
+        'mean-ms': 1000.0*total/len(times),
+        'p50-ms': 1000.0*percentile(times,50),
+        'p90-ms': 1000.0*percentile(times,90),
+        'p99-ms': 1000.0*percentile(times,99),
+        'max-ms': 1000.0*times[-1],
+        'items-per-second': len(times)*items/total if total > 0 else None
+    }
+    print('%-15s %-36s %8.3f %8.3f %8.3f %8.3f %12.0f %6d' % (
+        name, ','.join(k+'='+str(v) for k, v in sorted(params.items())),
+        result['mean-ms'], result['p50-ms'], result['p90-ms'], result['p99-ms'],
+        result['items-per-second'] or 0, errors))
+    sys.stdout.flush()
+    return result
+    
+'''
+Time function repeat times. Returns the times in seconds, and the 
+number of errors (function returns False).
+'''
+def timed(function,repeat):
+    times = []
+    errors = 0
+    for i in range(repeat):
+        t = time.time()
+        ok = function(i)
+        times.append( time.time()-t )
+        if not ok:
+            errors += 1
+    return times, errors
+
+def timestamp(i):
+    return (start_at + datetime.timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    
+def points(first,count,points_type='f'):
+    if points_type == 'f':
+        return [ {'at': timestamp(first+i), 'value': round(random.uniform(0,100),2)} for i in range(count) ]
+    return [ {'at': timestamp(first+i), 'value': random.randint(0,1000)} for i in range(count) ]
+    
+def objectPath(object_id):
+    return '/networks/'+network_id+'/objects/'+object_id
+    
+def createStream(client,object_id,stream_id,points_type='f'):
+    client.request('PUT',objectPath(object_id),{'object-name': object_id})
+    status, data = client.request('PUT',objectPath(object_id)+'/streams/'+stream_id,
+        {'stream-name': stream_id, 'points-type': points_type})
+    
+def bulkPoints(client,object_id,stream_id,stream_points):
+    status, data = client.request('POST','/networks/'+network_id+'/bulk',{'request-type': 'update'},{
+        'network-id': network_id,
+        'objects': { object_id: {
+            'object-id': object_id,
+            'streams': { stream_id: {'stream-id': stream_id, 'points': stream_points} }
+        } }
+    })
+    return status == 200 and json.loads(data).get('bulk-code') == 200
+    
+# Benchmarks
+def ingestSingle(client):
+    createStream(client,'bench-ingest','single')
+    path = objectPath('bench-ingest')+'/streams/single/points'
+    def post(i):
+        status, data = client.request('POST',path,
+            {'points-value': random.uniform(0,100), 'points-at': timestamp(i)})
+        return status == 200 and json.loads(data).get('points-code') == 200
+    times, errors = timed(post,args.repeat)
+    return [ summarize('ingest-single',{},times,1,errors) ]
+    
+def ingestBatch(client):
+    results = []
+    for size in [ int(size) for size in args.batch_sizes.split(',') ]:
+        stream_id = 'batch-'+str(size)
+        createStream(client,'bench-ingest',stream_id)
+        repeat = max( min( args.repeat, 100000//size ), 5 )
+        times, errors = timed( 
+            lambda i: bulkPoints(client,'bench-ingest',stream_id,points(i*size,size)), repeat )
+        results.append( summarize('ingest-batch',{'batch-size': size},times,size,errors) )
+    return results
+    
+def searchPoints(client):
+    sizes = [ int(size) for size in args.range_sizes.split(',') ]
+    total = max(sizes)*2
+    createStream(client,'bench-search','points')
+    for first in range(0,total,1000):
+        bulkPoints(client,'bench-search','points',points(first,min(1000,total-first)))
+    path = objectPath('bench-search')+'/streams/points/points'
+    
+    # Reads return at most 500 points, items/s counts the points returned
+    results = []
+    for size in sizes:
+        returned = []
+        def search(i):
+            first = random.randint(0,total-size)
+            status, data = client.request('GET',path,{
+                'points-start': timestamp(first),
+                'points-end': timestamp(first+size-1),
+                'points-limit': size
+            })
+            if status != 200 or json.loads(data).get('points-code') != 200:
+                return False
+            returned.append( len(json.loads(data)['points']) )
+            return True
+        times, errors = timed( search, max( min(args.repeat, 200000//size), 5 ) )
+        results.append( summarize('search-points',{'range-size': size, 'stream-size': total},times,
+            float(sum(returned))/max(len(returned),1),errors) )
+    return results
+    
+def readNetwork(client):
+    results = []
+    for size in args.network_sizes.split(','):
+        objects, streams = [ int(n) for n in size.split('x') ]
+        for o in range(objects):
+            for s in range(streams):
+                createStream(client,'bench-network-'+str(o),'s'+str(s))
+        def read(i):
+            status, data = client.request('GET','/networks/'+network_id)
+            return status == 200 and json.loads(data).get('network-code') == 200
+        times, errors = timed( read, max( min(args.repeat, 20000//(objects*streams)), 5 ) )
+        results.append( summarize('read-network',{'objects': objects, 'streams': streams},times,1,errors) )
+    return results
+    
+def schemaPoints(client):
+    from base.wallflower_packet import WallflowerPacket
+    results = []
+    for size in [1] + [ int(size) for size in args.batch_sizes.split(',') ]:
+        packet = {'stream-id': 'points', 'points': points(0,size)}
+        def validate(i):
+            return WallflowerPacket().loadRequest(packet,'update','points')
+        times, errors = timed( validate, max( min(args.repeat, 100000//size), 5 ) )
+        results.append( summarize('schema-points',{'points': size},times,size,errors) )
+    return results
+    
+# Run in a new process, in the directory of the database to start
+cold_start_script = '''
+import json, sys, time
+start_time = time.time()
+sys.path.insert(0,%r)
+import wallflower_atto_server
+client = wallflower_atto_server.app.test_client()
+started_time = time.time()
+response = client.get('/networks/local/objects/template/streams/s')
+print( json.dumps({
+    'startup': wallflower_atto_server.startup.dict(),
+    'started-seconds': started_time-start_time,
+    'first-request-seconds': time.time()-started_time,
+    'first-request-code': json.loads(response.data).get('stream-code')
+}) )
+'''
+
+# Adds streams objects.s0..s9 with a points table each, in one commit
+populate_script = '''
+import json, sys
+sys.path.insert(0,%r)
+import wallflower_atto_server
+from wallflower_atto_models import Object, Stream
+client = wallflower_atto_server.app.test_client()
+client.put('/networks/local/objects/template',query_string={'object-name': 'template'})
+client.put('/networks/local/objects/template/streams/s',query_string={'stream-name': 's','points-type': 'f'})
+atto_db = wallflower_atto_server.atto_db
+with wallflower_atto_server.app.app_context():
+    template = Stream.query.filter_by(object_id='template').first()
+    points_details = json.loads(template.points_details)
+    for i in range(%d):
+        object_id, stream_id = 'o'+str(i//10), 's'+str(i%%10)
+        if i %% 10 == 0:
+            atto_db.db.session.add( Object('local',object_id,json.dumps({'object-name': object_id})) )
+        atto_db.db.session.add( Stream('local',object_id,stream_id,
+            json.dumps({'stream-name': stream_id}),template.points_details) )
+        atto_db.getPointsTable(('local',object_id,stream_id),points_details).create(
+            atto_db.db.session.connection(), checkfirst=False )
+    atto_db.db.session.commit()
+'''
+
+def coldStart(client):
+    python = sys.executable
+    results = []
+    for streams in [ int(size) for size in args.startup_streams.split(',') ]:
+        path = tempfile.mkdtemp(prefix='wallflower_benchmark_')
+        try:
+            with open(os.path.join(path,'wallflower_config.json'),'wb') as f:
+                json.dump({
+                    'network-id': network_id,
+                    'metrics': {'enabled': False},
+                    'database': {'name': os.path.join(path,'wallflower_db'), 'type': 'sqlite'}
+                },f)
+            subprocess.check_call([python,'-c',populate_script % (repo_path,streams)],cwd=path)
+            
+            times = []
+            runs = []
+            errors = 0
+            for i in range(args.startup_repeat):
+                t = time.time()
+                output = subprocess.check_output([python,'-c',cold_start_script % repo_path],cwd=path)
+                times.append( time.time()-t )
+                runs.append( json.loads(output.strip().splitlines()[-1]) )
+                if runs[-1]['first-request-code'] != 200:
+                    errors += 1
+            result = summarize('cold-start',{'streams': streams},times,1,errors)
+            
+            # Median of each phase, and of the first request
+            phases = {}
+            for run in runs:
+                for phase in run['startup']['startup-phases']:
+                    phases.setdefault(phase['phase'],[]).append(phase['seconds'])
+                phases.setdefault('first-request',[]).append(run['first-request-seconds'])
+            result['phases-ms'] = dict( (phase, 1000.0*percentile(sorted(seconds),50)) 
+                for phase, seconds in phases.items() )
+            results.append(result)
+        finally:
+            shutil.rmtree(path,True)
+    return results
+    
+benchmarks = [
+    ('ingest-single', ingestSingle),
+    ('ingest-batch', ingestBatch),
+    ('search-points', searchPoints),
+    ('read-network', readNetwork),
+    ('schema-points', schemaPoints),
+    ('cold-start', coldStart)
+]
+
+if __name__ == '__main__':
+    if args.url is not None:
+        client = HTTPClient(args.url)
+        target = args.url
+    else:
+        client = AppClient(args.database)
+        target = 'in-process '+args.database
+        
+    try:
+        commit = subprocess.check_output(['git','rev-parse','HEAD'],cwd=repo_path,stderr=open(os.devnull,'wb')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+        
+    output = {
+        'benchmark-target': target,
+        'benchmark-commit': commit,
+        'benchmark-python': platform.python_version(),
+        'benchmark-platform': platform.platform(),
+        'benchmark-at': datetime.datetime.utcnow().isoformat()+'Z',
+        'benchmark-repeat': args.repeat,
+        'benchmark-seed': args.seed,
+        'results': []
+    }
+    only = args.only.split(',') if args.only else None
+    
+    print('')
+    print('Wallflower.cc benchmark: '+target)
+    print('')
+    print('%-15s %-36s %8s %8s %8s %8s %12s %6s' % (
+        'benchmark', 'params', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'items/s', 'errors'))
+    try:
+        for name, benchmark in benchmarks:
+            if only is not None and name not in only:
+                continue
+            if name in ['schema-points','cold-start'] and args.url is not None:
+                continue
+            output['results'] += benchmark(client)
+    finally:
+        client.close()
+    print('')
+    
+    if args.output == '-':
+        print( json.dumps(output,indent=2,sort_keys=True) )
+    else:
+        with open(args.output,'wb') as f:
+            json.dump(output,f,indent=2,sort_keys=True)
+        print('Results written to '+args.output)
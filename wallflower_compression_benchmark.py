@@ -0,0 +1,148 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+# 
+#  MIT License (MIT)
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy 
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+#  copies of the Software, and to permit persons to whom the Software is 
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+#  SOFTWARE.
+#
+#####################################################################################
+
+"""
+ The program below measures the compressed chunk encoding used for cold 
+ storage (base/wallflower_compression.py). For a few synthetic streams, 
+ it prints the compressed size per point, the compression ratio against 
+ fixed-width binary records and JSON points, and the encode and decode 
+ throughput in points per second.
+ 
+ Usage: python wallflower_compression_benchmark.py [--points N] [--chunk-size N]
+"""
+
+import argparse
+import json
+import random
+import struct
+import time
+
+from base.wallflower_compression import encodeChunk, decodeChunk
+
+parser = argparse.ArgumentParser(description='Compressed chunk benchmark')
+parser.add_argument('--points', type=int, default=100000, help='points per stream')
+parser.add_argument('--chunk-size', type=int, default=1000, help='points per chunk')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+start = 1500000000 * 1000000
+
+'''
+Timestamps every second, with a few microseconds of jitter.
+'''
+def timestamps(count):
+    return [ start + i * 1000000 + random.randint(0,50) for i in range(count) ]
+
+'''
+Temperature like readings, a random walk rounded to 2 decimals.
+'''
+def randomWalk(count):
+    value = 20.0
+    values = []
+    for i in range(count):
+        value += random.gauss(0,0.05)
+        values.append( round(value,2) )
+    return values
+    
+'''
+Energy meter like readings, a counter with small increments.
+'''
+def counter(count):
+    value = 0
+    values = []
+    for i in range(count):
+        value += random.randint(0,20)
+        values.append( value )
+    return values
+    
+'''
+Switch like readings, which rarely change.
+'''
+def switch(count):
+    value = False
+    values = []
+    for i in range(count):
+        if random.random() < 0.01:
+            value = not value
+        values.append( value )
+    return values
+    
+# (name, python type, struct code, values)
+streams = [
+    ('float random walk', float, 'd', randomWalk(args.points)),
+    ('float constant', float, 'd', [21.5] * args.points),
+    ('integer counter', int, 'q', counter(args.points)),
+    ('bool switch', bool, '?', switch(args.points))
+]
+
+print('')
+print('Compressed chunks: '+str(args.points)+' points per stream, '+str(args.chunk_size)+' points per chunk')
+print('')
+print('%-18s %10s %10s %10s %12s %12s' % (
+    'stream', 'bytes/pt', 'vs binary', 'vs json', 'encode pt/s', 'decode pt/s'))
+
+for name, python_type, code, values in streams:
+    times = timestamps(len(values))
+    
+    # Encode in chunks
+    chunks = []
+    encode_start = time.time()
+    for i in range(0,len(values),args.chunk_size):
+        chunks.append( encodeChunk( 
+            python_type, 
+            times[i:i+args.chunk_size], 
+            [values[i:i+args.chunk_size]] 
+        ) )
+    encode_time = time.time() - encode_start
+    
+    # Decode and check
+    decoded_times = []
+    decoded_values = []
+    decode_start = time.time()
+    for chunk in chunks:
+        chunk_times, chunk_columns = decodeChunk(chunk)
+        decoded_times.extend( chunk_times )
+        decoded_values.extend( chunk_columns[0] )
+    decode_time = time.time() - decode_start
+    assert decoded_times == times and decoded_values == values
+    
+    compressed_size = sum( len(chunk) for chunk in chunks )
+    binary_size = struct.calcsize('<q'+code) * len(values)
+    json_size = len(json.dumps([ 
+        {'at': '2017-07-14T02:40:00.000000Z', 'value': value} for value in values 
+    ]))
+    
+    print('%-18s %10.2f %9.1fx %9.1fx %12d %12d' % (
+        name,
+        compressed_size / float(len(values)),
+        binary_size / float(compressed_size),
+        json_size / float(compressed_size),
+        len(values) / encode_time,
+        len(values) / decode_time
+    ))
+print('')
@@ -0,0 +1,315 @@
+#####################################################################################
+#
+#  Copyright (c) 2016 Eric Burger, Wallflower.cc
+# 
+#  MIT License (MIT)
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy 
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+#  copies of the Software, and to permit persons to whom the Software is 
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
+#  SOFTWARE.
+#
+#####################################################################################
+
+"""
+ The program below generates load on a running server, to replace the
+ one-request-at-a-time demo sender when planning capacity. It simulates
+ a number of devices (objects), each with a number of streams, that 
+ send points at a given rate. Requests are sent by a pool of threads,
+ each with its own keep-alive connection. With --batch 1, each point
+ is a POST to the points of its stream. With --batch N, each device
+ sends N points of each of its streams in one bulk update.
+ 
+ The achieved throughput, the errors, and the latency percentiles are
+ printed every --report seconds and at the end. Latency is measured 
+ from the time the request was sent (service) and from the time it was
+ scheduled (scheduled), which includes the time waiting for a free
+ connection when the server does not keep up.
+ 
+ Usage: python wallflower_load.py [--url URL] [--objects N] [--streams N]
+            [--types i,f,s] [--rate POINTS/S] [--batch N] [--duration S]
+            [--connections N] [--output FILE]
+"""
+
+import argparse
+import datetime
+import heapq
+import httplib
+import json
+import random
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import Queue
+
+parser = argparse.ArgumentParser(description='Wallflower.cc load generator')
+parser.add_argument('--url', default='http://127.0.0.1:5000')
+parser.add_argument('--network-id', default='local')
+parser.add_argument('--objects', type=int, default=100, help='number of devices')
+parser.add_argument('--streams', type=int, default=5, help='streams per device')
+parser.add_argument('--types', default='i,f,s', help='points types of the streams, in turn')
+parser.add_argument('--rate', type=float, default=1.0, help='points per second per stream')
+parser.add_argument('--batch', type=int, default=1, help='points per stream per request')
+parser.add_argument('--duration', type=float, default=60, help='seconds')
+parser.add_argument('--connections', type=int, default=20, help='concurrent keep-alive connections')
+parser.add_argument('--prefix', default='load', help='prefix of the object ids')
+parser.add_argument('--no-setup', action='store_true', help='do not create the objects and streams')
+parser.add_argument('--report', type=float, default=10, help='seconds between reports')
+parser.add_argument('--output', default=None, help='JSON results file')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+url = urlparse.urlparse(args.url)
+network_path = '/networks/'+args.network_id
+types = args.types.split(',')
+words = ['on','off','open','closed','idle','running','error','ok']
+
+'''
+Return the p-th percentile (nearest rank) of sorted values.
+'''
+def percentile(values,p):
+    if len(values) == 0:
+        return 0.0
+    return values[ int( round( p/100.0 * (len(values)-1) ) ) ]
+    
+def randomValue(points_type):
+    if points_type == 'i':
+        return random.randint(0,1000)
+    elif points_type == 'f':
+        return round(random.uniform(0,100),2)
+    return random.choice(words)
+    
+'''
+Keep-alive connection to the server. Reconnects after errors.
+'''
+class Connection(object):
+
+    def __init__(self):
+        self.connection = None
+        
+    def request(self,method,path,params=None,body=None):
+        if params:
+            path += '?'+urllib.urlencode(params)
+        headers = {'Connection': 'keep-alive'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            if self.connection is None:
+                connection_type = httplib.HTTPSConnection if url.scheme == 'https' else httplib.HTTPConnection
+                self.connection = connection_type(url.hostname,url.port,timeout=120)
+            self.connection.request(method,path,body,headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (httplib.HTTPException, IOError):
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = None
+            return None, None
+            
+'''
+Counts of the requests of the run, and of the current report interval.
+'''
+class Results(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = self.newInterval()
+        self.interval = self.newInterval()
+        
+    def newInterval(self):
+        return {'requests': 0, 'points': 0, 'errors': {}, 'service': [], 'scheduled': []}
+        
+    def add(self,points,error,service,scheduled):
+        with self.lock:
+            for counts in (self.total, self.interval):
+                counts['requests'] += 1
+                if error is None:
+                    counts['points'] += points
+                else:
+                    counts['errors'][error] = counts['errors'].get(error,0) + 1
+                counts['service'].append(service)
+                counts['scheduled'].append(scheduled)
+                
+    def takeInterval(self):
+        with self.lock:
+            counts = self.interval
+            self.interval = self.newInterval()
+        return counts
+        
+'''
+Summarize counts over seconds.
+'''
+def summarize(counts,seconds):
+    service = sorted(counts['service'])
+    scheduled = sorted(counts['scheduled'])
+    return {
+        'seconds': seconds,
+        'requests': counts['requests'],
+        'points': counts['points'],
+        'errors': counts['errors'],
+        'error-rate': sum(counts['errors'].values())/float(max(counts['requests'],1)),
+        'requests-per-second': counts['requests']/seconds,
+        'points-per-second': counts['points']/seconds,
+        'service-ms': dict( ('p'+str(p), 1000*percentile(service,p)) for p in (50,90,99,100) ),
+        'scheduled-ms': dict( ('p'+str(p), 1000*percentile(scheduled,p)) for p in (50,90,99,100) )
+    }
+    
+def report(summary):
+    print('%7.1fs %8d req %9.1f req/s %10.1f pt/s %6.2f%% err  service p50 %7.1f p99 %7.1f ms  scheduled p50 %7.1f p99 %7.1f ms' % (
+        summary['seconds'], summary['requests'], summary['requests-per-second'], summary['points-per-second'],
+        100*summary['error-rate'], summary['service-ms']['p50'], summary['service-ms']['p99'],
+        summary['scheduled-ms']['p50'], summary['scheduled-ms']['p99'] ))
+    sys.stdout.flush()
+    
+def objectId(o):
+    return args.prefix+'-'+str(o)
+    
+def streamType(s):
+    return types[s % len(types)]
+    
+'''
+Create the objects and streams of the devices.
+'''
+def setup():
+    connection = Connection()
+    for o in range(args.objects):
+        object_path = network_path+'/objects/'+objectId(o)
+        connection.request('PUT',object_path,{'object-name': objectId(o)})
+        for s in range(args.streams):
+            connection.request('PUT',object_path+'/streams/s'+str(s),
+                {'stream-name': 's'+str(s), 'points-type': streamType(s)})
+                
+'''
+Return the requests of a device for one period: (method, path, params,
+body, points).
+'''
+def deviceRequests(o,now):
+    object_path = network_path+'/objects/'+objectId(o)
+    if args.batch == 1:
+        at = now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        return [
+            ('POST', object_path+'/streams/s'+str(s)+'/points',
+                {'points-value': randomValue(streamType(s)), 'points-at': at}, None, 1)
+            for s in range(args.streams)
+        ]
+    streams = {}
+    for s in range(args.streams):
+        streams['s'+str(s)] = {
+            'stream-id': 's'+str(s),
+            'points': [ {
+                'at': (now - datetime.timedelta(seconds=(args.batch-1-i)/args.rate)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                'value': randomValue(streamType(s))
+            } for i in range(args.batch) ]
+        }
+    body = {
+        'network-id': args.network_id,
+        'objects': { objectId(o): {'object-id': objectId(o), 'streams': streams} }
+    }
+    return [ ('POST', network_path+'/bulk', {'request-type': 'update'}, body, args.batch*args.streams) ]
+    
+'''
+Send the requests of the queue, until None.
+'''
+def worker(jobs,results):
+    connection = Connection()
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        scheduled_at, method, path, params, body, points = job
+        sent_at = time.time()
+        status, data = connection.request(method,path,params,body)
+        done_at = time.time()
+        error = None
+        if status is None:
+            error = 'connection'
+        elif status != 200:
+            error = str(status)
+        else:
+            try:
+                response = json.loads(data)
+                code = response.get('bulk-code',response.get('points-code'))
+                if code != 200:
+                    error = 'code-'+str(code)
+            except ValueError:
+                error = 'invalid-response'
+        results.add(points,error,done_at-sent_at,done_at-scheduled_at)
+
+if __name__ == '__main__':
+    if not args.no_setup:
+        print('Creating '+str(args.objects)+' objects with '+str(args.streams)+' streams')
+        setup()
+        
+    period = args.batch/args.rate
+    target = args.objects*args.streams*args.rate
+    print('Sending '+str(target)+' points/s from '+str(args.objects)+' devices for '+
+        str(args.duration)+'s over '+str(args.connections)+' connections')
+    print('')
+    
+    results = Results()
+    jobs = Queue.Queue()
+    workers = [ threading.Thread(target=worker,args=(jobs,results)) for i in range(args.connections) ]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+        
+    # Devices start at random offsets within the first period
+    start = time.time()
+    schedule = [ (start + random.uniform(0,period), o) for o in range(args.objects) ]
+    heapq.heapify(schedule)
+    end = start + args.duration
+    next_report = start + args.report
+    last_report = start
+    try:
+        while True:
+            at, o = schedule[0]
+            now = time.time()
+            if now >= next_report:
+                report( summarize(results.takeInterval(),now-last_report) )
+                last_report = now
+                next_report += args.report
+            if at >= end:
+                break
+            if at > now:
+                time.sleep( min(at-now,next_report-now,0.05) )
+                continue
+            heapq.heapreplace(schedule,(at+period,o))
+            for request in deviceRequests(o,datetime.datetime.utcnow()):
+                jobs.put( (at,) + request )
+    except KeyboardInterrupt:
+        end = time.time()
+        
+    for thread in workers:
+        jobs.put(None)
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+    
+    print('')
+    summary = summarize(results.total,elapsed)
+    summary['target-points-per-second'] = target
+    summary['options'] = vars(args)
+    report(summary)
+    if len(summary['errors']) > 0:
+        print('Errors: '+json.dumps(summary['errors'],sort_keys=True))
+    if args.output is not None:
+        with open(args.output,'wb') as f:
+            json.dump(summary,f,indent=2,sort_keys=True)
+        print('Results written to '+args.output)
@@ -26,11 +26,16 @@
 
 """
  The program below provides checks for the Wallflower.Pico API endpoints
- and common errors.
+ and common errors, and for the storage of points: compressed chunks, 
+ sealed points, and segment streams. Run it from the repository folder.
 """
 
 import requests
 import json
+import math
+import struct
+import uuid
+from base.wallflower_compression import encodeChunk, decodeChunk
 
 base = 'http://127.0.0.1:5000'
 network_id = 'local'
@@ -966,3 +971,567 @@ if resp[0] == "oc" and resp[1] == "200":
 else:
     print('Delete test object: error')
     print(response.text)
+
+
+print('')
+print("Storage Tests")
+print('')
+
+# Compressed chunks of cold storage must return the points unchanged
+timestamps = [0, 1, 2, 1000000, 1000001]
+floats = [float('nan'), -0.0, 1.5, float('inf'), -1e308]
+timestamps_out, columns = decodeChunk( encodeChunk(float,timestamps,[floats]) )
+if timestamps_out == timestamps and math.isnan(columns[0][0]) and \
+    columns[0][1] == 0.0 and math.copysign(1.0,columns[0][1]) == -1.0 and \
+    columns[0][2:] == floats[2:]:
+    print('Compress float points: ok')
+else:
+    print('Compress float points: error')
+    print(columns)
+
+integers = [2**63-1, -2**63, 0, -1, 2**63-1]
+timestamps_out, columns = decodeChunk( encodeChunk(int,timestamps,[integers]) )
+if timestamps_out == timestamps and columns[0] == integers:
+    print('Compress 64-bit integer points: ok')
+else:
+    print('Compress 64-bit integer points: error')
+    print(columns)
+
+strings = [u'caf\xe9', u'\u2603', u'', u'\U0001f600', u'a,b\nc']
+timestamps_out, columns = decodeChunk( encodeChunk(basestring,timestamps,[strings]) )
+if timestamps_out == timestamps and columns[0] == strings:
+    print('Compress unicode string points: ok')
+else:
+    print('Compress unicode string points: error')
+    print(columns)
+
+query = {
+    'object-name': 'Test Object'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object'
+response = requests.request('PUT', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['object-code'] == 201:
+    print('Create test object: ok')
+else:
+    print('Create test object: error')
+    print(response.text)
+
+query = {
+    'stream-name': 'Test Stream',
+    'points-type': 'f' # 'i', 'f', or 's'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream'
+response = requests.request('PUT', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['stream-code'] == 201:
+    print('Create test stream: ok')
+else:
+    print('Create test stream: error')
+    print(response.text)
+
+points_ok = True
+for i in range(1,6):
+    query = {
+        'points-value': i*1.5,
+        'points-at': '2016-01-01T00:00:0'+str(i)+'.000000Z'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+    response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] != 200:
+        points_ok = False
+if points_ok:
+    print('Update test stream points: ok')
+else:
+    print('Update test stream points: error')
+    print(response.text)
+
+query = {
+    'points-start': '2016-01-01T00:00:00.000000Z',
+    'points-end': '2016-01-02T00:00:00.000000Z'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+points_before_seal = json.loads( response.text ).get('points')
+
+# Sealing moves the points to cold storage, where the same search
+# must return the same points
+query = {
+    'points-before': '2016-01-02T00:00:00.000000Z'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points/seal'
+response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['points-code'] == 200:
+    print('Seal test stream points: ok')
+    
+    query = {
+        'points-start': '2016-01-01T00:00:00.000000Z',
+        'points-end': '2016-01-02T00:00:00.000000Z'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+    response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 200 and resp['points'] == points_before_seal and len(resp['points']) == 5:
+        print('Read sealed test stream points: ok')
+    else:
+        print('Read sealed test stream points: error')
+        print(response.text)
+    
+    query = {
+        'points-value': 9.9,
+        'points-at': '2016-01-01T00:00:02.000000Z'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+    response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 409:
+        print('Update sealed point with the same timestamp: ok')
+    else:
+        print('Update sealed point with the same timestamp: error')
+        print(response.text)
+    
+    query = {
+        'points-value': 9.9,
+        'points-at': '2016-01-01T00:00:02.000000Z',
+        'points-conflict': 'ignore'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+    response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 200 and len(resp['points']) == 0:
+        print('Update sealed point with the same timestamp, ignored: ok')
+    else:
+        print('Update sealed point with the same timestamp, ignored: error')
+        print(response.text)
+    
+    query = {
+        'points-start': '2016-01-01T00:00:00.000000Z',
+        'points-end': '2016-01-02T00:00:00.000000Z'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+    response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 200 and resp['points'] == points_before_seal:
+        print('Read sealed test stream points after duplicates: ok')
+    else:
+        print('Read sealed test stream points after duplicates: error')
+        print(response.text)
+elif resp['points-code'] == 400 and 'not enabled' in resp.get('points-error',''):
+    print('Seal test stream points: skipped, cold storage is not enabled')
+else:
+    print('Seal test stream points: error')
+    print(response.text)
+
+query = {
+    'stream-name': 'Test Segment Stream',
+    'points-type': 'f', # 'i', 'f', or 's'
+    'points-storage': 'segment'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-segment-stream'
+response = requests.request('PUT', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['stream-code'] == 201:
+    print('Create test segment stream: ok')
+    
+    points_ok = True
+    for i in range(1,4):
+        query = {
+            'points-value': i*1.5,
+            'points-at': '2016-01-01T00:00:0'+str(i)+'.000000Z'
+        }
+        endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-segment-stream/points'
+        response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+        resp = json.loads( response.text )
+        if resp['points-code'] != 200:
+            points_ok = False
+    if points_ok:
+        print('Update test segment stream points: ok')
+    else:
+        print('Update test segment stream points: error')
+        print(response.text)
+    
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-segment-stream/points'
+    response = requests.request('GET', base + endpoint, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 200 and [ point['value'] for point in resp['points'] ] == [4.5, 3.0, 1.5]:
+        print('Read test segment stream points: ok')
+    else:
+        print('Read test segment stream points: error')
+        print(response.text)
+    
+    query = {
+        'points-value': 9.9,
+        'points-at': '2016-01-01T00:00:02.000000Z'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-segment-stream/points'
+    response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 409:
+        print('Update segment point with the same timestamp: ok')
+    else:
+        print('Update segment point with the same timestamp: error')
+        print(response.text)
+    
+    query = {
+        'points-before': '2016-01-01T00:00:03.000000Z'
+    }
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-segment-stream/points'
+    response = requests.request('DELETE', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 200:
+        print('Delete test segment stream points: ok')
+    else:
+        print('Delete test segment stream points: error')
+        print(response.text)
+    
+    endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-segment-stream/points'
+    response = requests.request('GET', base + endpoint, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    if resp['points-code'] == 200 and [ point['value'] for point in resp['points'] ] == [4.5]:
+        print('Read test segment stream points after delete: ok')
+    else:
+        print('Read test segment stream points after delete: error')
+        print(response.text)
+elif resp['stream-code'] == 406 and 'not enabled' in resp.get('stream-error',''):
+    print('Create test segment stream: skipped, segment storage is not enabled')
+else:
+    print('Create test segment stream: error')
+    print(response.text)
+
+endpoint = '/networks/'+network_id+'/objects/test-object'
+response = requests.request('DELETE', base + endpoint, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['object-code'] == 200:
+    print('Delete test object: ok')
+else:
+    print('Delete test object: error')
+    print(response.text)
+
+
+print('')
+print("Feature Tests")
+print('')
+
+query = {
+    'object-name': 'Test Object'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object'
+response = requests.request('PUT', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['object-code'] == 201:
+    print('Create test object: ok')
+else:
+    print('Create test object: error')
+    print(response.text)
+
+query = {
+    'stream-name': 'Test Stream',
+    'points-type': 'f' # 'i', 'f', or 's'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream'
+response = requests.request('PUT', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['stream-code'] == 201:
+    print('Create test stream: ok')
+else:
+    print('Create test stream: error')
+    print(response.text)
+
+# Conditional GET: unchanged records answer 304, changed records 200
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream'
+response = requests.request('GET', base + endpoint, headers=header, timeout=120 )
+etag = response.headers.get('ETag')
+conditional_header = dict( header, **{'If-None-Match': etag} )
+response = requests.request('GET', base + endpoint, headers=conditional_header, timeout=120 )
+if etag is not None and response.status_code == 304:
+    print('Read unchanged test stream: ok')
+else:
+    print('Read unchanged test stream: error')
+    print(response.status_code)
+
+query = {
+    'points-value': 1.1,
+    'points-at': '2016-01-01T12:00:00.000Z'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/test-stream/points'
+response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+response = requests.request('GET', base + endpoint, headers=header, timeout=120 )
+etag = response.headers.get('ETag')
+conditional_header = dict( header, **{'If-None-Match': etag} )
+response = requests.request('GET', base + endpoint, headers=conditional_header, timeout=120 )
+if etag is not None and response.status_code == 304:
+    print('Read unchanged test points: ok')
+else:
+    print('Read unchanged test points: error')
+    print(response.status_code)
+
+query = {
+    'points-value': 2.2,
+    'points-at': '2016-01-01T12:00:01.000Z'
+}
+response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+response = requests.request('GET', base + endpoint, headers=conditional_header, timeout=120 )
+if response.status_code == 200:
+    print('Read test points after update: ok')
+else:
+    print('Read test points after update: error')
+    print(response.status_code)
+
+etag = response.headers.get('ETag')
+conditional_header = dict( header, **{'If-None-Match': etag} )
+query = {
+    'points-before': '2016-01-01T12:00:01.000Z'
+}
+response = requests.request('DELETE', base + endpoint, params=query, headers=header, timeout=120 )
+response = requests.request('GET', base + endpoint, headers=conditional_header, timeout=120 )
+if response.status_code == 200:
+    print('Read test points after delete: ok')
+else:
+    print('Read test points after delete: error')
+    print(response.status_code)
+
+# Incremental reads: only points newer than points-since are returned
+for second in [2,3]:
+    query = {
+        'points-value': float(second),
+        'points-at': '2016-01-01T12:00:0'+str(second)+'.000Z'
+    }
+    response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+query = {
+    'points-since': '2016-01-01T12:00:01.000Z'
+}
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if [ point['value'] for point in resp.get('points',[]) ] == [3.0,2.0] and \
+    resp.get('points-cursor','').startswith('2016-01-01T12:00:03'):
+    print('Read test points since cursor: ok')
+else:
+    print('Read test points since cursor: error')
+    print(response.text)
+
+query = {
+    'points-since': resp.get('points-cursor')
+}
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['points-code'] == 200 and resp.get('points') == []:
+    print('Read test points since last cursor: ok')
+else:
+    print('Read test points since last cursor: error')
+    print(response.text)
+
+# Multi-stream reads answer per stream, a missing stream does not fail the others
+query = {
+    'stream-ids': 'test-stream,missing-stream'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/points'
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+streams = resp.get('objects',{}).get('test-object',{}).get('streams',{})
+if streams.get('test-stream',{}).get('points-code') == 200 and \
+    len(streams['test-stream'].get('points',[])) == 3 and \
+    streams.get('missing-stream',{}).get('points-code') == 404:
+    print('Read points of test streams: ok')
+else:
+    print('Read points of test streams: error')
+    print(response.text)
+
+# Bulk requests run in one transaction, a failed request rolls back the batch
+bulk_header = dict( header, **{'Content-Type': 'application/json'} )
+bulk_streams = {}
+for stream_id in ['bulk-a','bulk-b']:
+    bulk_streams[stream_id] = {
+        'stream-details': {
+            'stream-name': 'Test Bulk Stream',
+            'stream-type': 'data'
+        },
+        'points-details': {
+            'points-type': 'f',
+            'points-length': 0
+        }
+    }
+query = {
+    'request-type': 'create'
+}
+data = json.dumps( {'objects': {'test-object': {'streams': bulk_streams}}} )
+endpoint = '/networks/'+network_id+'/bulk'
+response = requests.request('POST', base + endpoint, params=query, headers=bulk_header, data=data, timeout=120 )
+resp = json.loads( response.text )
+streams = resp.get('objects',{}).get('test-object',{}).get('streams',{})
+if resp['bulk-code'] == 200 and \
+    streams.get('bulk-a',{}).get('stream-code') == 201 and \
+    streams.get('bulk-b',{}).get('stream-code') == 201:
+    print('Create test streams in bulk: ok')
+else:
+    print('Create test streams in bulk: error')
+    print(response.text)
+
+query = {
+    'request-type': 'update'
+}
+data = json.dumps( {'objects': {'test-object': {'streams': {
+    'bulk-a': {'points': [{'value': 1.1, 'at': '2016-01-01T12:00:00.000Z'}]},
+    'bulk-b': {'points': [{'value': 2.2, 'at': '2016-01-01T12:00:00.000Z'}]}
+}}}} )
+response = requests.request('POST', base + endpoint, params=query, headers=bulk_header, data=data, timeout=120 )
+resp = json.loads( response.text )
+streams = resp.get('objects',{}).get('test-object',{}).get('streams',{})
+if resp['bulk-code'] == 200 and \
+    streams.get('bulk-a',{}).get('points-code') == 200 and \
+    streams.get('bulk-b',{}).get('points-code') == 200:
+    print('Update test streams in bulk: ok')
+else:
+    print('Update test streams in bulk: error')
+    print(response.text)
+
+# An invalid timestamp fails the batch before it runs, the other stream answers 424
+data = json.dumps( {'objects': {'test-object': {'streams': {
+    'bulk-a': {'points': [{'value': 3.3, 'at': '2016-01-01T12:00:01.000Z'}]},
+    'bulk-b': {'points': [{'value': 4.4, 'at': 'not-a-timestamp'}]}
+}}}} )
+response = requests.request('POST', base + endpoint, params=query, headers=bulk_header, data=data, timeout=120 )
+resp = json.loads( response.text )
+streams = resp.get('objects',{}).get('test-object',{}).get('streams',{})
+if resp['bulk-code'] == 400 and \
+    streams.get('bulk-a',{}).get('points-code') == 424 and \
+    streams.get('bulk-b',{}).get('points-code') == 400:
+    print('Update test streams in bulk with invalid point: ok')
+else:
+    print('Update test streams in bulk with invalid point: error')
+    print(response.text)
+
+# A missing stream fails the batch while it runs, the update of the other stream is rolled back
+data = json.dumps( {'objects': {'test-object': {'streams': {
+    'bulk-a': {'points': [{'value': 5.5, 'at': '2016-01-01T12:00:02.000Z'}]},
+    'missing-stream': {'points': [{'value': 6.6, 'at': '2016-01-01T12:00:02.000Z'}]}
+}}}} )
+response = requests.request('POST', base + endpoint, params=query, headers=bulk_header, data=data, timeout=120 )
+resp = json.loads( response.text )
+if resp['bulk-code'] == 400:
+    print('Update test streams in bulk with missing stream: ok')
+else:
+    print('Update test streams in bulk with missing stream: error')
+    print(response.text)
+
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/bulk-a/points'
+response = requests.request('GET', base + endpoint, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['points-code'] == 200 and \
+    [ point['value'] for point in resp['points'] ] == [1.1]:
+    print('Read test stream points after failed bulk updates: ok')
+else:
+    print('Read test stream points after failed bulk updates: error')
+    print(response.text)
+
+# Binary points: fixed-size little-endian records round-trip unchanged
+query = {
+    'response-type': 'binary'
+}
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/bulk-b/points'
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+points_format = str( response.headers.get('X-Points-Format','<qd') )
+records = [ (1451649601000000, 1.5), (1451649602000000, -2.25) ]
+data = ''.join( [ struct.pack(points_format,*record) for record in records ] )
+binary_header = dict( header, **{'Content-Type': 'application/octet-stream'} )
+response = requests.request('POST', base + endpoint, headers=binary_header, data=data, timeout=120 )
+resp = json.loads( response.text )
+if resp['points-code'] == 200:
+    print('Update test stream binary points: ok')
+else:
+    print('Update test stream binary points: error')
+    print(response.text)
+
+query = {
+    'response-type': 'binary',
+    'points-start': '2016-01-01T12:00:01.000Z'
+}
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+size = struct.calcsize(points_format)
+records_out = [ struct.unpack(points_format,response.content[i:i+size])
+    for i in range(0,len(response.content),size) ]
+if response.status_code == 200 and sorted(records_out) == records:
+    print('Read test stream binary points: ok')
+else:
+    print('Read test stream binary points: error')
+    print(records_out)
+
+# Points with an existing timestamp are rejected, ignored, or overwritten
+endpoint = '/networks/'+network_id+'/objects/test-object/streams/bulk-a/points'
+conflict_checks = [
+    ('reject', 9.9, 409, 1.1),
+    ('ignore', 9.9, 200, 1.1),
+    ('overwrite', 7.7, 200, 7.7),
+    ('bogus', 8.8, 400, 7.7)
+]
+for points_conflict, value, code, value_out in conflict_checks:
+    query = {
+        'points-value': value,
+        'points-at': '2016-01-01T12:00:00.000Z',
+        'points-conflict': points_conflict
+    }
+    response = requests.request('POST', base + endpoint, params=query, headers=header, timeout=120 )
+    resp = json.loads( response.text )
+    query = {
+        'points-end': '2016-01-01T12:00:00.000Z'
+    }
+    response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+    points = json.loads( response.text ).get('points',[])
+    if resp['points-code'] == code and \
+        [ point['value'] for point in points ] == [value_out]:
+        print('Update test stream points with '+points_conflict+' conflict: ok')
+    else:
+        print('Update test stream points with '+points_conflict+' conflict: error')
+        print(json.dumps(resp))
+
+# A retried request with the same Idempotency-Key replays the first response
+idempotency_header = dict( header, **{'Idempotency-Key': uuid.uuid4().hex} )
+query = {
+    'points-value': 3.3,
+    'points-at': '2016-01-01T12:00:03.000Z'
+}
+response = requests.request('POST', base + endpoint, params=query, headers=idempotency_header, timeout=120 )
+first_text = response.text
+response = requests.request('POST', base + endpoint, params=query, headers=idempotency_header, timeout=120 )
+resp = json.loads( response.text )
+if resp['points-code'] == 200 and response.text == first_text and \
+    response.headers.get('Idempotent-Replayed') == 'true':
+    print('Repeat test stream points update: ok')
+else:
+    print('Repeat test stream points update: error')
+    print(response.text)
+
+query = {
+    'points-value': 4.4,
+    'points-at': '2016-01-01T12:00:04.000Z'
+}
+response = requests.request('POST', base + endpoint, params=query, headers=idempotency_header, timeout=120 )
+resp = json.loads( response.text )
+if resp.get('server-code') == 422:
+    print('Reuse idempotency key for other points update: ok')
+else:
+    print('Reuse idempotency key for other points update: error')
+    print(response.text)
+
+query = {
+    'points-start': '2016-01-01T12:00:03.000Z'
+}
+response = requests.request('GET', base + endpoint, params=query, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['points-code'] == 200 and \
+    [ point['value'] for point in resp['points'] ] == [3.3]:
+    print('Read test stream points after repeated updates: ok')
+else:
+    print('Read test stream points after repeated updates: error')
+    print(response.text)
+
+# Remove the feature test object
+endpoint = '/networks/'+network_id+'/objects/test-object'
+response = requests.request('DELETE', base + endpoint, headers=header, timeout=120 )
+resp = json.loads( response.text )
+if resp['object-code'] == 200:
+    print('Delete test object: ok')
+else:
+    print('Delete test object: error')
+    print(response.text)